@@ -0,0 +1,396 @@
+"""Deleting accounts: a tombstone now, the rows in the background.
+
+Deleting an account used to be one `db.session.delete(user)`. The ORM loaded
+every message, like and follow of the account, deleted them row by row in a
+single transaction and held their locks throughout: seconds, for a big
+account. Now `tombstone(user)` just sets `User.deleted_at` and queues an
+`AccountPurge`. From then on the user can't log in, and their profile and
+messages 404 and drop out of user lists and search.
+
+`purge(user_id)` deletes the rest in STAGES. Each stage runs in batches of
+at most ACCOUNT_PURGE_BATCH_SIZE rows. A batch picks the next rows on an
+index, takes back what they added to other rows' counters, deletes them,
+and commits along with the purge's progress. Timeline entries go first,
+so the account's messages leave other people's homes soonest. The users
+row goes last, and takes with it (foreign keys cascade) anything added in
+the meantime. A batch only ever deletes rows that are still there, so
+after a crash a purge picks up where it stopped: `flask purge-accounts`
+finishes every unfinished purge, and `flask purge-status` shows where each
+one is.
+
+With ACCOUNT_PURGE_THREAD set, each process also runs queued purges on a
+background thread, started by its first deletion. The thread checks for
+unfinished purges every ACCOUNT_PURGE_INTERVAL seconds, so it finishes
+those interrupted elsewhere.
+
+NB: the `follows` columns are named from the other side of the
+relationship: a row (followee_id=F, follower_id=T) means user F follows
+user T (see timeline.py).
+"""
+
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+
+import click
+from flask import current_app
+from sqlalchemy import bindparam, literal_column, select, tuple_
+
+from models import (
+    db,
+    AccountPurge,
+    FollowersFollowee,
+    FollowEvent,
+    Like,
+    Message,
+    Suggestion,
+    TimelineEntry,
+    TrendingScore,
+    User,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_INTERVAL = 60
+
+users = User.__table__
+messages = Message.__table__
+likes = Like.__table__
+follows = FollowersFollowee.__table__
+follow_events = FollowEvent.__table__
+timelines = TimelineEntry.__table__
+suggestions = Suggestion.__table__
+trending = TrendingScore.__table__
+
+
+def _take(table, where, limit, *columns):
+    """Delete up to `limit` rows of `table` matching `where`.
+
+    Returns the deleted rows' `columns`. Rows are picked by primary key, or
+    by rowid on SQLite, which can't match a list of composite keys.
+    """
+
+    conn = db.session.connection()
+    key = list(table.primary_key.columns)
+    if conn.dialect.name == "sqlite":
+        key = [literal_column("rowid")]
+
+    # Labelled, since a select drops repeated columns, and `columns` are
+    # often part of the key
+    labelled = [column.label(f"key_{i}") for i, column in enumerate(key)] + [
+        column.label(f"column_{i}") for i, column in enumerate(columns)
+    ]
+    query = select(labelled).where(where).limit(limit)
+    rows = conn.execute(query).fetchall()
+    if not rows:
+        return []
+
+    if len(key) == 1:
+        picked = key[0].in_([row[0] for row in rows])
+    else:
+        picked = tuple_(*key).in_([tuple(row[: len(key)]) for row in rows])
+    conn.execute(table.delete().where(picked))
+
+    return [tuple(row[len(key):]) for row in rows]
+
+
+def _subtract(column, counts):
+    """Take `counts` ({row id: n}) off `column` of its table, in id order."""
+
+    table = column.table
+    params = [dict(row_id=row_id, n=n) for row_id, n in sorted(counts.items())]
+
+    if params:
+        db.session.connection().execute(
+            table.update()
+            .where(table.c.id == bindparam("row_id"))
+            .values({column.name: column - bindparam("n")}),
+            params,
+        )
+
+
+def _log_unfollows(pairs):
+    """Log (follower, followed) `pairs` for other processes' follow graphs."""
+
+    if pairs:
+        now = datetime.utcnow()
+        db.session.connection().execute(
+            follow_events.insert(),
+            [
+                dict(follower_id=follower, followed_id=followed, created_at=now)
+                for follower, followed in pairs
+            ],
+        )
+
+
+def purge_timelines(user_id, limit):
+    """Entries of the user's messages in others' timelines, then their own."""
+
+    rows = _take(timelines, timelines.c.author_id == user_id, limit)
+    if len(rows) < limit:
+        rows += _take(timelines, timelines.c.owner_id == user_id, limit - len(rows))
+    return len(rows)
+
+
+def purge_likes_received(user_id, limit):
+    """Likes of the user's messages (and the likers' likes counts)."""
+
+    own = select([messages.c.id]).where(messages.c.user_id == user_id)
+    rows = _take(likes, likes.c.message_id.in_(own), limit, likes.c.user_id)
+    _subtract(users.c.likes_count, Counter(liker_id for (liker_id,) in rows))
+    return len(rows)
+
+
+def purge_messages(user_id, limit):
+    """The user's messages (now unliked and out of timelines)."""
+
+    rows = _take(messages, messages.c.user_id == user_id, limit, messages.c.id)
+    message_ids = [message_id for (message_id,) in rows]
+
+    if message_ids:
+        db.session.execute(
+            trending.delete().where(trending.c.message_id.in_(message_ids))
+        )
+    return len(rows)
+
+
+def purge_likes_given(user_id, limit):
+    """The user's likes (and the liked messages' likes counts)."""
+
+    rows = _take(likes, likes.c.user_id == user_id, limit, likes.c.message_id)
+    _subtract(messages.c.likes_count, Counter(msg_id for (msg_id,) in rows))
+    return len(rows)
+
+
+def purge_following(user_id, limit):
+    """Who the user follows (and those users' followers counts)."""
+
+    rows = _take(
+        follows, follows.c.followee_id == user_id, limit, follows.c.follower_id
+    )
+    _subtract(users.c.followers_count, Counter(followed for (followed,) in rows))
+    _log_unfollows([(user_id, followed) for (followed,) in rows])
+    return len(rows)
+
+
+def purge_followers(user_id, limit):
+    """The user's followers (and their following counts)."""
+
+    rows = _take(
+        follows, follows.c.follower_id == user_id, limit, follows.c.followee_id
+    )
+    _subtract(users.c.following_count, Counter(follower for (follower,) in rows))
+    _log_unfollows([(follower, user_id) for (follower,) in rows])
+    return len(rows)
+
+
+def purge_suggestions(user_id, limit):
+    """Who-to-follow suggestions for the user, and of them to others."""
+
+    rows = _take(suggestions, suggestions.c.user_id == user_id, limit)
+    if len(rows) < limit:
+        rows += _take(
+            suggestions, suggestions.c.suggested_id == user_id, limit - len(rows)
+        )
+    return len(rows)
+
+
+def purge_user_row(user_id, limit):
+    """The users row itself, once nothing refers to it."""
+
+    return db.session.execute(users.delete().where(users.c.id == user_id)).rowcount
+
+
+# (name, step) in order: step(user_id, limit) deletes a batch of up to
+# `limit` rows and returns how many; fewer means the stage is done.
+STAGES = [
+    ("timelines", purge_timelines),
+    ("likes received", purge_likes_received),
+    ("messages", purge_messages),
+    ("likes given", purge_likes_given),
+    ("following", purge_following),
+    ("followers", purge_followers),
+    ("suggestions", purge_suggestions),
+    ("user", purge_user_row),
+]
+
+STAGE_NAMES = [name for name, _ in STAGES]
+
+
+def tombstone(user):
+    """Mark `user`'s account deleted and queue its purge.
+
+    Runs in the session's transaction (the caller commits).
+    """
+
+    now = datetime.utcnow()
+    user.deleted_at = now
+    db.session.add(
+        AccountPurge(
+            user_id=user.id, stage=STAGE_NAMES[0], requested_at=now, updated_at=now
+        )
+    )
+
+
+def _claim(user_id, stage):
+    """Record that `user_id`'s purge is working on `stage`.
+
+    Its first write, so each batch holds the purge's row lock (on SQLite,
+    the database's) before it reads anything: two processes resuming the
+    same purge take turns rather than both uncounting the same rows.
+    Returns False if the purge is finished or gone.
+    """
+
+    result = db.session.execute(
+        AccountPurge.__table__.update()
+        .where(AccountPurge.user_id == user_id)
+        .where(AccountPurge.finished_at.is_(None))
+        .values(stage=stage, updated_at=datetime.utcnow())
+    )
+    return result.rowcount == 1
+
+
+def purge(user_id, batch_size=DEFAULT_BATCH_SIZE, echo=None):
+    """Finish purging `user_id`'s account, from the stage it's on.
+
+    Each batch commits on its own. Returns the number of rows deleted.
+    """
+
+    job = AccountPurge.query.get(user_id)
+    if job is None or job.finished_at is not None:
+        return 0
+
+    deleted = 0
+    for name, step in STAGES[STAGE_NAMES.index(job.stage):]:
+        while True:
+            if not _claim(user_id, name):
+                db.session.rollback()
+                return deleted
+
+            n = step(user_id, batch_size)
+            db.session.execute(
+                AccountPurge.__table__.update()
+                .where(AccountPurge.user_id == user_id)
+                .values(rows_deleted=AccountPurge.rows_deleted + n)
+            )
+            db.session.commit()
+            deleted += n
+
+            if n < batch_size:
+                break
+
+        if echo:
+            echo(f"Purged {name} of user {user_id}: {deleted} rows so far")
+
+    AccountPurge.query.filter_by(user_id=user_id).update(
+        {AccountPurge.finished_at: datetime.utcnow()}, synchronize_session=False
+    )
+    db.session.commit()
+    return deleted
+
+
+def unfinished():
+    """Ids of the accounts waiting to be purged, oldest deletion first."""
+
+    rows = (
+        db.session.query(AccountPurge.user_id)
+        .filter(AccountPurge.finished_at.is_(None))
+        .order_by(AccountPurge.requested_at, AccountPurge.user_id)
+    )
+    return [user_id for (user_id,) in rows]
+
+
+def purge_all(batch_size=DEFAULT_BATCH_SIZE, echo=None):
+    """Finish every unfinished purge; return how many there were."""
+
+    user_ids = unfinished()
+    for user_id in user_ids:
+        purge(user_id, batch_size=batch_size, echo=echo)
+    return len(user_ids)
+
+
+_wakeup = threading.Event()
+_purger = None
+_purger_lock = threading.Lock()
+
+
+def _purge_forever(app):
+    interval = app.config.get("ACCOUNT_PURGE_INTERVAL", DEFAULT_INTERVAL)
+    batch_size = app.config.get("ACCOUNT_PURGE_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+
+    while True:
+        with app.app_context():
+            try:
+                purge_all(batch_size=batch_size)
+            except Exception:
+                logger.exception("Purging deleted accounts failed")
+            finally:
+                db.session.remove()
+
+        _wakeup.wait(interval)
+        _wakeup.clear()
+
+
+def _start_purger(app):
+    """Start this process's purge thread, if it isn't running yet.
+
+    Started on first use rather than at import, so it runs in each worker
+    process rather than a pre-fork parent.
+    """
+
+    global _purger
+
+    with _purger_lock:
+        if _purger is None:
+            _purger = threading.Thread(
+                target=_purge_forever, args=(app,), name="account-purger", daemon=True
+            )
+            _purger.start()
+
+
+def purge_soon():
+    """Have this process's purge thread, if it runs one, purge now."""
+
+    if current_app.config.get("ACCOUNT_PURGE_THREAD"):
+        _start_purger(current_app._get_current_object())
+        _wakeup.set()
+
+
+def status():
+    """[AccountPurge] of unfinished purges, then the latest finished ones."""
+
+    pending = AccountPurge.query.filter(AccountPurge.finished_at.is_(None))
+    finished = (
+        AccountPurge.query.filter(AccountPurge.finished_at.isnot(None))
+        .order_by(AccountPurge.finished_at.desc())
+        .limit(10)
+    )
+    return pending.order_by(AccountPurge.requested_at).all() + finished.all()
+
+
+def init_app(app):
+    """Register the purge CLI commands on `app`."""
+
+    @app.cli.command("purge-accounts")
+    @click.option("--batch-size", type=int)
+    def purge_accounts_command(batch_size):
+        """Finish purging deleted accounts (resuming interrupted purges)."""
+
+        batch_size = batch_size or app.config.get(
+            "ACCOUNT_PURGE_BATCH_SIZE", DEFAULT_BATCH_SIZE
+        )
+        count = purge_all(batch_size=batch_size, echo=click.echo)
+        click.echo(f"Purged {count} accounts")
+
+    @app.cli.command("purge-status")
+    def purge_status_command():
+        """Show the progress of account purges."""
+
+        for job in status():
+            if job.finished_at:
+                state = f"finished at {job.finished_at:%Y-%m-%d %H:%M:%S}"
+            else:
+                state = f"on {job.stage}, at {job.updated_at:%Y-%m-%d %H:%M:%S}"
+            click.echo(f"user {job.user_id}: {job.rows_deleted} rows deleted, {state}")
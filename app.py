@@ -1,417 +1,276 @@
-import os
-
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.sql.expression import Tuple
-from sqlalchemy import and_
-from forms import UserAddForm, LoginForm, MessageForm, EditUserForm
-from models import db, connect_db, User, Message, Like
-
-CURR_USER_KEY = "curr_user"
-
-app = Flask(__name__)
-
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
-    "DATABASE_URL", "postgres:///warbler"
-)
-
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_ECHO"] = False
-app.config["DEBUG_TB_INTERCEPT_REDIRECTS"] = True
-app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "it's a secret")
-toolbar = DebugToolbarExtension(app)
-
-connect_db(app)
-db.create_all()
-
-
-##############################################################################
-# User signup/login/logout
-
-
-@app.before_request
-def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
-
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
-
-    else:
-        g.user = None
-
-
-def do_login(user):
-    """Log in user."""
-
-    session[CURR_USER_KEY] = user.id
-
-
-def do_logout():
-    """Logout user."""
-
-    if CURR_USER_KEY in session:
-        del session[CURR_USER_KEY]
-
-
-@app.route("/signup", methods=["GET", "POST"])
-def signup():
-    """Handle user signup.
-
-    Create new user and add to DB. Redirect to home page.
-
-    If form not valid, present form.
-
-    If the there already is a user with that username: flash message
-    and re-present form.
-    """
-
-    form = UserAddForm()
-
-    if form.validate_on_submit():
-        try:
-            user = User.signup(
-                username=form.data["username"],
-                password=form.data["password"],
-                email=form.data["email"],
-                image_url=form.data["image_url"],
-            )
-            db.session.commit()
-
-        except IntegrityError as e:
-            flash("Username already taken", "danger")
-            return render_template("users/signup.html", form=form)
-
-        do_login(user)
-
-        return redirect("/")
-
-    else:
-        return render_template("users/signup.html", form=form)
-
-
-@app.route("/login", methods=["GET", "POST"])
-def login():
-    """Handle user login."""
-
-    form = LoginForm()
-
-    if form.validate_on_submit():
-        user = User.authenticate(form.data["username"], form.data["password"])
-
-        if user:
-            do_login(user)
-            flash(f"Hello, {user.username}!", "success")
-            return redirect("/")
-
-        flash("Invalid credentials.", "danger")
-
-    return render_template("users/login.html", form=form)
-
-
-@app.route("/logout")
-def logout():
-    """Handle logout of user."""
-
-    do_logout()
-    flash("You have successfully logged out", "success")
-    return redirect("/login")
-
-
-##############################################################################
-# General user routes:
-
-
-@app.route("/users")
-def list_users():
-    """Page with listing of users.
-
-    Can take a 'q' param in querystring to search by that username.
-    """
-
-    search = request.args.get("q")
-
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
-
-    return render_template("users/index.html", users=users)
-
-
-@app.route("/users/<int:user_id>")
-def users_show(user_id):
-    """Show user profile."""
-
-    user = User.query.get_or_404(user_id)
-    return render_template("users/show.html", user=user)
-
-
-@app.route("/users/<int:user_id>/following")
-def show_following(user_id):
-    """Show list of people this user is following."""
-
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    user = User.query.get_or_404(user_id)
-    return render_template("users/following.html", user=user)
-
-
-@app.route("/users/<int:user_id>/followers")
-def users_followers(user_id):
-    """Show list of followers of this user."""
-
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    user = User.query.get_or_404(user_id)
-    return render_template("users/followers.html", user=user)
-
-
-@app.route("/users/follow/<int:follow_id>", methods=["POST"])
-def add_follow(follow_id):
-    """Add a follow for the currently-logged-in user."""
-
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    followee = User.query.get_or_404(follow_id)
-    g.user.following.append(followee)
-    db.session.commit()
-
-    return redirect(f"/users/{g.user.id}/following")
-
-
-@app.route("/users/stop-following/<int:follow_id>", methods=["POST"])
-def stop_following(follow_id):
-    """Have currently-logged-in-user stop following this user."""
-
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
+"""Warbler's Flask application factory.
 
-    followee = User.query.get(follow_id)
-    g.user.following.remove(followee)
-    db.session.commit()
+`create_app(config)` builds an app for one of the PROFILES. Importing this
+module is cheap: nothing is created, and the views (see views.py) and
+subsystems are only imported when an app is. The debug toolbar and
+`db.create_all()` are opt-in (the dev and test profiles), so production
+workers never change the schema; production does read the follow graph
+(see followgraph.py) and load the templates up front.
 
-    return redirect(f"/users/{g.user.id}/following")
+`app` is the app for the WARBLER_PROFILE profile (production by default),
+created on first access, for `flask run`, `gunicorn app:app` and the
+tests. With gunicorn, --preload creates it once in the master process so
+workers fork from a warm copy.
+"""
 
+import os
 
-@app.route("/users/profile", methods=["GET", "POST"])
-def profile():
-    """Update profile for current user."""
-
-    form = EditUserForm(obj=g.user)
-
-    user = User.authenticate(username=g.user.username,
-                             password=form.data["password"])
-
-    if form.validate_on_submit():
-        if g.user == user:
-            # if user:
-            g.user.username = request.form["username"]
-            g.user.email = request.form["email"]
-            g.user.image_url = request.form["image_url"]
-            g.user.header_image_url = request.form["header_image_url"]
-            g.user.bio = request.form["bio"]
-            g.user.location = request.form["location"]
-            db.session.commit()
-            return redirect(f"/users/{user.id}")
-
-        else:
-            flash("Incorrect Password", "danger")
-            return redirect("/")
-
-    # if g.user == user:
-    #     if not user:
-    #         flash("Incorrect Password", "danger")
-    #         return redirect("/")
-
-    # g.user.username = request.form["username"]
-    # g.user.email = request.form["email"]
-    # g.user.image_url = request.form["image_url"]
-    # g.user.header_image_url = request.form["header_image_url"]
-    # g.user.bio = request.form["bio"]
-    # g.user.location = request.form["location"]
-    # db.session.commit()
-    # return redirect(f"/users/{user.id}")
-
-    #     else:
-    #         flash("Incorrect Password", "danger")
-    #         return redirect("/")
-
-    return render_template("/users/edit.html", user=user, form=form, user_id=g.user.id)
-
-
-@app.route("/users/delete", methods=["POST"])
-def delete_user():
-    """Delete user."""
-
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    do_logout()
-
-    db.session.delete(g.user)
-    db.session.commit()
-
-    return redirect("/signup")
-
-
-##############################################################################
-# Messages routes:
-
-
-@app.route("/messages/new", methods=["GET", "POST"])
-def messages_add():
-    """Add a message:
-
-    Show form if GET. If valid, update message and redirect to user page.
-    """
-
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    form = MessageForm()
-
-    if form.validate_on_submit():
-        msg = Message(text=form.data["text"])
-        g.user.messages.append(msg)
-        db.session.commit()
-
-        return redirect(f"/users/{g.user.id}")
-
-    return render_template("messages/new.html", form=form)
-
-
-@app.route("/messages/<int:message_id>", methods=["GET"])
-def messages_show(message_id):
-    """Show a message."""
-
-    msg = Message.query.get(message_id)
-    return render_template("messages/show.html", message=msg)
-
-
-@app.route("/messages/<int:message_id>/delete", methods=["POST"])
-def messages_destroy(message_id):
-    """Delete a message."""
-
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    msg = Message.query.get(message_id)
-    db.session.delete(msg)
-    db.session.commit()
-
-    return redirect(f"/users/{g.user.id}")
-
-
-#########################################
-# Likes
-
-
-# @app.route("/likes/<int:message_id>", method=["POST"])
-# def like_or_unlike_a_message(message_id):
-#     return_to = request.form["return_to"]
-#     ....
-#     return redirect(return_to)
-
-
-@app.route("/like/<int:message_id>", methods=["POST"])
-def like_message(message_id):
-    """adds a like to database and redirects back to previous page"""
-
-    print("in like function")
-    message = Message.query.get(message_id)
-
-    message.like(g.user)
-
-    return_to = request.form["return_to"]
-
-    return redirect(return_to)
-
-
-@app.route("/unlike/<int:message_id>", methods=["POST"])
-def unlike_message(message_id):
-    """Deletes a like from the database and redirects back to previous page"""
-
-    message = Message.query.get(message_id)
-
-    message.unlike(g.user)
-
-    return_to = request.form["return_to"]
-
-    return redirect(return_to)
-
-
-@app.route("/users/<int:user_id>/likes", methods=["GET", "POST"])
-def show_liked_messages(user_id):
-    """Show all of the liked messages"""
-
-    user = g.user
-
-    return render_template("/users/likes.html", user=user)
-
-
-##############################################################################
-# Homepage and error pages
-
+from flask import Flask
 
-@app.route("/")
-def homepage():
-    """Show homepage:
+CURR_USER_KEY = "curr_user"
 
-    - anon users: no messages
-    - logged in: 100 most recent messages of followees
+# Settings of each profile, applied over those read from the environment
+PROFILES = {
+    "production": dict(
+        DEBUG_TB_ENABLED=False,
+        CREATE_SCHEMA=False,
+        TEMPLATES_AUTO_RELOAD=False,
+        TEMPLATE_PRELOAD=True,
+        FOLLOW_GRAPH_PRELOAD=True,
+    ),
+    "dev": dict(
+        DEBUG=True,
+        DEBUG_TB_ENABLED=True,
+        CREATE_SCHEMA=True,
+        TEMPLATES_AUTO_RELOAD=True,
+    ),
+    "test": dict(
+        TESTING=True,
+        DEBUG_TB_ENABLED=False,
+        CREATE_SCHEMA=True,
+        WTF_CSRF_ENABLED=False,
+        QUERY_BUDGET_ENFORCE=True,
+        ACCOUNT_PURGE_THREAD=False,
+    ),
+}
+
+DEFAULT_PROFILE = "production"
+
+
+def create_app(config=None, **settings):
+    """Create and set up a Warbler app.
+
+    `config` names a profile in PROFILES (by default the WARBLER_PROFILE
+    environment variable, else production). Keyword arguments override
+    individual settings.
     """
 
-    if g.user:
-        following_ids = [f.id for f in g.user.following] + [g.user.id]
-
-        messages = (
-            Message.query.filter(Message.user_id.in_(following_ids))
-            .order_by(Message.timestamp.desc())
-            .limit(100)
-            .all()
+    import accounts
+    import assets
+    import counters
+    import followgraph
+    import fragcache
+    import httpcache
+    import imageproxy
+    import indexes
+    import likes
+    import pagination
+    import passwords
+    import querystats
+    import recommend
+    import replicas
+    import schema
+    import search
+    import templatecache
+    import timeline
+    import trending
+    import usercache
+    import views
+    from models import db, connect_db
+
+    profile = config or os.environ.get("WARBLER_PROFILE", DEFAULT_PROFILE)
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile {profile!r}")
+
+    app = Flask(__name__)
+
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+        "DATABASE_URL", "postgres:///warbler"
+    )
+
+    # Comma-separated replica URLs; read-only pages read from them (see replicas.py)
+    app.config["SQLALCHEMY_BINDS"] = {
+        f"{replicas.REPLICA_PREFIX}{n}": url
+        for n, url in enumerate(
+            url for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url
         )
-        like_ids = [like.message_id for like in g.user.likes]
-
-        return render_template("home.html", messages=messages, like_ids=like_ids)
-
-    else:
-        return render_template("home-anon.html")
-
-
-@app.errorhandler(404)
-def page_not_found(e):
-    """404 NOT FOUND page."""
-
-    return render_template("404.html"), 404
-
-
-##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers["Cache-Control"] = "public, max-age=0"
-    return req
+    }
+    app.config["REPLICA_STICKY_SECONDS"] = float(
+        os.environ.get("REPLICA_STICKY_SECONDS", replicas.DEFAULT_STICKY_SECONDS)
+    )
+    # Connection pools, per engine and process; statement timeout in ms (0: none)
+    app.config["DB_POOL_SIZE"] = int(
+        os.environ.get("DB_POOL_SIZE", replicas.DEFAULT_POOL_SIZE)
+    )
+    app.config["DB_MAX_OVERFLOW"] = int(
+        os.environ.get("DB_MAX_OVERFLOW", replicas.DEFAULT_MAX_OVERFLOW)
+    )
+    app.config["DB_POOL_TIMEOUT"] = int(
+        os.environ.get("DB_POOL_TIMEOUT", replicas.DEFAULT_POOL_TIMEOUT)
+    )
+    app.config["DB_POOL_RECYCLE"] = int(
+        os.environ.get("DB_POOL_RECYCLE", replicas.DEFAULT_POOL_RECYCLE)
+    )
+    app.config["DB_POOL_PRE_PING"] = os.environ.get("DB_POOL_PRE_PING", "1") == "1"
+    app.config["DB_STATEMENT_TIMEOUT"] = int(os.environ.get("DB_STATEMENT_TIMEOUT", 0))
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ECHO"] = False
+    app.config["DEBUG_TB_INTERCEPT_REDIRECTS"] = True
+    app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "it's a secret")
+    app.config["TIMELINE_FANOUT_LIMIT"] = int(
+        os.environ.get("TIMELINE_FANOUT_LIMIT", timeline.DEFAULT_FANOUT_LIMIT)
+    )
+    # "auto" uses pg_trgm on Postgres and an in-process n-gram index elsewhere
+    app.config["SEARCH_BACKEND"] = os.environ.get("SEARCH_BACKEND", "auto")
+    app.config["SEARCH_LIMIT"] = search.DEFAULT_LIMIT
+    app.config["FOLLOW_GRAPH_ENABLED"] = (
+        os.environ.get("FOLLOW_GRAPH_ENABLED", "1") == "1"
+    )
+    # How often each process applies the follows other processes made
+    # (seconds, 0 for never)
+    app.config["FOLLOW_GRAPH_POLL_INTERVAL"] = float(
+        os.environ.get(
+            "FOLLOW_GRAPH_POLL_INTERVAL", followgraph.DEFAULT_POLL_INTERVAL
+        )
+    )
+    # Trending: like weight half-life, messages kept in memory, and how often
+    # each process merges its likes into the `trending` table (0: never)
+    app.config["TRENDING_HALF_LIFE"] = int(
+        os.environ.get("TRENDING_HALF_LIFE", trending.DEFAULT_HALF_LIFE)
+    )
+    app.config["TRENDING_CAPACITY"] = int(
+        os.environ.get("TRENDING_CAPACITY", trending.DEFAULT_CAPACITY)
+    )
+    app.config["TRENDING_SNAPSHOT_INTERVAL"] = float(
+        os.environ.get("TRENDING_SNAPSHOT_INTERVAL", trending.DEFAULT_SNAPSHOT_INTERVAL)
+    )
+    # Who-to-follow fill-ins for users without precomputed suggestions
+    app.config["SUGGESTIONS_POPULAR_TTL"] = int(
+        os.environ.get("SUGGESTIONS_POPULAR_TTL", recommend.POPULAR_TTL)
+    )
+    app.config["BCRYPT_LOG_ROUNDS"] = int(
+        os.environ.get("BCRYPT_LOG_ROUNDS", passwords.DEFAULT_LOG_ROUNDS)
+    )
+    app.config["PASSWORD_HASH_WORKERS"] = int(
+        os.environ.get("PASSWORD_HASH_WORKERS", os.cpu_count() or 2)
+    )
+    app.config["USER_CACHE_ENABLED"] = os.environ.get("USER_CACHE_ENABLED", "1") == "1"
+    app.config["USER_CACHE_SIZE"] = int(os.environ.get("USER_CACHE_SIZE", 1024))
+    app.config["USER_CACHE_TTL"] = int(os.environ.get("USER_CACHE_TTL", 60))
+    # Fraction of requests whose SQL is measured and logged (see querystats.py)
+    app.config["QUERY_STATS_SAMPLE_RATE"] = float(
+        os.environ.get("QUERY_STATS_SAMPLE_RATE", querystats.DEFAULT_SAMPLE_RATE)
+    )
+    app.config["QUERY_BUDGET_ENFORCE"] = os.environ.get("QUERY_BUDGET_ENFORCE") == "1"
+    # Conditional GETs of database-backed pages (see httpcache.py)
+    app.config["HTTP_CACHE_ENABLED"] = os.environ.get("HTTP_CACHE_ENABLED", "1") == "1"
+    app.config["HTTP_ETAG_WINDOW"] = int(
+        os.environ.get("HTTP_ETAG_WINDOW", httpcache.DEFAULT_ETAG_WINDOW)
+    )
+    app.config["HTTP_ETAG_SALT"] = os.environ.get("RELEASE", "")
+    app.config["STATIC_MAX_AGE"] = httpcache.DEFAULT_STATIC_MAX_AGE
+    # Fingerprinted, precompressed static files ("" for none; see assets.py)
+    app.config["ASSET_BUILD_DIR"] = os.environ.get(
+        "ASSET_BUILD_DIR", os.path.join(app.root_path, ".assets")
+    )
+    # Resized users' images, fetched once from their origins ("" to link to
+    # the origins; see imageproxy.py)
+    app.config["IMAGE_CACHE_DIR"] = os.environ.get(
+        "IMAGE_CACHE_DIR", os.path.join(app.root_path, ".image-cache")
+    )
+    # What `flask prune-images` trims the cache to
+    app.config["IMAGE_CACHE_MAX_BYTES"] = int(
+        os.environ.get("IMAGE_CACHE_MAX_BYTES", imageproxy.DEFAULT_CACHE_MAX_BYTES)
+    )
+    app.config["IMAGE_FETCH_CONCURRENCY"] = int(
+        os.environ.get("IMAGE_FETCH_CONCURRENCY", imageproxy.DEFAULT_FETCH_CONCURRENCY)
+    )
+    app.config["IMAGE_FETCH_TIMEOUT"] = float(
+        os.environ.get("IMAGE_FETCH_TIMEOUT", imageproxy.DEFAULT_FETCH_TIMEOUT)
+    )
+    app.config["IMAGE_MAX_AGE"] = imageproxy.DEFAULT_MAX_AGE
+    # Compiled templates, shared by workers and kept across restarts ("" for
+    # none; see templatecache.py)
+    app.config["TEMPLATE_CACHE_DIR"] = os.environ.get(
+        "TEMPLATE_CACHE_DIR", os.path.join(app.root_path, ".template-cache")
+    )
+    # "lru", "memcached://host:port" or "none" (see fragcache.py)
+    app.config["FRAGMENT_CACHE_URL"] = os.environ.get(
+        "FRAGMENT_CACHE_URL", fragcache.DEFAULT_URL
+    )
+    app.config["FRAGMENT_CACHE_SIZE"] = int(
+        os.environ.get("FRAGMENT_CACHE_SIZE", fragcache.DEFAULT_SIZE)
+    )
+    app.config["FRAGMENT_CACHE_TTL"] = int(
+        os.environ.get("FRAGMENT_CACHE_TTL", fragcache.DEFAULT_TTL)
+    )
+    app.config["FRAGMENT_CACHE_SALT"] = os.environ.get("RELEASE", "")
+    # Buffer likes and apply them in batches (see likes.py)
+    app.config["LIKES_WRITE_BEHIND"] = os.environ.get("LIKES_WRITE_BEHIND") == "1"
+    app.config["LIKES_FLUSH_INTERVAL"] = float(
+        os.environ.get("LIKES_FLUSH_INTERVAL", likes.DEFAULT_FLUSH_INTERVAL)
+    )
+    app.config["LIKES_FLUSH_SIZE"] = int(
+        os.environ.get("LIKES_FLUSH_SIZE", likes.DEFAULT_FLUSH_SIZE)
+    )
+    # Purge deleted accounts on a thread in each process, rather than only
+    # with `flask purge-accounts` (see accounts.py)
+    app.config["ACCOUNT_PURGE_THREAD"] = (
+        os.environ.get("ACCOUNT_PURGE_THREAD", "1") == "1"
+    )
+    app.config["ACCOUNT_PURGE_BATCH_SIZE"] = int(
+        os.environ.get("ACCOUNT_PURGE_BATCH_SIZE", accounts.DEFAULT_BATCH_SIZE)
+    )
+    app.config["ACCOUNT_PURGE_INTERVAL"] = float(
+        os.environ.get("ACCOUNT_PURGE_INTERVAL", accounts.DEFAULT_INTERVAL)
+    )
+    app.config.update(PROFILES[profile])
+    app.config.update(settings)
+
+    if app.config["DEBUG_TB_ENABLED"]:
+        from flask_debugtoolbar import DebugToolbarExtension
+
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+    if app.config["CREATE_SCHEMA"]:
+        with app.app_context():
+            db.create_all()
+
+    timeline.init_app(app)
+    accounts.init_app(app)
+    assets.init_app(app)
+    counters.init_app(app)
+    followgraph.init_app(app)
+    fragcache.init_app(app)
+    httpcache.init_app(app)
+    imageproxy.init_app(app)
+    indexes.init_app(app)
+    pagination.init_app(app)
+    passwords.init_app(app)
+    querystats.init_app(app)
+    recommend.init_app(app)
+    replicas.init_app(app)
+    schema.init_app(app)
+    trending.init_app(app)
+    usercache.init_app(app)
+
+    app.register_blueprint(views.bp)
+    templatecache.init_app(app)
+
+    if app.config.get("FOLLOW_GRAPH_PRELOAD") and app.config["FOLLOW_GRAPH_ENABLED"]:
+        followgraph.preload(app)
+
+    return app
+
+
+def __getattr__(name):
+    """Create `app` on first access (PEP 562)."""
+
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    app = globals()["app"] = create_app()
+    return app
@@ -0,0 +1,243 @@
+"""Fingerprinted, precompressed static files.
+
+`flask build-assets` copies every file under static/ into ASSET_BUILD_DIR
+under a name carrying a hash of its content
+(`stylesheets/style.3b5f1c0a9e2d.css`), adds gzip and brotli variants of
+the files that compress, and writes a manifest from each file's name to
+its hashed name. Stylesheets' url() references to other static files are
+rewritten to their hashed URLs first, so changing an image changes the
+stylesheets that use it too.
+
+Templates call `asset_url("stylesheets/style.css")`. Once the assets are
+built it returns the hashed URL, under /assets/. A hashed name never
+changes content, so those responses are cached by browsers for a year
+without revalidation (`immutable`), and sent as whichever precompressed
+variant the browser accepts (`Vary: Accept-Encoding`): nothing is
+compressed per request. Without a build (say, in development),
+`asset_url` falls back to `static_url` and /static.
+
+A build leaves the files of earlier builds in place, so pages rendered
+before a deploy still find the assets they name.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import tempfile
+
+import brotli
+import click
+from flask import abort, current_app, request, send_from_directory
+
+from httpcache import DEFAULT_STATIC_MAX_AGE, static_url
+
+ASSET_URL_PATH = "/assets"
+MANIFEST = "manifest.json"
+
+# Variants by preference: (Content-Encoding, file suffix)
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+# Types worth compressing (images and fonts are compressed already)
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+    "image/vnd.microsoft.icon",
+    "image/x-icon",
+}
+
+# A variant is kept only if it's at most this fraction of the original.
+MIN_SAVING = 0.9
+
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+_manifests = {}
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def hashed_name(name, data):
+    """`name` with the hash of `data` before its extension."""
+
+    root, ext = os.path.splitext(name)
+    return f"{root}.{content_hash(data)}{ext}"
+
+
+def is_compressible(name):
+    mimetype = mimetypes.guess_type(name)[0] or ""
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES
+
+
+def compress(data):
+    """{suffix: compressed data} for the variants worth keeping."""
+
+    variants = {
+        ".gz": gzip.compress(data, compresslevel=9, mtime=0),
+        ".br": brotli.compress(data, quality=11),
+    }
+    return {
+        suffix: compressed
+        for suffix, compressed in variants.items()
+        if len(compressed) <= len(data) * MIN_SAVING
+    }
+
+
+def write_file(path, data):
+    """Write `data` to `path`, which no one sees half-written."""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(temp_name, path)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+
+
+def static_names(static_folder):
+    """Names (relative, with "/") of all files under `static_folder`."""
+
+    names = []
+    for directory, _, files in os.walk(static_folder):
+        for file in files:
+            path = os.path.relpath(os.path.join(directory, file), static_folder)
+            names.append(path.replace(os.sep, "/"))
+    return sorted(names)
+
+
+def rewrite_css(css, name, manifest, static_url_path):
+    """`css` (from static file `name`) with url()s to hashed assets."""
+
+    def replace(match):
+        quote, url = match.groups()
+        if url.startswith(static_url_path + "/"):
+            target = url[len(static_url_path) + 1:]
+        elif url.startswith(("/", "#", "data:")) or "://" in url:
+            return match.group(0)
+        else:
+            target = posixpath.normpath(posixpath.join(posixpath.dirname(name), url))
+
+        target = target.split("?")[0].split("#")[0]
+        if target not in manifest:
+            return match.group(0)
+        return f"url({quote}{ASSET_URL_PATH}/{manifest[target]}{quote})"
+
+    return CSS_URL.sub(replace, css)
+
+
+def build(app):
+    """Build `app`'s static files into its ASSET_BUILD_DIR; return the manifest."""
+
+    static_folder = app.static_folder
+    build_dir = app.config["ASSET_BUILD_DIR"]
+    names = static_names(static_folder)
+
+    # stylesheets last, so their url()s can point at hashed files
+    names.sort(key=lambda name: name.endswith(".css"))
+
+    manifest = {}
+    for name in names:
+        with open(os.path.join(static_folder, name), "rb") as file:
+            data = file.read()
+
+        if name.endswith(".css"):
+            css = rewrite_css(data.decode(), name, manifest, app.static_url_path)
+            data = css.encode()
+
+        manifest[name] = hashed_name(name, data)
+        path = os.path.join(build_dir, manifest[name])
+        if os.path.exists(path):
+            continue
+
+        # variants first: once the file exists, so do they
+        if is_compressible(name):
+            for suffix, compressed in compress(data).items():
+                write_file(path + suffix, compressed)
+        write_file(path, data)
+
+    write_file(
+        os.path.join(build_dir, MANIFEST),
+        json.dumps(manifest, indent=2, sort_keys=True).encode(),
+    )
+    _manifests.pop(build_dir, None)
+    return manifest
+
+
+def get_manifest():
+    """The current app's manifest ({} if its assets aren't built)."""
+
+    build_dir = current_app.config.get("ASSET_BUILD_DIR")
+    if not build_dir:
+        return {}
+
+    if current_app.debug or build_dir not in _manifests:
+        try:
+            with open(os.path.join(build_dir, MANIFEST)) as file:
+                _manifests[build_dir] = json.load(file)
+        except OSError:
+            _manifests[build_dir] = {}
+
+    return _manifests[build_dir]
+
+
+def asset_url(filename):
+    """URL of a static file: its hashed, built asset if there is one."""
+
+    hashed = get_manifest().get(filename)
+    if hashed is None:
+        return static_url(filename)
+    return f"{ASSET_URL_PATH}/{hashed}"
+
+
+def serve_asset(filename):
+    """Send a built asset, precompressed as the browser accepts."""
+
+    build_dir = current_app.config.get("ASSET_BUILD_DIR")
+    if not build_dir or filename.endswith(tuple(s for _, s in ENCODINGS)):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    for encoding, suffix in ENCODINGS:
+        if request.accept_encodings[encoding] and os.path.isfile(
+            os.path.join(build_dir, filename + suffix)
+        ):
+            break
+    else:
+        encoding = suffix = None
+
+    resp = send_from_directory(build_dir, filename + (suffix or ""), mimetype=mimetype)
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    if is_compressible(filename):
+        resp.vary.add("Accept-Encoding")
+
+    max_age = current_app.config.get("STATIC_MAX_AGE", DEFAULT_STATIC_MAX_AGE)
+    resp.headers["Cache-Control"] = f"public, max-age={max_age}, immutable"
+    return resp
+
+
+def init_app(app):
+    """Serve built assets at /assets and add `asset_url` to templates."""
+
+    app.add_url_rule(f"{ASSET_URL_PATH}/<path:filename>", "assets", serve_asset)
+    app.add_template_global(asset_url)
+
+    @app.cli.command("build-assets")
+    def build_assets_command():
+        """Fingerprint and precompress the static files."""
+
+        if not app.config.get("ASSET_BUILD_DIR"):
+            raise click.ClickException("ASSET_BUILD_DIR isn't set")
+
+        manifest = build(app)
+        click.echo(
+            f"Built {len(manifest)} assets into {app.config['ASSET_BUILD_DIR']}"
+        )
@@ -0,0 +1,417 @@
+"""Async JSON read API, served by an ASGI app alongside the Flask app.
+
+A Flask view waiting on a slow query ties up its WSGI worker until the
+query finishes. These endpoints are coroutines instead: while one waits on
+the database the process serves others, so a few processes can hold
+thousands of open connections.
+
+    GET /api/timeline          the logged-in user's home timeline
+    GET /api/users?q=...       username search
+    GET /api/users/<id>        a profile and its newest messages
+    GET /api/messages/<id>     one message
+
+They're the pages' reads, with the same keyset `cursor` arguments, built as
+SQLAlchemy Core queries on the tables in models.py and run on an async
+driver with its own pool: asyncpg on Postgres, aiosqlite elsewhere. The pool
+is sized and timed out by the Flask app's DB_* settings (see replicas.py),
+and the Flask session cookie logs you in here too.
+
+`api` serves every other path from the Flask app (in a thread pool), so
+one ASGI server can run the whole site:
+
+    uvicorn asyncapi:api --workers 4
+"""
+
+import asyncio
+
+from itsdangerous import BadSignature
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine.url import make_url
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import replicas
+import search
+import timeline
+from app import app as flask_app, CURR_USER_KEY
+from models import User, Message, FollowersFollowee, TimelineEntry
+from pagination import PER_PAGE, PREV, build_page, decode_cursor, keyset_clauses
+
+users = User.__table__
+messages = Message.__table__
+follows = FollowersFollowee.__table__
+timelines = TimelineEntry.__table__
+
+MESSAGE_COLUMNS = [
+    messages.c.id,
+    messages.c.text,
+    messages.c.timestamp,
+    messages.c.likes_count,
+    users.c.id.label("user_id"),
+    users.c.username,
+    users.c.image_url,
+]
+
+PROFILE_COLUMNS = [
+    users.c.id,
+    users.c.username,
+    users.c.image_url,
+    users.c.header_image_url,
+    users.c.bio,
+    users.c.location,
+    users.c.messages_count,
+    users.c.following_count,
+    users.c.followers_count,
+    users.c.likes_count,
+]
+
+# What's sent of a user in search results and on messages
+USER_FIELDS = ("id", "username", "image_url")
+
+
+class SQLitePool:
+    """A fixed set of aiosqlite connections, shared through a queue."""
+
+    def __init__(self, connections):
+        self.connections = connections
+        self.idle = asyncio.Queue()
+        for connection in connections:
+            self.idle.put_nowait(connection)
+
+    @classmethod
+    async def create(cls, path, size):
+        import aiosqlite
+
+        return cls([await aiosqlite.connect(path) for _ in range(size)])
+
+    async def fetch(self, sql, *args):
+        connection = await self.idle.get()
+        try:
+            async with connection.execute(sql, args) as cursor:
+                return await cursor.fetchall()
+        finally:
+            self.idle.put_nowait(connection)
+
+    async def close(self):
+        for connection in self.connections:
+            await connection.close()
+
+
+class Database:
+    """An async connection pool for `url` that runs Core queries."""
+
+    def __init__(self, url, config):
+        self.url = make_url(url)
+        self.config = config
+        self.pool = None
+
+        self.is_postgres = self.url.get_backend_name() in ("postgresql", "postgres")
+        if self.is_postgres:
+            self.dialect = postgresql.dialect()
+        else:
+            self.dialect = sqlite.dialect(paramstyle="qmark")
+
+    async def connect(self):
+        size = self.config.get("DB_POOL_SIZE", replicas.DEFAULT_POOL_SIZE)
+        max_size = size + self.config.get(
+            "DB_MAX_OVERFLOW", replicas.DEFAULT_MAX_OVERFLOW
+        )
+
+        if not self.is_postgres:
+            self.pool = await SQLitePool.create(self.url.database, max_size)
+            return
+
+        import asyncpg
+
+        timeout = self.config.get("DB_STATEMENT_TIMEOUT", 0)
+        self.pool = await asyncpg.create_pool(
+            # asyncpg wants a plain libpq URL, without SQLAlchemy's +driver
+            "postgresql://" + str(self.url).split("://", 1)[1],
+            min_size=size,
+            max_size=max_size,
+            max_inactive_connection_lifetime=self.config.get(
+                "DB_POOL_RECYCLE", replicas.DEFAULT_POOL_RECYCLE
+            ),
+            server_settings={"statement_timeout": str(timeout)} if timeout else None,
+        )
+
+    async def disconnect(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def compile(self, query):
+        """The SQL of `query` and its positional arguments, for the driver."""
+
+        compiled = query.compile(dialect=self.dialect)
+
+        if self.is_postgres:
+            # pyformat placeholders, renumbered to asyncpg's $1, $2, ...
+            names = sorted(compiled.params)
+            sql = compiled.string % {
+                name: f"${n}" for n, name in enumerate(names, 1)
+            }
+        else:
+            sql, names = compiled.string, compiled.positiontup
+
+        args = []
+        for name in names:
+            value = compiled.params[name]
+            type_ = compiled.binds[name].type.dialect_impl(self.dialect)
+            processor = type_.bind_processor(self.dialect)
+            args.append(processor(value) if processor else value)
+
+        return sql, args
+
+    async def fetch_all(self, query):
+        """Rows of `query`, as dicts keyed by its column names."""
+
+        sql, args = self.compile(query)
+        rows = await self.pool.fetch(sql, *args)
+
+        columns = [
+            (
+                column.key,
+                column.type.dialect_impl(self.dialect).result_processor(
+                    self.dialect, None
+                ),
+            )
+            for column in query.c
+        ]
+
+        return [
+            {
+                key: processor(row[n]) if processor else row[n]
+                for n, (key, processor) in enumerate(columns)
+            }
+            for row in rows
+        ]
+
+    async def fetch_one(self, query):
+        rows = await self.fetch_all(query.limit(1))
+        return rows[0] if rows else None
+
+
+database = Database(flask_app.config["SQLALCHEMY_DATABASE_URI"], flask_app.config)
+
+
+##############################################################################
+# Queries
+
+
+def _keyset(query, columns, cursor, per_page=PER_PAGE):
+    """`query` restricted to the page past `cursor` (see `apply_keyset`)."""
+
+    condition, order = keyset_clauses(columns, cursor)
+    if condition is not None:
+        query = query.where(condition)
+    return query.order_by(*order).limit(per_page + 1)
+
+
+def message_key(row):
+    """Sort key of a message row, matching timeline.KEY_COLUMNS."""
+
+    return row["timestamp"], row["id"]
+
+
+async def home_timeline(user_id, cursor, per_page=timeline.PAGE_SIZE):
+    """A KeysetPage of message rows for `user_id`'s home timeline.
+
+    The materialized timeline and the messages of followed high-fanout
+    authors (see timeline.py) are read concurrently.
+    """
+
+    materialized = _keyset(
+        select(MESSAGE_COLUMNS)
+        .select_from(
+            timelines.join(messages, messages.c.id == timelines.c.message_id).join(
+                users, users.c.id == messages.c.user_id
+            )
+        )
+        .where(timelines.c.owner_id == user_id),
+        (timelines.c.timestamp, timelines.c.message_id),
+        cursor,
+        per_page,
+    )
+
+    # see timeline.py: followee_id holds the *follower*
+    high_fanout = select([users.c.id]).where(
+        users.c.is_high_fanout
+        & users.c.id.in_(
+            select([follows.c.follower_id]).where(follows.c.followee_id == user_id)
+        )
+    )
+    pulled = _keyset(
+        select(MESSAGE_COLUMNS)
+        .select_from(messages.join(users, users.c.id == messages.c.user_id))
+        .where(messages.c.user_id.in_(high_fanout)),
+        (messages.c.timestamp, messages.c.id),
+        cursor,
+        per_page,
+    )
+
+    rows, pulled_rows = await asyncio.gather(
+        database.fetch_all(materialized), database.fetch_all(pulled)
+    )
+
+    if pulled_rows:
+        seen = {row["id"] for row in rows}
+        rows += [row for row in pulled_rows if row["id"] not in seen]
+        rows.sort(key=message_key, reverse=cursor.direction != PREV)
+
+    return build_page(rows, message_key, cursor, per_page)
+
+
+async def profile(user_id, cursor):
+    """(profile row or None, KeysetPage of their message rows)."""
+
+    user = database.fetch_one(
+        select(PROFILE_COLUMNS).where(
+            (users.c.id == user_id) & users.c.deleted_at.is_(None)
+        )
+    )
+    newest = database.fetch_all(
+        _keyset(
+            select(MESSAGE_COLUMNS)
+            .select_from(messages.join(users, users.c.id == messages.c.user_id))
+            .where(messages.c.user_id == user_id),
+            (messages.c.timestamp, messages.c.id),
+            cursor,
+        )
+    )
+    user, rows = await asyncio.gather(user, newest)
+
+    return user, build_page(rows, message_key, cursor)
+
+
+async def message(message_id):
+    """A message row, or None."""
+
+    return await database.fetch_one(
+        select(MESSAGE_COLUMNS)
+        .select_from(messages.join(users, users.c.id == messages.c.user_id))
+        .where((messages.c.id == message_id) & users.c.deleted_at.is_(None))
+    )
+
+
+async def search_users(query, limit):
+    """User rows best matching `query` (see search.py), best first."""
+
+    query = query.strip().lower()
+    if not query:
+        return []
+
+    matches, order = search.search_terms(query, trigrams=database.is_postgres)
+    columns = [users.c[field] for field in USER_FIELDS]
+
+    return await database.fetch_all(
+        select(columns).where(matches).order_by(*order).limit(limit)
+    )
+
+
+##############################################################################
+# Endpoints
+
+
+def current_user_id(request):
+    """The id of the user the Flask session cookie logs in, or None."""
+
+    cookie = request.cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    if not cookie:
+        return None
+
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        session = serializer.loads(
+            cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds())
+        )
+    except BadSignature:
+        return None
+
+    return session.get(CURR_USER_KEY)
+
+
+def cursor_from_request(request, columns):
+    """Decode the `cursor` query-string argument, or 400 if it's bogus."""
+
+    try:
+        return decode_cursor(request.query_params.get("cursor"), columns)
+    except ValueError:
+        raise HTTPException(400, "Malformed cursor")
+
+
+def message_json(row):
+    return dict(
+        id=row["id"],
+        text=row["text"],
+        timestamp=row["timestamp"].isoformat(),
+        likes_count=row["likes_count"],
+        user=dict(
+            id=row["user_id"], username=row["username"], image_url=row["image_url"]
+        ),
+    )
+
+
+def page_json(page):
+    return dict(
+        messages=[message_json(row) for row in page],
+        next_cursor=page.next_cursor,
+        prev_cursor=page.prev_cursor,
+    )
+
+
+async def api_timeline(request):
+    user_id = current_user_id(request)
+    if user_id is None:
+        raise HTTPException(401, "Log in to see your timeline")
+
+    cursor = cursor_from_request(request, timeline.KEY_COLUMNS)
+    page = await home_timeline(user_id, cursor)
+
+    return JSONResponse(page_json(page))
+
+
+async def api_users(request):
+    limit = flask_app.config.get("SEARCH_LIMIT", search.DEFAULT_LIMIT)
+    rows = await search_users(request.query_params.get("q", ""), limit)
+
+    return JSONResponse(dict(users=rows))
+
+
+async def api_user(request):
+    cursor = cursor_from_request(request, timeline.KEY_COLUMNS)
+    user, page = await profile(request.path_params["user_id"], cursor)
+    if user is None:
+        raise HTTPException(404, "No such user")
+
+    return JSONResponse(dict(page_json(page), user=user))
+
+
+async def api_message(request):
+    row = await message(request.path_params["message_id"])
+    if row is None:
+        raise HTTPException(404, "No such message")
+
+    return JSONResponse(dict(message=message_json(row)))
+
+
+async def http_error(request, exc):
+    return JSONResponse(dict(error=exc.detail), status_code=exc.status_code)
+
+
+api = Starlette(
+    routes=[
+        Route("/api/timeline", api_timeline),
+        Route("/api/users", api_users),
+        Route("/api/users/{user_id:int}", api_user),
+        Route("/api/messages/{message_id:int}", api_message),
+        Mount("", app=WSGIMiddleware(flask_app)),
+    ]
+)
+api.add_exception_handler(HTTPException, http_error)
+api.add_event_handler("startup", database.connect)
+api.add_event_handler("shutdown", database.disconnect)
@@ -0,0 +1,6 @@
+"""Benchmark scripts for Warbler.
+
+Run them as modules from the project root, e.g.:
+
+    python -m benchmarks.timeline --db sqlite:////tmp/bench.db --users 10000
+"""
@@ -0,0 +1,132 @@
+"""Bytes a browser transfers per page view, with and without built assets.
+
+A simulated browser views each of PAGES --views times, --hours apart,
+fetching the page and the static files it links to (and those its
+stylesheets link to; a real browser fetches only those a page's elements
+use, so this is an upper bound). Like a browser, it keeps responses for
+their Cache-Control max-age and revalidates stale ones with If-None-Match
+and If-Modified-Since. It sends `Accept-Encoding: gzip, deflate, br`.
+
+  static        the app serving /static (`asset_url` without a build)
+  built         after `flask build-assets`: hashed, precompressed /assets
+
+Reports, per case, the requests for static files and their response body
+bytes, in the first view and (on average) in the later ones. The pages
+themselves are the same either way, so aren't counted.
+
+    python -m benchmarks.assets --views 10 --hours 24
+"""
+
+import gzip
+import os
+import re
+import tempfile
+from urllib.parse import urljoin
+
+import brotli
+
+from benchmarks.common import make_parser
+
+PAGES = ["/", "/login", "/signup"]
+
+LINK = re.compile(rb"""(?:href|src)="(/(?:static|assets)/[^"]+)\"""")
+CSS_URL = re.compile(rb"""url\(\s*['"]?(/(?:static|assets)/[^'")]+)""")
+
+
+class Browser:
+    """A browser cache, and the static bytes fetched through it."""
+
+    def __init__(self, client):
+        self.client = client
+        self.now = 0
+        self.cache = {}  # url -> (expires, response)
+        self.requests = self.bytes = 0
+
+    def get(self, url):
+        headers = {"Accept-Encoding": "gzip, deflate, br"}
+        cached = self.cache.get(url)
+        if cached:
+            expires, resp = cached
+            if self.now < expires:
+                return resp
+            if resp.headers.get("ETag"):
+                headers["If-None-Match"] = resp.headers["ETag"]
+            if resp.headers.get("Last-Modified"):
+                headers["If-Modified-Since"] = resp.headers["Last-Modified"]
+
+        fresh = self.client.get(url, headers=headers)
+        if url not in PAGES:
+            self.requests += 1
+            self.bytes += len(fresh.data)
+
+        if fresh.status_code == 304 and cached:
+            fresh = cached[1]
+        cache_control = fresh.cache_control
+        if not cache_control.no_store:
+            self.cache[url] = (self.now + (cache_control.max_age or 0), fresh)
+        return fresh
+
+    def view(self, page):
+        """Fetch `page` and its static files."""
+
+        html = self.get(page).data
+        for url in LINK.findall(html):
+            url = url.decode()
+            resp = self.get(url)
+            if resp.mimetype == "text/css":
+                for linked in CSS_URL.findall(self.decoded(resp)):
+                    self.get(urljoin(url, linked.decode()))
+
+    @staticmethod
+    def decoded(resp):
+        encoding = resp.headers.get("Content-Encoding")
+        if encoding == "br":
+            return brotli.decompress(resp.data)
+        if encoding == "gzip":
+            return gzip.decompress(resp.data)
+        return resp.data
+
+
+def measure(app, views, hours):
+    """[(requests, bytes)] of each view of all PAGES."""
+
+    browser = Browser(app.test_client())
+    samples = []
+    for _ in range(views):
+        requests, sent = browser.requests, browser.bytes
+        for page in PAGES:
+            browser.view(page)
+        samples.append((browser.requests - requests, browser.bytes - sent))
+        browser.now += hours * 60 * 60
+    return samples
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument("--views", type=int, default=10)
+    parser.add_argument("--hours", type=float, default=24, help="between views")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.db
+    from app import create_app
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app("production", ASSET_BUILD_DIR=directory)
+
+        for name in ("static", "built"):
+            if name == "built":
+                app.test_cli_runner().invoke(args=["build-assets"])
+
+            samples = measure(app, args.views, args.hours)
+            first, later = samples[0], samples[1:] or samples
+            later_requests = sum(n for n, _ in later) / len(later)
+            later_bytes = sum(b for _, b in later) / len(later)
+            print(
+                f"{name:<8} first view: {first[0]:3} requests "
+                f"{first[1] / 1024:8.1f}KiB   later views: {later_requests:5.1f} requests "
+                f"{later_bytes / 1024:8.1f}KiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""Async read API vs the Flask pages under many concurrent connections.
+
+Seeds a random social graph, then serves it twice, each from one process:
+the Flask app on a threaded WSGI server (a thread per connection, as in
+benchmarks.routes) and `asyncapi.api` on uvicorn. For each, --connections
+clients connect at once, each logged in as a random user, and make
+requests for --duration seconds, picking at random between the home
+timeline, a profile, a message and a search (the pages, or their /api/
+JSON equivalents). Reports requests per second, latency percentiles and
+failed requests (errors, refused connections, and anything slower than
+--timeout). The pages render HTML as well as querying, so the gap is the
+whole of what a client would see, not just the driver's.
+
+    python -m benchmarks.asyncapi --connections 1000 --duration 30
+
+The clients run in this process on one event loop; on a small machine they
+compete with the server for CPU, so compare the two servers' numbers with
+each other rather than with other benchmarks.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.common import make_parser, load_app, seed_graph, summarize
+
+# route -> (page path, API path) templates
+ROUTES = {
+    "timeline": ("/", "/api/timeline"),
+    "profile": ("/users/{user_id}", "/api/users/{user_id}"),
+    "message": ("/messages/{message_id}", "/api/messages/{message_id}"),
+    "search": ("/users?q={query}", "/api/users?q={query}"),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(port, proc, timeout=60):
+    """Wait until something listens on `port`, or `proc` exits."""
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"server exited with status {proc.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f"nothing listening on port {port}")
+
+
+def serve_flask(db_url, port):
+    """Run the Flask app on a threaded WSGI server (in a subprocess)."""
+
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    app = load_app(db_url)
+    app.config["DEBUG_TB_ENABLED"] = False
+    make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+
+
+def start_server(kind, db_url):
+    """Start the `kind` ("flask" or "async") server; return (process, port)."""
+
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=db_url)
+
+    if kind == "flask":
+        command = [sys.executable, "-m", "benchmarks.asyncapi", "--db", db_url,
+                   "--serve-flask", str(port)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "asyncapi:api", "--host",
+                   "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+
+    proc = subprocess.Popen(command, env=env)
+    wait_for(port, proc)
+    return proc, port
+
+
+class Connection:
+    """One client's HTTP/1.1 connection, reopened when the server closes it."""
+
+    def __init__(self, port, cookie):
+        self.port = port
+        self.cookie = cookie
+        self.reader = self.writer = None
+
+    async def request(self, path):
+        """GET `path`; return the status code."""
+
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                "127.0.0.1", self.port
+            )
+
+        self.writer.write(
+            f"GET {path} HTTP/1.1\r\nHost: localhost\r\n"
+            f"Cookie: {self.cookie}\r\n\r\n".encode()
+        )
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed")
+        version, status = status_line.split()[:2]
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "content-length" in headers:
+            await self.reader.readexactly(int(headers["content-length"]))
+        else:
+            await self.reader.read()
+
+        if version == b"HTTP/1.0" or headers.get("connection") == "close":
+            self.close()
+
+        return int(status)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def drive(connections, paths, duration, timeout, rng):
+    """Requests from all `connections` for `duration` seconds.
+
+    Returns ([(seconds, ok)], elapsed).
+    """
+
+    samples = []
+    start = time.perf_counter()
+    deadline = start + duration
+
+    async def client(connection):
+        while time.perf_counter() < deadline:
+            path = rng.choice(paths)()
+            began = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(connection.request(path), timeout)
+                ok = status < 400
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                connection.close()
+                ok = False
+            samples.append((time.perf_counter() - began, ok))
+
+    await asyncio.gather(*[client(connection) for connection in connections])
+    for connection in connections:
+        connection.close()
+
+    return samples, time.perf_counter() - start
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--follows", type=int, default=50, help="follows per user")
+    parser.add_argument("--messages", type=int, default=10, help="messages per user")
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=30, help="seconds per run")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds")
+    parser.add_argument("--serve-flask", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_flask:
+        return serve_flask(args.db, args.serve_flask)
+
+    # a socket per connection, on both ends
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = args.connections * 2 + 256
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+
+    app = load_app(args.db)
+    rng = random.Random(args.seed)
+
+    import counters
+    import timeline
+    from app import CURR_USER_KEY
+    from models import db, Message
+
+    with app.app_context():
+        seed_graph(args.users, args.follows, args.messages, rng)
+        counters.reconcile()
+        timeline.rebuild_all()
+        num_messages = Message.query.count()
+        db.session.remove()
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookie_name = app.config["SESSION_COOKIE_NAME"]
+
+    def cookie():
+        user_id = rng.randint(1, args.users)
+        return f"{cookie_name}={serializer.dumps({CURR_USER_KEY: user_id})}"
+
+    def path_maker(template):
+        def make():
+            return template.format(
+                user_id=rng.randint(1, args.users),
+                message_id=rng.randint(1, num_messages),
+                query=f"user{rng.randint(1, args.users)}"[: rng.randint(5, 8)],
+            )
+
+        return make
+
+    for kind, column in (("flask", 0), ("async", 1)):
+        paths = [path_maker(templates[column]) for templates in ROUTES.values()]
+        proc, port = start_server(kind, args.db)
+
+        try:
+            connections = [
+                Connection(port, cookie()) for _ in range(args.connections)
+            ]
+            samples, elapsed = asyncio.get_event_loop().run_until_complete(
+                drive(connections, paths, args.duration, args.timeout, rng)
+            )
+        finally:
+            proc.terminate()
+            proc.wait()
+
+        latencies = [seconds for seconds, ok in samples if ok]
+        failed = sum(1 for _, ok in samples if not ok)
+        stats = summarize(latencies) if latencies else dict(p50=0, p95=0, p99=0)
+
+        print(
+            f"{kind:<6} {args.connections} connections: "
+            f"{len(latencies) / elapsed:8.1f} req/s "
+            f"p50={stats['p50']:8.1f}ms p95={stats['p95']:8.1f}ms "
+            f"p99={stats['p99']:8.1f}ms failed={failed}"
+        )
+
+
+if __name__ == "__main__":
+    main()
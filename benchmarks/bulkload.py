@@ -0,0 +1,112 @@
+"""Bulk load throughput: the old whole-file bulk_insert_mappings seed vs. the
+streaming loader in bulkload.py.
+
+Writes a synthetic users/messages/follows dataset to a temporary directory
+and loads it both ways into a fresh schema.
+
+    python -m benchmarks.bulkload --users 100000
+"""
+
+import csv
+import os
+import random
+import shutil
+import tempfile
+import time
+from csv import DictReader
+from datetime import datetime, timedelta
+
+from benchmarks.common import make_parser, load_app
+
+
+def write_dataset(data_dir, num_users, follows_per_user, messages_per_user, rng):
+    """Write users.csv, messages.csv and follows.csv; return the row count."""
+
+    now = datetime.utcnow()
+    rows = 0
+
+    with open(os.path.join(data_dir, "users.csv"), "w", newline="") as file:
+        out = csv.writer(file)
+        out.writerow(["email", "username", "password"])
+        for i in range(1, num_users + 1):
+            out.writerow([f"user{i}@bench.test", f"user{i}", "x"])
+            rows += 1
+
+    with open(os.path.join(data_dir, "messages.csv"), "w", newline="") as file:
+        out = csv.writer(file)
+        out.writerow(["text", "timestamp", "user_id"])
+        for n in range(num_users * messages_per_user):
+            ts = now - timedelta(seconds=rng.randrange(0, 86400 * 365))
+            out.writerow([f"benchmark message {n}", ts, rng.randrange(1, num_users + 1)])
+            rows += 1
+
+    with open(os.path.join(data_dir, "follows.csv"), "w", newline="") as file:
+        out = csv.writer(file)
+        out.writerow(["followee_id", "follower_id"])
+        for user in range(1, num_users + 1):
+            others = rng.sample(range(1, num_users + 1), follows_per_user + 1)
+            for other in others:
+                if other != user:
+                    out.writerow([user, other])
+                    rows += 1
+
+    return rows
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--follows", type=int, default=20, help="per user")
+    parser.add_argument("--messages", type=int, default=10, help="per user")
+    args = parser.parse_args()
+
+    app = load_app(args.db)
+
+    import bulkload
+    from models import db, User, Message, FollowersFollowee
+
+    data_dir = tempfile.mkdtemp()
+
+    try:
+        total = write_dataset(
+            data_dir, args.users, args.follows, args.messages, random.Random(args.seed)
+        )
+
+        def whole_files():
+            for model, name in [
+                (User, "users"),
+                (Message, "messages"),
+                (FollowersFollowee, "follows"),
+            ]:
+                with open(os.path.join(data_dir, f"{name}.csv")) as file:
+                    rows = list(DictReader(file))
+                # (Postgres parses timestamp strings itself; SQLite can't)
+                for row in rows:
+                    if "timestamp" in row:
+                        row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+                db.session.bulk_insert_mappings(model, rows)
+            db.session.commit()
+
+        def streaming():
+            bulkload.load(data_dir)
+
+        with app.app_context():
+            for name, fn in [("whole-file seed", whole_files), ("streaming", streaming)]:
+                db.session.remove()
+                db.drop_all()
+                db.create_all()
+
+                start = time.perf_counter()
+                fn()
+                elapsed = time.perf_counter() - start
+
+                print(
+                    f"{name:<32} rows={total:<10} {elapsed:8.2f}s "
+                    f"{total / elapsed:12,.0f} rows/s"
+                )
+    finally:
+        shutil.rmtree(data_dir)
+
+
+if __name__ == "__main__":
+    main()
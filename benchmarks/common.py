@@ -0,0 +1,146 @@
+"""Shared helpers for the benchmark scripts."""
+
+import argparse
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+BATCH_SIZE = 10000
+
+
+def make_parser(description):
+    """Argument parser with the options every benchmark takes."""
+
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--db",
+        default=os.environ.get("BENCH_DATABASE_URL", "sqlite:////tmp/warbler_bench.db"),
+        help="database to (re)create and benchmark against",
+    )
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument(
+        "--repeat", type=int, default=200, help="timed iterations per case"
+    )
+    return parser
+
+
+def load_app(db_url):
+    """Import the Flask app pointed at `db_url` (must run before importing app)."""
+
+    os.environ["DATABASE_URL"] = db_url
+
+    from app import app
+
+    return app
+
+
+def seed_graph(num_users, follows_per_user, messages_per_user, rng=None):
+    """Drop/recreate the schema and bulk-load a random social graph.
+
+    Returns the list of user ids.
+    """
+
+    from models import db, User, Message, FollowersFollowee
+
+    rng = rng or random.Random(1)
+
+    db.drop_all()
+    db.create_all()
+
+    _bulk(
+        User,
+        (
+            dict(
+                id=i,
+                email=f"user{i}@bench.test",
+                username=f"user{i}",
+                password="x",
+            )
+            for i in range(1, num_users + 1)
+        ),
+    )
+
+    def follows():
+        for follower in range(1, num_users + 1):
+            k = min(follows_per_user + 1, num_users)
+            targets = rng.sample(range(1, num_users + 1), k)
+            for followee in targets:
+                if followee != follower:
+                    # see timeline.py: followee_id holds the *follower*
+                    yield dict(followee_id=follower, follower_id=followee)
+
+    _bulk(FollowersFollowee, follows())
+
+    now = datetime.utcnow()
+
+    _bulk(
+        Message,
+        (
+            dict(
+                text=f"benchmark message {n}",
+                timestamp=now - timedelta(seconds=rng.randrange(0, 86400 * 365)),
+                user_id=rng.randrange(1, num_users + 1),
+            )
+            for n in range(num_users * messages_per_user)
+        ),
+    )
+
+    db.session.commit()
+
+    return list(range(1, num_users + 1))
+
+
+def _bulk(model, rows):
+    """Insert `rows` into `model`'s table in BATCH_SIZE chunks."""
+
+    from models import db
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            db.session.bulk_insert_mappings(model, batch)
+            batch = []
+    if batch:
+        db.session.bulk_insert_mappings(model, batch)
+
+
+def timed(fn, args_iter):
+    """Call `fn(*args)` for each args tuple; return per-call seconds."""
+
+    samples = []
+    for args in args_iter:
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(samples):
+    """Return a dict of latency statistics (milliseconds) for `samples`."""
+
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return dict(
+        n=len(ordered),
+        mean=statistics.mean(ordered) * 1000,
+        p50=pct(0.50),
+        p95=pct(0.95),
+        p99=pct(0.99),
+    )
+
+
+def report(name, samples):
+    """Print one line of latency statistics for `samples`."""
+
+    stats = summarize(samples)
+    print(
+        f"{name:<32} n={stats['n']:<6} mean={stats['mean']:8.3f}ms "
+        f"p50={stats['p50']:8.3f}ms p95={stats['p95']:8.3f}ms p99={stats['p99']:8.3f}ms"
+    )
+    return stats
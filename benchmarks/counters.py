@@ -0,0 +1,84 @@
+"""Profile stats: COUNT(*) queries vs. denormalized counter columns.
+
+Seeds one "hot" account followed by --follows users, then times the four
+COUNT(*) queries the profile used to run against reading the counters, and
+a full render of the profile page.
+
+    python -m benchmarks.counters --follows 1000000
+"""
+
+from benchmarks.common import make_parser, load_app, timed, report, _bulk
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument("--follows", type=int, default=1000000)
+    parser.add_argument("--messages", type=int, default=10000)
+    args = parser.parse_args()
+
+    app = load_app(args.db)
+
+    import counters
+    from models import db, User, Message, FollowersFollowee
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        n = args.follows + 1
+        _bulk(
+            User,
+            (
+                dict(
+                    id=i, email=f"user{i}@bench.test", username=f"user{i}", password="x"
+                )
+                for i in range(1, n + 1)
+            ),
+        )
+        # user #1 is followed by everyone else (followee_id holds the follower)
+        _bulk(
+            FollowersFollowee,
+            (dict(followee_id=i, follower_id=1) for i in range(2, n + 1)),
+        )
+        _bulk(
+            Message,
+            (dict(text=f"message {i}", user_id=1) for i in range(args.messages)),
+        )
+        db.session.commit()
+        counters.reconcile()
+        print(f"Seeded user #1 with {args.follows} followers")
+
+        repeat = [(1,)] * args.repeat
+
+        def count_queries(user_id):
+            user = User.query.get(user_id)
+            return (
+                user.messages.count(),
+                user.following.count(),
+                user.followers.count(),
+                user.likes.count(),
+            )
+
+        def counter_columns(user_id):
+            db.session.expire_all()
+            user = User.query.get(user_id)
+            return (
+                user.messages_count,
+                user.following_count,
+                user.followers_count,
+                user.likes_count,
+            )
+
+        client = app.test_client()
+
+        def profile_page(user_id):
+            db.session.remove()
+            client.get(f"/users/{user_id}")
+
+        report("4x COUNT(*)", timed(count_queries, repeat))
+        report("counter columns", timed(counter_columns, repeat))
+        report("GET /users/<id> (counters)", timed(profile_page, repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Follow graph build time, memory and lookups at scale.
+
+Builds a FollowGraph straight from --edges synthetic random follows between
+--users users (no database), then reports its memory footprint and times
+single membership checks, a page's worth of batch checks and flags, and
+follows/unfollows against the built arrays.
+
+    python -m benchmarks.followgraph --users 500000 --edges 10000000
+"""
+
+import random
+import time
+
+from benchmarks.common import make_parser, timed, report
+
+
+def random_edges(num_users, num_edges, rng):
+    """About `num_edges` distinct (follower, followed) pairs, sorted."""
+
+    per_user = max(1, num_edges // num_users)
+    population = range(1, num_users + 1)
+
+    for follower in population:
+        targets = rng.sample(population, min(per_user + 1, num_users))
+        targets = [followed for followed in targets if followed != follower]
+        for followed in sorted(targets[:per_user]):
+            yield follower, followed
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument("--users", type=int, default=100000, help="users")
+    parser.add_argument("--edges", type=int, default=1000000, help="follows")
+    parser.add_argument("--page", type=int, default=20, help="cards per page")
+    args = parser.parse_args()
+
+    from followgraph import FollowGraph
+
+    rng = random.Random(args.seed)
+
+    start = time.perf_counter()
+    graph = FollowGraph(args.users + 1, random_edges(args.users, args.edges, rng))
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{len(graph):,} edges between {args.users:,} users, "
+        f"built in {elapsed:.1f}s"
+    )
+    for part, size in graph.memory_usage().items():
+        print(f"  {part:<8} {size / 2**20:10.1f} MB")
+    print()
+
+    def pairs():
+        return [
+            (rng.randint(1, args.users), rng.randint(1, args.users))
+            for _ in range(args.repeat)
+        ]
+
+    def pages():
+        return [
+            (
+                rng.randint(1, args.users),
+                [rng.randint(1, args.users) for _ in range(args.page)],
+            )
+            for _ in range(args.repeat)
+        ]
+
+    def toggle(a, b):
+        graph.add(a, b)
+        graph.remove(a, b)
+
+    report("follows(a, b)", timed(graph.follows, pairs()))
+    report(f"followed_among ({args.page})", timed(graph.followed_among, pages()))
+    report(f"flags ({args.page})", timed(graph.flags, pages()))
+    report("add + remove", timed(toggle, pairs()))
+
+
+if __name__ == "__main__":
+    main()
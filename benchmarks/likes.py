@@ -0,0 +1,89 @@
+"""Likes per second on one hot message: applied per request vs. write-behind.
+
+--workers threads, each logged in as a different user, toggle their like on
+the same message through the /like and /unlike routes. Reports throughput
+and request latency for each mode, then flushes and checks the message's
+likes_count matches its likes rows.
+
+    python -m benchmarks.likes --workers 16 --repeat 500
+"""
+
+import threading
+import time
+
+from benchmarks.common import make_parser, load_app, seed_graph, report
+
+
+def run(app, user_ids, message_id, repeat):
+    """Have each user toggle their like `repeat` times; return (latencies, elapsed)."""
+
+    from app import CURR_USER_KEY
+
+    latencies = []
+    lock = threading.Lock()
+
+    def toggle(user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        samples = []
+        for n in range(repeat):
+            path = "like" if n % 2 == 0 else "unlike"
+            start = time.perf_counter()
+            client.post(f"/{path}/{message_id}", data={"return_to": "/"})
+            samples.append(time.perf_counter() - start)
+
+        with lock:
+            latencies.extend(samples)
+
+    threads = [threading.Thread(target=toggle, args=(id,)) for id in user_ids]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument("--workers", type=int, default=8, help="concurrent likers")
+    args = parser.parse_args()
+
+    app = load_app(args.db)
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["DEBUG_TB_ENABLED"] = False
+    app.config["QUERY_STATS_SAMPLE_RATE"] = 0
+
+    import likes
+    from models import db, Message, Like
+
+    with app.app_context():
+        user_ids = seed_graph(args.workers, 0, 1)
+        message_id = Message.query.first().id
+        db.session.remove()
+
+    for mode, write_behind in [("per request", False), ("write-behind", True)]:
+        app.config["LIKES_WRITE_BEHIND"] = write_behind
+
+        latencies, elapsed = run(app, user_ids, message_id, args.repeat)
+
+        with app.app_context():
+            likes.flush()
+            msg = Message.query.get(message_id)
+            rows = Like.query.filter_by(message_id=message_id).count()
+            consistent = "ok" if msg.likes_count == rows else "MISMATCH"
+            db.session.remove()
+
+        report(mode, latencies)
+        print(
+            f"{'':<32} {len(latencies) / elapsed:10,.0f} likes/s "
+            f"likes_count={msg.likes_count} rows={rows} {consistent}"
+        )
+
+
+if __name__ == "__main__":
+    main()
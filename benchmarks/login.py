@@ -0,0 +1,47 @@
+"""Concurrent login latency: bcrypt on request threads vs. the hashing pool.
+
+    python -m benchmarks.login --threads 64 --rounds 12
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import make_parser, load_app, report
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument("--threads", type=int, default=32, help="concurrent logins")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost")
+    args = parser.parse_args()
+
+    app = load_app(args.db)
+
+    import passwords
+
+    bcrypt = passwords.get_bcrypt()
+
+    passwords.log_rounds = args.rounds
+    pw_hash = bcrypt.generate_password_hash("abc123", args.rounds).decode("UTF-8")
+
+    def direct():
+        start = time.perf_counter()
+        bcrypt.check_password_hash(pw_hash, "abc123")
+        return time.perf_counter() - start
+
+    def pooled():
+        start = time.perf_counter()
+        passwords.check_password(pw_hash, "abc123")
+        return time.perf_counter() - start
+
+    with app.app_context():
+        for name, fn in [("request-thread bcrypt", direct), ("pooled bcrypt", pooled)]:
+            with ThreadPoolExecutor(max_workers=args.threads) as clients:
+                futures = [clients.submit(fn) for _ in range(args.repeat)]
+                report(name, [f.result() for f in futures])
+
+        print(f"pool stats: {passwords.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Who-to-follow batch job throughput at scale.
+
+Builds a random follow matrix of --users users and about --edges follows
+straight in memory (no database), with followed users drawn from a Zipf-like
+distribution so some accounts are far more followed than others, then times
+scoring blocks of users with `recommend.score_blocks` across --processes
+worker processes. With --blocks, only that many blocks are scored and the
+full run's time is extrapolated from them.
+
+    python -m benchmarks.recommend --users 1000000 --edges 50000000 --blocks 10
+"""
+
+import time
+
+from benchmarks.common import make_parser
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def random_follows(num_users, num_edges, rng, skew=1.1):
+    """A CSR follow matrix with about `num_edges` follows, no self-follows."""
+
+    followers = rng.randint(0, num_users, num_edges).astype(np.int32)
+
+    # rank r is followed with weight 1 / r**skew; ranks shuffled over ids
+    weights = 1.0 / np.arange(1, num_users + 1) ** skew
+    cumulative = np.cumsum(weights / weights.sum())
+    ranks = np.searchsorted(cumulative, rng.random_sample(num_edges))
+    followed = rng.permutation(num_users).astype(np.int32)[
+        np.minimum(ranks, num_users - 1)
+    ]
+
+    keep = followers != followed
+    matrix = csr_matrix(
+        (np.ones(keep.sum(), dtype=np.int32), (followers[keep], followed[keep])),
+        shape=(num_users, num_users),
+    )
+    # duplicate pairs were summed: they're one follow
+    matrix.data[:] = 1
+    return matrix
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument("--users", type=int, default=100000, help="users")
+    parser.add_argument("--edges", type=int, default=5000000, help="follows")
+    parser.add_argument("--processes", type=int, default=1, help="workers")
+    parser.add_argument("--block-size", type=int, help="users per block")
+    parser.add_argument("--blocks", type=int, help="only time this many blocks")
+    args = parser.parse_args()
+
+    import recommend
+
+    block_size = args.block_size or recommend.BLOCK_SIZE
+    rng = np.random.RandomState(args.seed)
+
+    start = time.perf_counter()
+    matrix = random_follows(args.users, args.edges, rng)
+    print(
+        f"{matrix.nnz:,} follows between {args.users:,} users, "
+        f"generated in {time.perf_counter() - start:.1f}s"
+    )
+
+    start = time.perf_counter()
+    users = stored = 0
+    blocks = recommend.score_blocks(
+        matrix, processes=args.processes, block_size=block_size
+    )
+
+    for n, (lo, hi, suggestions) in enumerate(blocks, 1):
+        users = hi
+        stored += len(suggestions[0])
+        if n == args.blocks:
+            blocks.close()
+            break
+
+    elapsed = time.perf_counter() - start
+    rate = users / elapsed
+
+    print(
+        f"scored {users:,} users ({stored:,} suggestions) in {elapsed:.1f}s: "
+        f"{rate:,.0f} users/s with {args.processes} process(es)"
+    )
+    if users < args.users:
+        print(f"full run: about {args.users / rate:,.0f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+"""Route-level load benchmark: a realistic request mix against the whole app.
+
+Seeds a random social graph, then has --workers simulated users (each logged
+in as a different account) make --repeat requests between them, picking
+routes at random according to --mix. Requests go through the Flask test
+client, or with --driver server over HTTP to a threaded WSGI server.
+
+With --conditional, workers revalidate pages they've seen before with
+If-None-Match, as a browser would, so unchanged pages come back 304.
+
+Reports throughput, latency percentiles and SQL queries per request for
+each route, optionally writes them to --output as JSON, and with --compare
+exits non-zero if any route regressed past the thresholds against an
+earlier results file:
+
+    python -m benchmarks.routes --users 10000 --output before.json
+    git checkout my-branch
+    python -m benchmarks.routes --users 10000 --compare before.json
+"""
+
+import json
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from functools import partial
+from http.cookiejar import CookieJar
+
+from benchmarks.common import make_parser, load_app, seed_graph, summarize
+
+PASSWORD = "benchpass"
+
+DEFAULT_MIX = "home=40,profile=20,search=10,like=15,post=10,login=5"
+
+
+class ClientDriver:
+    """Makes requests through a Flask test client (in-process)."""
+
+    def __init__(self, app, conditional=False):
+        self.client = app.test_client()
+        self.etags = {} if conditional else None
+
+    def request(self, method, path, data=None):
+        """Make a request; return (status code, SQL queries it ran)."""
+
+        headers = {}
+        if self.etags is not None and path in self.etags:
+            headers["If-None-Match"] = self.etags[path]
+
+        resp = self.client.open(path, method=method, data=data, headers=headers)
+
+        if self.etags is not None and "ETag" in resp.headers:
+            self.etags[path] = resp.headers["ETag"]
+
+        return resp.status_code, int(resp.headers.get("X-Query-Count", 0))
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class ServerDriver:
+    """Makes requests over HTTP to a WSGI server, keeping session cookies."""
+
+    def __init__(self, base_url, conditional=False):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect
+        )
+        self.etags = {} if conditional else None
+
+    def request(self, method, path, data=None):
+        """Make a request; return (status code, SQL queries it ran)."""
+
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        if self.etags is not None and path in self.etags:
+            req.add_header("If-None-Match", self.etags[path])
+
+        try:
+            with self.opener.open(req) as resp:
+                resp.read()
+                status, headers = resp.status, resp.headers
+        except urllib.error.HTTPError as err:
+            # includes the redirects we deliberately don't follow, and 304s
+            status, headers = err.code, err.headers
+
+        if self.etags is not None and "ETag" in headers:
+            self.etags[path] = headers["ETag"]
+
+        return status, int(headers.get("X-Query-Count", 0))
+
+
+def start_server(app):
+    """Serve `app` from a background thread; return its base URL."""
+
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+class Worker:
+    """One simulated user: a driver logged in as `user`, and its own RNG."""
+
+    def __init__(self, driver, user, num_users, num_messages, rng):
+        self.driver = driver
+        self.user = user
+        self.num_users = num_users
+        self.num_messages = num_messages
+        self.rng = rng
+        self.liked = set()
+
+    def home(self):
+        return self.driver.request("GET", "/")
+
+    def profile(self):
+        user_id = self.rng.randint(1, self.num_users)
+        return self.driver.request("GET", f"/users/{user_id}")
+
+    def search(self):
+        query = f"user{self.rng.randint(1, self.num_users)}"[: self.rng.randint(5, 8)]
+        return self.driver.request("GET", f"/users?q={query}")
+
+    def like(self):
+        # like a random message, or unlike one this worker liked earlier
+        if self.liked and self.rng.random() < 0.3:
+            message_id = self.liked.pop()
+            path = f"/unlike/{message_id}"
+        else:
+            message_id = self.rng.randint(1, self.num_messages)
+            if message_id in self.liked:
+                return self.like()
+            self.liked.add(message_id)
+            path = f"/like/{message_id}"
+
+        return self.driver.request("POST", path, {"return_to": "/"})
+
+    def post(self):
+        text = f"benchmark post {self.rng.random()}"
+        return self.driver.request("POST", "/messages/new", {"text": text})
+
+    def login(self):
+        return self.driver.request(
+            "POST", "/login", {"username": self.user, "password": PASSWORD}
+        )
+
+
+def parse_mix(mix):
+    """Parse "route=weight,..." into ([routes], [weights])."""
+
+    pairs = [item.split("=") for item in mix.split(",")]
+    for route, _ in pairs:
+        if not hasattr(Worker, route):
+            raise SystemExit(f"Unknown route in --mix: {route}")
+    return [route for route, _ in pairs], [float(weight) for _, weight in pairs]
+
+
+def run(workers, routes, weights, requests_per_worker, rng):
+    """Run the mix on every worker at once; return (samples, elapsed).
+
+    `samples` maps route -> list of (seconds, queries, status).
+    """
+
+    samples = {route: [] for route in routes}
+    lock = threading.Lock()
+    plans = [
+        rng.choices(routes, weights, k=requests_per_worker) for _ in workers
+    ]
+
+    def drive(worker, plan):
+        for route in plan:
+            start = time.perf_counter()
+            status, queries = getattr(worker, route)()
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples[route].append((elapsed, queries, status))
+
+    threads = [
+        threading.Thread(target=drive, args=(worker, plan))
+        for worker, plan in zip(workers, plans)
+    ]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return samples, time.perf_counter() - start
+
+
+def results_for(samples, elapsed):
+    """Per-route statistics (latencies in ms) for the samples of one run."""
+
+    results = {}
+
+    for route, route_samples in samples.items():
+        if not route_samples:
+            continue
+
+        latencies = [s for s, _, _ in route_samples]
+        queries = [q for _, q, _ in route_samples]
+
+        results[route] = dict(
+            summarize(latencies),
+            throughput=len(route_samples) / elapsed,
+            queries_mean=sum(queries) / len(queries),
+            queries_max=max(queries),
+            not_modified=sum(1 for _, _, status in route_samples if status == 304),
+            errors=sum(1 for _, _, status in route_samples if status >= 400),
+        )
+
+    return results
+
+
+def compare(baseline, current, latency_threshold, query_threshold):
+    """Regressions of `current` against `baseline` results, as messages.
+
+    A route regresses if its p95 latency grew by more than
+    `latency_threshold` (a fraction), or its mean queries per request by
+    more than `query_threshold` (a count).
+    """
+
+    regressions = []
+
+    for route, stats in current["routes"].items():
+        before = baseline["routes"].get(route)
+        if not before:
+            continue
+
+        if stats["p95"] > before["p95"] * (1 + latency_threshold):
+            regressions.append(
+                f"{route}: p95 {before['p95']:.3f}ms -> {stats['p95']:.3f}ms"
+            )
+        if stats["queries_mean"] > before["queries_mean"] + query_threshold:
+            regressions.append(
+                f"{route}: queries {before['queries_mean']:.2f} -> "
+                f"{stats['queries_mean']:.2f}"
+            )
+        if stats["errors"] > before["errors"]:
+            regressions.append(
+                f"{route}: errors {before['errors']} -> {stats['errors']}"
+            )
+
+    return regressions
+
+
+def git_commit():
+    """The current commit id, if we're in a git checkout."""
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--follows", type=int, default=50, help="follows per user")
+    parser.add_argument("--messages", type=int, default=10, help="messages per user")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="route=weight,...")
+    parser.add_argument("--workers", type=int, default=1, help="concurrent users")
+    parser.add_argument("--warmup", type=int, default=20, help="requests per worker")
+    parser.add_argument("--driver", choices=["client", "server"], default="client")
+    parser.add_argument(
+        "--conditional", action="store_true", help="revalidate pages with ETags"
+    )
+    parser.add_argument(
+        "--fragment-cache", default="lru", help='"lru", "memcached://..." or "none"'
+    )
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="JSON results file to compare against")
+    parser.add_argument(
+        "--latency-threshold",
+        type=float,
+        default=0.2,
+        help="allowed p95 latency growth, as a fraction",
+    )
+    parser.add_argument(
+        "--query-threshold",
+        type=float,
+        default=0.5,
+        help="allowed growth in mean queries per request",
+    )
+    args = parser.parse_args()
+
+    routes, weights = parse_mix(args.mix)
+
+    app = load_app(args.db)
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config["DEBUG_TB_ENABLED"] = False
+    # measure every request; querystats reports counts in X-Query-Count
+    app.config["QUERY_STATS_SAMPLE_RATE"] = 1
+
+    import counters
+    import fragcache
+    import passwords
+    import timeline
+    from models import db, User, Message
+
+    passwords.log_rounds = args.rounds
+    fragcache.cache.backend = fragcache.backend_for(args.fragment_cache)
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        seed_graph(args.users, args.follows, args.messages, rng)
+        User.query.update({User.password: passwords.hash_password(PASSWORD)})
+        db.session.commit()
+        counters.reconcile()
+        timeline.rebuild_all()
+        num_messages = Message.query.count()
+        db.session.remove()
+
+    if args.driver == "server":
+        make_driver = partial(ServerDriver, start_server(app), args.conditional)
+    else:
+        make_driver = partial(ClientDriver, app, args.conditional)
+
+    workers = []
+    for n in range(args.workers):
+        username = f"user{rng.randint(1, args.users)}"
+        worker = Worker(
+            make_driver(), username, args.users, num_messages, random.Random(n)
+        )
+        worker.login()
+        workers.append(worker)
+
+    run(workers, routes, weights, args.warmup, rng)
+    fragcache.cache.hits = fragcache.cache.misses = 0
+    samples, elapsed = run(workers, routes, weights, args.repeat, rng)
+
+    results = dict(
+        meta=dict(
+            commit=git_commit(),
+            database=args.db.split(":")[0],
+            driver=args.driver,
+            conditional=args.conditional,
+            fragment_cache=args.fragment_cache,
+            python=platform.python_version(),
+            users=args.users,
+            follows=args.follows,
+            messages=args.messages,
+            mix=args.mix,
+            workers=args.workers,
+            repeat=args.repeat,
+            seed=args.seed,
+        ),
+        throughput=sum(len(s) for s in samples.values()) / elapsed,
+        routes=results_for(samples, elapsed),
+        fragment_cache=fragcache.cache.stats(),
+    )
+
+    for route, stats in results["routes"].items():
+        print(
+            f"{route:<10} n={stats['n']:<6} {stats['throughput']:8.1f} req/s "
+            f"p50={stats['p50']:8.3f}ms p95={stats['p95']:8.3f}ms "
+            f"p99={stats['p99']:8.3f}ms queries={stats['queries_mean']:5.1f} "
+            f"304s={stats['not_modified']} errors={stats['errors']}"
+        )
+    print(f"total      {results['throughput']:.1f} req/s")
+    print(f"fragment cache hit ratio {results['fragment_cache']['hit_ratio']:.1%}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+        for key in ("database", "driver", "conditional", "users", "mix", "workers"):
+            if baseline["meta"].get(key) != results["meta"][key]:
+                print(f"warning: baseline was run with a different {key}")
+
+        regressions = compare(
+            baseline, results, args.latency_threshold, args.query_threshold
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
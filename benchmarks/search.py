@@ -0,0 +1,81 @@
+"""Username search: LIKE '%q%' vs. the trigram search subsystem.
+
+    python -m benchmarks.search --users 1000000
+    python -m benchmarks.search --db postgresql:///warbler_bench --users 1000000
+"""
+
+import random
+import string
+
+from benchmarks.common import make_parser, load_app, timed, report, _bulk
+
+SYLLABLES = ["jo", "an", "mar", "ton", "li", "sa", "ke", "vin", "ra", "bel", "do"]
+
+
+def random_username(rng, i):
+    """A pronounceable-ish username, unique thanks to the numeric suffix."""
+
+    name = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+    return f"{name}{i}"
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument("--users", type=int, default=100000)
+    args = parser.parse_args()
+
+    app = load_app(args.db)
+
+    import search
+    from models import db, User
+
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        _bulk(
+            User,
+            (
+                dict(
+                    id=i,
+                    email=f"user{i}@bench.test",
+                    username=random_username(rng, i),
+                    password="x",
+                )
+                for i in range(1, args.users + 1)
+            ),
+        )
+        db.session.commit()
+        print(f"Seeded {args.users} users ({db.engine.dialect.name})")
+
+        queries = [
+            ("".join(rng.choice(SYLLABLES) for _ in range(2)),)
+            for _ in range(args.repeat)
+        ]
+        prefixes = [(q[:3],) for (q,) in queries]
+        misses = [
+            ("".join(rng.choice(string.ascii_lowercase) for _ in range(6)),)
+            for _ in range(args.repeat)
+        ]
+
+        def like_query(q):
+            return User.query.filter(User.username.like(f"%{q}%")).all()
+
+        def ranked_search(q):
+            return search.search_users(q, limit=50)
+
+        def autocomplete(q):
+            return search.autocomplete(q)
+
+        # build the in-process index (if used) outside the timings
+        ranked_search("warmup")
+
+        report("LIKE '%q%' (current)", timed(like_query, queries))
+        report("search_users", timed(ranked_search, queries))
+        report("search_users (no match)", timed(ranked_search, misses))
+        report("autocomplete", timed(autocomplete, prefixes))
+
+
+if __name__ == "__main__":
+    main()
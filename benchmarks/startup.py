@@ -0,0 +1,152 @@
+"""Worker startup: import time, cold start and forking from a preloaded app.
+
+Each case runs --repeat times in a fresh interpreter:
+
+  import        `import app` alone (creates nothing)
+  create        `create_app()` for --profile
+  first request `create_app()` and one GET of a page rendering a form,
+                as a new worker's first request would
+  dev profile   the same, with the debug toolbar and `db.create_all()`
+
+and then preloading, as gunicorn's --preload does: one process creates the
+app, then forks --workers children that each serve their first request,
+timed from the fork.
+
+    python -m benchmarks.startup --repeat 20 --workers 4
+
+With --importtime, also lists the slowest modules `create_app()` imports
+(from `python -X importtime`).
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.common import make_parser, summarize
+
+IMPORT = """
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+"""
+
+CREATE = """
+start = time.perf_counter()
+from app import create_app
+app = create_app({profile!r})
+elapsed = time.perf_counter() - start
+"""
+
+FIRST_REQUEST = """
+start = time.perf_counter()
+from app import create_app
+app = create_app({profile!r})
+app.test_client().get("/login")
+elapsed = time.perf_counter() - start
+"""
+
+PRELOAD = """
+from app import create_app
+app = create_app({profile!r})
+
+elapsed = []
+for _ in range({workers}):
+    read, write = os.pipe()
+    start = time.perf_counter()
+    if os.fork() == 0:
+        app.test_client().get("/login")
+        os.write(write, repr(time.perf_counter() - start).encode())
+        os._exit(0)
+    os.close(write)
+    elapsed.append(float(os.read(read, 64)))
+    os.close(read)
+    os.wait()
+"""
+
+
+def run(snippet, db_url, **params):
+    """Run `snippet` in a fresh interpreter; return its `elapsed`."""
+
+    code = "import os, time\n" + snippet.format(**params)
+    code += "\nprint(__import__('json').dumps(elapsed))\n"
+    env = dict(os.environ, DATABASE_URL=db_url)
+
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def report(name, samples):
+    stats = summarize(samples)
+    print(
+        f"{name:<16} n={stats['n']:<4} mean={stats['mean']:8.1f}ms "
+        f"p50={stats['p50']:8.1f}ms p95={stats['p95']:8.1f}ms"
+    )
+
+
+def slowest_imports(db_url, profile, n=15):
+    """The `n` modules with the largest cumulative import time (us)."""
+
+    env = dict(os.environ, DATABASE_URL=db_url)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         f"from app import create_app; create_app({profile!r})"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = []
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, module = line.split("|")
+            if cumulative.strip().isdigit():
+                times.append((int(cumulative), module.strip()))
+
+    return sorted(times, reverse=True)[:n]
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.set_defaults(repeat=10)
+    parser.add_argument("--profile", default="production")
+    parser.add_argument("--workers", type=int, default=4, help="preforked workers")
+    parser.add_argument(
+        "--importtime", action="store_true", help="list the slowest imports"
+    )
+    args = parser.parse_args()
+
+    # the dev profile creates the schema the requests need
+    cases = [
+        ("dev profile", FIRST_REQUEST, "dev"),
+        ("import", IMPORT, args.profile),
+        ("create", CREATE, args.profile),
+        ("first request", FIRST_REQUEST, args.profile),
+    ]
+
+    for name, snippet, profile in cases:
+        samples = [
+            run(snippet, args.db, profile=profile) for _ in range(args.repeat)
+        ]
+        report(name, samples)
+
+    samples = []
+    for _ in range(args.repeat):
+        samples += run(PRELOAD, args.db, profile=args.profile, workers=args.workers)
+    report("preload + fork", samples)
+
+    if args.importtime:
+        print()
+        for cumulative, module in slowest_imports(args.db, args.profile):
+            print(f"{cumulative / 1000:8.1f}ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""A new worker's first requests, with and without the template cache.
+
+Each case runs --repeat times in a fresh interpreter, which creates the app
+for --profile and then GETs each of PAGES once, as a newly started worker
+would. Reported separately: creating the app ("create"), and the first
+requests ("pages").
+
+  no cache      templates compiled on first use (TEMPLATE_CACHE_DIR unset)
+  bytecode      compiled templates loaded from a cache directory filled
+                beforehand by `flask compile-templates`
+  preload       the same cache, with every template loaded by
+                `create_app()` (TEMPLATE_PRELOAD) rather than by requests
+
+    python -m benchmarks.templates --repeat 20
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.common import make_parser
+from benchmarks.startup import report, run
+
+# pages that render without a logged-in user or any rows
+PAGES = ["/", "/login", "/signup"]
+
+FIRST_REQUESTS = """
+start = time.perf_counter()
+from app import create_app
+app = create_app({profile!r}, TEMPLATE_CACHE_DIR={directory!r},
+                 TEMPLATE_PRELOAD={preload!r})
+created = time.perf_counter()
+client = app.test_client()
+for page in {pages!r}:
+    client.get(page)
+elapsed = [created - start, time.perf_counter() - created]
+"""
+
+
+def compile_templates(db_url, directory):
+    """Fill `directory` as a deploy's build step would."""
+
+    env = dict(
+        os.environ,
+        DATABASE_URL=db_url,
+        FLASK_APP="app:create_app",
+        TEMPLATE_CACHE_DIR=directory,
+    )
+    subprocess.run(
+        [sys.executable, "-m", "flask", "compile-templates"],
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.set_defaults(repeat=10)
+    parser.add_argument("--profile", default="production")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        compile_templates(args.db, directory)
+
+        cases = [
+            ("no cache", "", False),
+            ("bytecode", directory, False),
+            ("preload", directory, True),
+        ]
+
+        for name, cache_dir, preload in cases:
+            samples = [
+                run(
+                    FIRST_REQUESTS,
+                    args.db,
+                    profile=args.profile,
+                    directory=cache_dir,
+                    preload=preload,
+                    pages=PAGES,
+                )
+                for _ in range(args.repeat)
+            ]
+            report(f"{name} create", [created for created, _ in samples])
+            report(f"{name} pages", [pages for _, pages in samples])
+
+
+if __name__ == "__main__":
+    main()
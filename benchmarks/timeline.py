@@ -0,0 +1,62 @@
+"""Compare the materialized home timeline with the old IN-list query.
+
+    python -m benchmarks.timeline --users 20000 --follows 200 --messages 20
+"""
+
+from benchmarks.common import make_parser, load_app, seed_graph, timed, report
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--follows", type=int, default=100, help="follows per user")
+    parser.add_argument("--messages", type=int, default=10, help="messages per user")
+    parser.add_argument(
+        "--fanout-limit",
+        type=int,
+        default=None,
+        help="TIMELINE_FANOUT_LIMIT to benchmark the hybrid mode with",
+    )
+    args = parser.parse_args()
+
+    app = load_app(args.db)
+
+    import random
+
+    import timeline
+    from models import User, Message
+
+    if args.fanout_limit is not None:
+        app.config["TIMELINE_FANOUT_LIMIT"] = args.fanout_limit
+
+    with app.app_context():
+        rng = random.Random(args.seed)
+        user_ids = seed_graph(args.users, args.follows, args.messages, rng)
+        print(f"Seeded {args.users} users; rebuilding timelines...")
+        timeline.rebuild_all()
+
+        sample = [(User.query.get(rng.choice(user_ids)),) for _ in range(args.repeat)]
+
+        def in_list_query(user):
+            following_ids = [f.id for f in user.following] + [user.id]
+            return (
+                Message.query.filter(Message.user_id.in_(following_ids))
+                .order_by(Message.timestamp.desc())
+                .limit(100)
+                .all()
+            )
+
+        def materialized(user):
+            return timeline.home_timeline(user, per_page=100)
+
+        # warm up caches for both paths before timing
+        for (user,) in sample[:10]:
+            in_list_query(user)
+            materialized(user)
+
+        report("in-list query", timed(in_list_query, sample))
+        report("materialized timeline", timed(materialized, sample))
+
+
+if __name__ == "__main__":
+    main()
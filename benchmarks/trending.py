@@ -0,0 +1,80 @@
+"""Trending score update throughput and snapshot cost.
+
+Feeds --updates likes (one in --unlike-every an unlike) of --messages
+messages, picked with a Zipf-like skew so a few are hot, into a
+TrendingBoard of --capacity, timing the board updates alone. Then seeds the
+database with the messages and times snapshots merging a board's pending
+scores into the `trending` table and reloading it.
+
+    python -m benchmarks.trending --messages 1000000 --updates 2000000
+"""
+
+import random
+import time
+
+from benchmarks.common import make_parser, load_app, seed_graph, timed, report
+
+
+def zipf_ids(num_messages, count, rng, skew=1.1):
+    """`count` message ids in 1..num_messages, low ids most often."""
+
+    weights = [1 / rank ** skew for rank in range(1, num_messages + 1)]
+    return rng.choices(range(1, num_messages + 1), weights, k=count)
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument("--messages", type=int, default=100000, help="messages")
+    parser.add_argument("--updates", type=int, default=1000000, help="likes")
+    parser.add_argument("--capacity", type=int, default=10000, help="board size")
+    parser.add_argument("--unlike-every", type=int, default=10, help="unlike rate")
+    args = parser.parse_args()
+
+    app = load_app(args.db)
+    app.config["TRENDING_SNAPSHOT_INTERVAL"] = 0
+
+    import trending
+    from models import db
+
+    rng = random.Random(args.seed)
+    ids = zipf_ids(args.messages, args.updates, rng)
+
+    board = trending.TrendingBoard(args.capacity)
+    start_at = time.time()
+    half_life = trending.DEFAULT_HALF_LIFE
+
+    start = time.perf_counter()
+    for n, message_id in enumerate(ids):
+        # likes spread over a day
+        weight = (start_at + 86400 * n / args.updates) / half_life
+        if n % args.unlike_every:
+            board.add(message_id, weight)
+        else:
+            board.remove(message_id, weight)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{args.updates:,} updates of {args.messages:,} messages "
+        f"in {elapsed:.2f}s: {args.updates / elapsed:,.0f} updates/s "
+        f"({len(board):,} on the board, {len(board.pending):,} pending)"
+    )
+
+    with app.app_context():
+        seed_graph(max(1, args.messages // 100), 0, 100)
+        db.session.remove()
+
+    def snapshot(count):
+        with app.app_context():
+            trending.reset_board()
+            live = trending.get_board()
+            for message_id in ids[:count]:
+                live.add(message_id, start_at / half_life)
+            trending.snapshot()
+            db.session.remove()
+
+    for count in (1000, 10000, 100000):
+        report(f"snapshot ({count:,} likes)", timed(snapshot, [(count,)] * 5))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""Streaming bulk loader for Warbler's CSV datasets (see seed.py).
+
+Each table is loaded from the `<table>*.csv` files in a data directory
+(`users.csv`, or shards like `users-0001.csv`), CHUNK_SIZE rows at a time,
+so memory stays flat however big the files are. On Postgres chunks go in
+with COPY; other databases get a batched executemany.
+
+The managed indexes (see indexes.py) are dropped before loading and rebuilt
+afterwards, and id sequences are moved past the loaded ids. Files without
+an `id` column get ids numbered from 1 in file order, which is what the
+other files' foreign keys refer to.
+
+Every chunk commits together with its file's row count in the
+`bulkload_progress` table, so an interrupted load can be resumed from the
+last committed chunk.
+"""
+
+import csv
+import io
+import os
+import time
+from datetime import datetime
+from glob import glob
+from itertools import islice
+
+from sqlalchemy import BigInteger, Column, MetaData, Table, Text
+from sqlalchemy.types import Boolean, DateTime, Integer
+
+import indexes
+from models import db, User, Message, FollowersFollowee, Like
+
+CHUNK_SIZE = 50000
+
+# In foreign key order
+TABLES = (
+    User.__table__,
+    Message.__table__,
+    FollowersFollowee.__table__,
+    Like.__table__,
+)
+
+progress = Table(
+    "bulkload_progress",
+    MetaData(),
+    Column("filename", Text, primary_key=True),
+    Column("rows", BigInteger, nullable=False),
+)
+
+
+def data_files(data_dir, table):
+    """The CSV files holding `table`'s rows, in load order."""
+
+    return sorted(glob(os.path.join(data_dir, f"{table.name}*.csv")))
+
+
+def _parse_bool(value):
+    return value.lower() in ("1", "t", "true")
+
+
+def _converter(column):
+    """Function turning a CSV field into a value for `column`."""
+
+    if isinstance(column.type, DateTime):
+        convert = datetime.fromisoformat
+    elif isinstance(column.type, Boolean):
+        convert = _parse_bool
+    elif isinstance(column.type, Integer):
+        convert = int
+    else:
+        return str
+
+    return lambda value: convert(value) if value != "" else None
+
+
+def _copy_chunk(conn, table, columns, rows):
+    """COPY `rows` into `table` (Postgres)."""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer,
+    )
+    cursor.close()
+
+
+def _insert_chunk(conn, table, columns, rows):
+    """INSERT `rows` into `table` with one executemany."""
+
+    converters = [(name, _converter(table.c[name])) for name in columns]
+    conn.execute(
+        table.insert(),
+        [
+            {name: convert(value) for (name, convert), value in zip(converters, row)}
+            for row in rows
+        ],
+    )
+
+
+def insert_rows(conn, table, columns, rows):
+    """Insert `rows` into `table`: COPY on Postgres, executemany elsewhere."""
+
+    if conn.dialect.name == "postgresql":
+        _copy_chunk(conn, table, columns, rows)
+    else:
+        _insert_chunk(conn, table, columns, rows)
+
+
+def load_file(engine, table, path, first_id=1, chunk_size=CHUNK_SIZE, echo=None):
+    """Load one CSV file into `table`, skipping rows already loaded.
+
+    `first_id` is the id of the file's first row, if ids are being
+    assigned. Returns the number of rows in the file.
+    """
+
+    filename = os.path.basename(path)
+
+    done = engine.execute(
+        progress.select().where(progress.c.filename == filename)
+    ).first()
+    done = done.rows if done else 0
+
+    with open(path, newline="") as file:
+        reader = csv.reader(file)
+        columns = next(reader)
+        number_rows = "id" in table.c and "id" not in columns
+        if number_rows:
+            columns = ["id"] + columns
+
+        for _ in islice(reader, done):
+            pass
+
+        loaded = done
+        start = time.perf_counter()
+
+        while True:
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                break
+
+            if number_rows:
+                first = first_id + loaded
+                rows = [[first + n] + row for n, row in enumerate(rows)]
+
+            with engine.begin() as conn:
+                insert_rows(conn, table, columns, rows)
+                loaded += len(rows)
+                conn.execute(progress.delete().where(progress.c.filename == filename))
+                conn.execute(progress.insert(), filename=filename, rows=loaded)
+
+            if echo:
+                rate = (loaded - done) / (time.perf_counter() - start)
+                echo(f"{filename}: {loaded:,} rows ({rate:,.0f} rows/s)")
+
+    return loaded
+
+
+def reset_sequences(engine):
+    """Point the id sequences past the ids that were loaded (Postgres)."""
+
+    if engine.dialect.name != "postgresql":
+        # SQLite picks the next rowid from the table itself
+        return
+
+    for table in TABLES:
+        if "id" in table.c:
+            engine.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'),"
+                f" COALESCE(MAX(id), 0) + 1, false) FROM {table.name}"
+            )
+
+
+def load(data_dir="generator", resume=False, chunk_size=CHUNK_SIZE, echo=None):
+    """Load every table's CSV files from `data_dir` into the database.
+
+    Tables must exist and, unless resuming, be empty. With `resume`, files
+    and chunks loaded by an earlier, interrupted call are skipped. Returns
+    {table name: rows}.
+    """
+
+    engine = db.engine
+    progress.create(engine, checkfirst=True)
+
+    if not resume:
+        engine.execute(progress.delete())
+
+    indexes.drop_indexes(engine, echo=echo)
+
+    counts = {}
+
+    for table in TABLES:
+        counts[table.name] = 0
+        for path in data_files(data_dir, table):
+            counts[table.name] += load_file(
+                engine,
+                table,
+                path,
+                first_id=counts[table.name] + 1,
+                chunk_size=chunk_size,
+                echo=echo,
+            )
+
+    reset_sequences(engine)
+    indexes.apply_indexes(engine, echo=echo, concurrently=False)
+
+    if engine.dialect.name == "postgresql":
+        # Fresh planner statistics for the new rows and indexes
+        engine.execute("ANALYZE")
+
+    progress.drop(engine)
+
+    return counts
@@ -0,0 +1,134 @@
+"""Denormalized user and message counters for Warbler.
+
+`User.messages_count`, `following_count`, `followers_count`, `likes_count`
+and `Message.likes_count` are adjusted in the same transaction as the write
+that changes them, using `col = col + 1` updates so concurrent writers don't
+lose increments. `reconcile()` recomputes them from the source tables in
+batches and repairs any drift.
+
+(Likes are counted in `Like.apply`.)
+"""
+
+import click
+from sqlalchemy import func, select, or_
+
+from models import db, User, Message, FollowersFollowee, Like
+
+RECONCILE_BATCH_SIZE = 5000
+
+
+def message_added(user):
+    """Count a new message by `user`."""
+
+    user.messages_count = User.messages_count + 1
+
+
+def message_removed(msg):
+    """Uncount `msg` and the likes it's about to lose with it."""
+
+    msg.user.messages_count = User.messages_count - 1
+
+    liker_ids = db.session.query(Like.user_id).filter(Like.message_id == msg.id)
+    User.query.filter(User.id.in_(liker_ids.subquery())).update(
+        {User.likes_count: User.likes_count - 1}, synchronize_session=False
+    )
+
+
+def followed(follower, followee):
+    """Count `follower` starting to follow `followee`."""
+
+    follower.following_count = User.following_count + 1
+    followee.followers_count = User.followers_count + 1
+
+
+def unfollowed(follower, followee):
+    """Count `follower` no longer following `followee`."""
+
+    follower.following_count = User.following_count - 1
+    followee.followers_count = User.followers_count - 1
+
+
+def _user_count_subqueries():
+    """Correlated COUNT(*) expressions for each counter on `users`."""
+
+    users = User.__table__
+
+    def count(table, column):
+        return (
+            select([func.count()])
+            .select_from(table)
+            .where(column == users.c.id)
+            .as_scalar()
+        )
+
+    follows = FollowersFollowee.__table__
+
+    return {
+        "messages_count": count(Message.__table__, Message.__table__.c.user_id),
+        "following_count": count(follows, follows.c.followee_id),
+        "followers_count": count(follows, follows.c.follower_id),
+        "likes_count": count(Like.__table__, Like.__table__.c.user_id),
+    }
+
+
+def _reconcile_range(table, counts, low, high):
+    """Repair drifted counters on `table` rows with low < id <= high."""
+
+    drifted = or_(*[table.c[name] != expr for name, expr in counts.items()])
+
+    result = db.session.execute(
+        table.update()
+        .where(table.c.id > low)
+        .where(table.c.id <= high)
+        .where(drifted)
+        .values(**counts)
+    )
+
+    return result.rowcount
+
+
+def reconcile(batch_size=RECONCILE_BATCH_SIZE, echo=None):
+    """Recompute every counter from the source tables, in id-range batches.
+
+    Each batch only rewrites rows whose stored counts have drifted, and is
+    committed on its own so locks are held briefly. Returns the number of
+    rows repaired.
+    """
+
+    repaired = 0
+
+    messages = Message.__table__
+    likes = Like.__table__
+    message_counts = {
+        "likes_count": select([func.count()])
+        .select_from(likes)
+        .where(likes.c.message_id == messages.c.id)
+        .as_scalar()
+    }
+
+    for table, counts in [
+        (User.__table__, _user_count_subqueries()),
+        (messages, message_counts),
+    ]:
+        max_id = db.session.query(func.max(table.c.id)).scalar() or 0
+
+        for low in range(0, max_id, batch_size):
+            repaired += _reconcile_range(table, counts, low, low + batch_size)
+            db.session.commit()
+
+        if echo:
+            echo(f"Reconciled {table.name}: {repaired} rows repaired so far")
+
+    return repaired
+
+
+def init_app(app):
+    """Register the counter CLI commands on `app`."""
+
+    @app.cli.command("reconcile-counters")
+    @click.option("--batch-size", type=int, default=RECONCILE_BATCH_SIZE)
+    def reconcile_counters_command(batch_size):
+        """Recompute denormalized counters and repair drift."""
+
+        repaired = reconcile(batch_size=batch_size, echo=click.echo)
+        click.echo(f"Repaired {repaired} rows")
@@ -0,0 +1,670 @@
+"""In-memory follow graph for Warbler.
+
+Answers "does A follow B?" (follow buttons, "follows you" badges) without a
+query per card. The `follows` table is held in compressed sparse row (CSR)
+form: for each user id, a slice of one big sorted array of the ids they
+follow, found through an array of row offsets, plus the same again
+transposed for followers. Membership is a binary search within a row, so
+O(log degree); at 4 bytes per edge per direction, 10M edges take about
+80MB (`memory_usage()`, or `python -m benchmarks.followgraph`).
+
+The arrays are built once per process from the `follows` primary key: in
+`create_app` with FOLLOW_GRAPH_PRELOAD (the production profile), so workers
+forked from a preloading parent share them, or else on first use. After
+that they're never reloaded wholesale. Follows and unfollows go into small
+per-user sets of added and removed edges laid over the arrays, both those
+made by this process and, every FOLLOW_GRAPH_POLL_INTERVAL seconds, those
+other processes logged in `follow_events`. An event only says which edge
+changed: polling reads those edges' current state from `follows`, so an
+event read twice (polls overlap by EVENT_LOOKBACK seconds, to catch
+transactions that committed late) or out of order does no harm. Once the
+pending sets reach COMPACT_RATIO of the arrays, they're folded into new
+arrays in the background, in memory. Events are kept for EVENT_RETENTION
+seconds; a process that hasn't polled for that long reloads from the
+table instead.
+
+The viewer's own rows are also checked against their following/followers
+counters, and reloaded when they disagree, so people see their own follows
+at once whatever the graph has missed.
+
+NB: a `follows` row (followee_id=A, follower_id=B) means A follows B (see
+timeline.py).
+"""
+
+import logging
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.exc import SQLAlchemyError
+
+import querystats
+from models import db, User, FollowersFollowee, FollowEvent
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 5
+EVENT_LOOKBACK = 60
+EVENT_RETENTION = 60 * 60
+BUILD_CHUNK_SIZE = 50000
+POLL_CHUNK_SIZE = 500
+
+# fold pending changes into new arrays once they're this share of the edges
+# (and at least COMPACT_MIN of them)
+COMPACT_RATIO = 0.05
+COMPACT_MIN = 10000
+
+# unsigned 32-bit: user ids and edge offsets
+ID_TYPE = "I"
+
+Flags = namedtuple("Flags", "following follows_you mutual")
+
+
+def _zeros(n):
+    return array(ID_TYPE, bytes(array(ID_TYPE).itemsize * n))
+
+
+def _offsets(counts):
+    """Turn per-row counts (shifted up one) into row offsets, in place."""
+
+    total = 0
+    for i, count in enumerate(counts):
+        total += count
+        counts[i] = total
+    return counts
+
+
+class FollowGraph:
+    """Follow edges as CSR arrays in both directions, plus pending changes."""
+
+    def __init__(self, num_users=0, edges=()):
+        """Build from `edges`, (follower, followed) pairs sorted by follower
+        then followed, between user ids below `num_users`.
+        """
+
+        counts = _zeros(num_users + 1)
+        targets = array(ID_TYPE)
+
+        for src, dst in edges:
+            targets.append(dst)
+            counts[src + 1] += 1
+
+        self.out_offsets = _offsets(counts)
+        self.out_targets = targets
+
+        # transpose: walking sources in order leaves each in-row sorted
+        in_counts = _zeros(num_users + 1)
+        for dst in targets:
+            in_counts[dst + 1] += 1
+        self.in_offsets = _offsets(in_counts)
+
+        self.in_targets = _zeros(len(targets))
+        fill = array(ID_TYPE, self.in_offsets)
+        offsets = self.out_offsets
+        for src in range(num_users):
+            for i in range(offsets[src], offsets[src + 1]):
+                dst = targets[i]
+                self.in_targets[fill[dst]] = src
+                fill[dst] += 1
+
+        self.added_out = defaultdict(set)
+        self.removed_out = defaultdict(set)
+        self.added_in = defaultdict(set)
+        self.removed_in = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return (
+                len(self.out_targets)
+                + sum(map(len, self.added_out.values()))
+                - sum(map(len, self.removed_out.values()))
+            )
+
+    @staticmethod
+    def _row(offsets, targets, row):
+        if row + 1 >= len(offsets):
+            return targets[0:0]
+        return targets[offsets[row]:offsets[row + 1]]
+
+    @staticmethod
+    def _degree(offsets, row):
+        if row + 1 >= len(offsets):
+            return 0
+        return offsets[row + 1] - offsets[row]
+
+    @staticmethod
+    def _in_row(offsets, targets, row, value):
+        if row + 1 >= len(offsets):
+            return False
+        lo, hi = offsets[row], offsets[row + 1]
+        i = bisect_left(targets, value, lo, hi)
+        return i < hi and targets[i] == value
+
+    def _has(self, offsets, targets, added, removed, row, value):
+        if value in added.get(row, ()):
+            return True
+        if value in removed.get(row, ()):
+            return False
+        return self._in_row(offsets, targets, row, value)
+
+    def follows(self, follower_id, followed_id):
+        """Does `follower_id` follow `followed_id`?"""
+
+        return self._has(
+            self.out_offsets,
+            self.out_targets,
+            self.added_out,
+            self.removed_out,
+            follower_id,
+            followed_id,
+        )
+
+    def followed_among(self, user_id, user_ids):
+        """Which of `user_ids` does `user_id` follow?"""
+
+        return {other for other in user_ids if self.follows(user_id, other)}
+
+    def followers_among(self, user_id, user_ids):
+        """Which of `user_ids` follow `user_id`? (Searches its in-row.)"""
+
+        return {
+            other
+            for other in user_ids
+            if self._has(
+                self.in_offsets,
+                self.in_targets,
+                self.added_in,
+                self.removed_in,
+                user_id,
+                other,
+            )
+        }
+
+    def flags(self, user_id, user_ids):
+        """{id: Flags(following, follows_you, mutual)} for `user_ids`."""
+
+        following = self.followed_among(user_id, user_ids)
+        followers = self.followers_among(user_id, user_ids)
+
+        return {
+            other: Flags(
+                other in following,
+                other in followers,
+                other in following and other in followers,
+            )
+            for other in user_ids
+        }
+
+    def _ids(self, offsets, targets, added, removed, row):
+        ids = set(self._row(offsets, targets, row))
+        with self.lock:
+            ids -= removed.get(row, set())
+            ids |= added.get(row, set())
+        return sorted(ids)
+
+    def following_ids(self, user_id):
+        """Sorted ids of the users `user_id` follows."""
+
+        return self._ids(
+            self.out_offsets,
+            self.out_targets,
+            self.added_out,
+            self.removed_out,
+            user_id,
+        )
+
+    def follower_ids(self, user_id):
+        """Sorted ids of the users following `user_id`."""
+
+        return self._ids(
+            self.in_offsets, self.in_targets, self.added_in, self.removed_in, user_id
+        )
+
+    def following_count(self, user_id):
+        return (
+            self._degree(self.out_offsets, user_id)
+            + len(self.added_out.get(user_id, ()))
+            - len(self.removed_out.get(user_id, ()))
+        )
+
+    def followers_count(self, user_id):
+        return (
+            self._degree(self.in_offsets, user_id)
+            + len(self.added_in.get(user_id, ()))
+            - len(self.removed_in.get(user_id, ()))
+        )
+
+    def _set(self, follower_id, followed_id, following):
+        pairs = [
+            (self.out_offsets, self.out_targets, self.added_out, self.removed_out,
+             follower_id, followed_id),
+            (self.in_offsets, self.in_targets, self.added_in, self.removed_in,
+             followed_id, follower_id),
+        ]
+
+        with self.lock:
+            for offsets, targets, added, removed, row, value in pairs:
+                in_base = self._in_row(offsets, targets, row, value)
+
+                if following:
+                    removed[row].discard(value)
+                    if not in_base:
+                        added[row].add(value)
+                else:
+                    added[row].discard(value)
+                    if in_base:
+                        removed[row].add(value)
+
+    def add(self, follower_id, followed_id):
+        """Record that `follower_id` now follows `followed_id`."""
+
+        self._set(follower_id, followed_id, True)
+
+    def remove(self, follower_id, followed_id):
+        """Record that `follower_id` no longer follows `followed_id`."""
+
+        self._set(follower_id, followed_id, False)
+
+    def replace_following(self, user_id, followed_ids):
+        """Make `user_id`'s follows exactly `followed_ids`."""
+
+        current = set(self.following_ids(user_id))
+        for other in current - set(followed_ids):
+            self.remove(user_id, other)
+        for other in set(followed_ids) - current:
+            self.add(user_id, other)
+
+    def replace_followers(self, user_id, follower_ids):
+        """Make `user_id`'s followers exactly `follower_ids`."""
+
+        current = set(self.follower_ids(user_id))
+        for other in current - set(follower_ids):
+            self.remove(other, user_id)
+        for other in set(follower_ids) - current:
+            self.add(other, user_id)
+
+    def remove_user(self, user_id):
+        """Drop every edge to or from `user_id`."""
+
+        for other in self.following_ids(user_id):
+            self.remove(user_id, other)
+        for other in self.follower_ids(user_id):
+            self.remove(other, user_id)
+
+    def pending(self):
+        """How many edges the pending changes add or remove."""
+
+        with self.lock:
+            return sum(map(len, self.added_out.values())) + sum(
+                map(len, self.removed_out.values())
+            )
+
+    def compacted(self):
+        """A new FollowGraph of these edges, with no pending changes."""
+
+        with self.lock:
+            rows = [len(self.out_offsets) - 1, len(self.in_offsets) - 1]
+            rows += [row + 1 for row, ids in self.added_out.items() if ids]
+            rows += [row + 1 for row, ids in self.added_in.items() if ids]
+        num_users = max(rows)
+
+        edges = (
+            (src, dst)
+            for src in range(num_users)
+            for dst in self.following_ids(src)
+        )
+        return FollowGraph(num_users, edges)
+
+    def memory_usage(self):
+        """Approximate bytes held, by part."""
+
+        def array_bytes(*arrays):
+            return sum(a.itemsize * len(a) for a in arrays)
+
+        def delta_bytes(*deltas):
+            return sum(
+                sys.getsizeof(delta)
+                + sum(sys.getsizeof(row) for row in delta.values())
+                for delta in deltas
+            )
+
+        with self.lock:
+            usage = dict(
+                offsets=array_bytes(self.out_offsets, self.in_offsets),
+                edges=array_bytes(self.out_targets, self.in_targets),
+                pending=delta_bytes(
+                    self.added_out, self.removed_out, self.added_in, self.removed_in
+                ),
+            )
+        usage["total"] = sum(usage.values())
+        return usage
+
+
+def load_graph(chunk_size=BUILD_CHUNK_SIZE):
+    """Build a FollowGraph from the `follows` table, in primary key order."""
+
+    num_users = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+
+    # (followee_id=A, follower_id=B) means A follows B
+    edges = (
+        db.session.query(FollowersFollowee.followee_id, FollowersFollowee.follower_id)
+        .order_by(FollowersFollowee.followee_id, FollowersFollowee.follower_id)
+        .yield_per(chunk_size)
+    )
+
+    return FollowGraph(num_users, edges)
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
+# Changes to _graph are made under _change_lock. While a replacement is
+# being built in the background, the edges changed meanwhile are noted in
+# _touched and copied over before the swap.
+_change_lock = threading.Lock()
+_touched = None
+_replacing = False
+
+_polled_at = 0
+_events_since = None
+_poll_lock = threading.Lock()
+
+
+def _change(follower_id, followed_id, following):
+    with _change_lock:
+        if _graph is None:
+            return
+        _graph._set(follower_id, followed_id, following)
+        if _touched is not None:
+            _touched.add((follower_id, followed_id))
+
+
+def _replace(app, build):
+    """Swap in the graph `build()` returns, built in a background thread."""
+
+    global _graph, _touched, _replacing
+
+    try:
+        with app.app_context():
+            with _change_lock:
+                old, _touched = _graph, set()
+            graph = build(old)
+            db.session.remove()
+
+        with _change_lock:
+            for follower_id, followed_id in _touched:
+                graph._set(
+                    follower_id, followed_id, old.follows(follower_id, followed_id)
+                )
+            if _graph is old:
+                _graph = graph
+    except Exception:
+        logger.exception("Couldn't rebuild the follow graph")
+    finally:
+        with _change_lock:
+            _touched = None
+        _replacing = False
+
+
+def _start_replacing(build):
+    global _replacing
+
+    with _graph_lock:
+        if _replacing:
+            return
+        _replacing = True
+
+    threading.Thread(
+        target=_replace,
+        args=(current_app._get_current_object(), build),
+        daemon=True,
+    ).start()
+
+
+def _current_state(conn, pairs):
+    """Which of the (follower, followed) `pairs` are in `follows` now?"""
+
+    follows = FollowersFollowee.__table__
+    present = set()
+
+    # no row-value IN on SQLite
+    for i in range(0, len(pairs), POLL_CHUNK_SIZE):
+        query = select([follows.c.followee_id, follows.c.follower_id]).where(
+            or_(
+                *[
+                    and_(
+                        follows.c.followee_id == follower_id,
+                        follows.c.follower_id == followed_id,
+                    )
+                    for follower_id, followed_id in pairs[i:i + POLL_CHUNK_SIZE]
+                ]
+            )
+        )
+        present.update(tuple(row) for row in conn.execute(query))
+
+    return present
+
+
+def poll():
+    """Apply the follows other processes logged since the last poll.
+
+    Reads a little further back than that (EVENT_LOOKBACK), for those
+    committed late. Also prunes events older than EVENT_RETENTION, and
+    starts a reload if the last poll is older than that.
+    """
+
+    global _events_since
+
+    now = datetime.utcnow()
+    retention = timedelta(seconds=EVENT_RETENTION)
+
+    if now - _events_since > retention - timedelta(seconds=EVENT_LOOKBACK):
+        _events_since = now
+        _start_replacing(lambda old: load_graph())
+        return
+
+    events = FollowEvent.__table__
+    since = _events_since - timedelta(seconds=EVENT_LOOKBACK)
+
+    with db.engine.begin() as conn:
+        pairs = [
+            tuple(row)
+            for row in conn.execute(
+                select([events.c.follower_id, events.c.followed_id])
+                .where(events.c.created_at >= since)
+                .distinct()
+            )
+        ]
+        present = _current_state(conn, pairs)
+        conn.execute(events.delete().where(events.c.created_at < now - retention))
+
+    _events_since = now
+    for pair in pairs:
+        _change(*pair, pair in present)
+
+    graph = _graph
+    if graph.pending() >= max(COMPACT_MIN, COMPACT_RATIO * len(graph.out_targets)):
+        _start_replacing(lambda old: old.compacted())
+
+
+def get_graph():
+    """This process's FollowGraph: built on first use (unless preloaded),
+    then brought up to date with other processes' changes every
+    FOLLOW_GRAPH_POLL_INTERVAL seconds.
+    """
+
+    global _graph, _polled_at, _events_since
+
+    if _graph is None:
+        with _graph_lock, querystats.exempt():
+            if _graph is None:
+                _events_since = datetime.utcnow()
+                _graph, _polled_at = load_graph(), time.monotonic()
+        return _graph
+
+    interval = current_app.config.get(
+        "FOLLOW_GRAPH_POLL_INTERVAL", DEFAULT_POLL_INTERVAL
+    )
+    if interval and time.monotonic() - _polled_at > interval:
+        # one request polls; the others go on with the graph as it is
+        if _poll_lock.acquire(blocking=False):
+            try:
+                _polled_at = time.monotonic()
+                with querystats.exempt():
+                    poll()
+            except SQLAlchemyError:
+                logger.exception("Couldn't poll for follow events")
+            finally:
+                _poll_lock.release()
+
+    return _graph
+
+
+def preload(app):
+    """Build the graph now, so requests don't wait for it and workers
+    forked from this process share it.
+
+    Connections opened meanwhile are closed, so forked workers don't share
+    them. A database without the tables yet leaves the graph to first use.
+    """
+
+    try:
+        with app.app_context():
+            get_graph()
+    except SQLAlchemyError:
+        logger.warning("Couldn't preload the follow graph", exc_info=True)
+    finally:
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+
+
+def reset_graph():
+    """Forget the in-process graph (it's rebuilt on next use)."""
+
+    global _graph
+    _graph = None
+
+
+def use_graph():
+    return current_app.config.get("FOLLOW_GRAPH_ENABLED", True)
+
+
+def _synced(user, followers=False):
+    """The graph, with `user`'s own rows reloaded if their counters disagree."""
+
+    graph = get_graph()
+
+    if graph.following_count(user.id) != user.following_count:
+        ids = db.session.query(FollowersFollowee.follower_id).filter(
+            FollowersFollowee.followee_id == user.id
+        )
+        graph.replace_following(user.id, [id for (id,) in ids])
+
+    if followers and graph.followers_count(user.id) != user.followers_count:
+        ids = db.session.query(FollowersFollowee.followee_id).filter(
+            FollowersFollowee.follower_id == user.id
+        )
+        graph.replace_followers(user.id, [id for (id,) in ids])
+
+    return graph
+
+
+def followed_ids_for(user_ids, user):
+    """Which of `user_ids` does `user` follow? (A set; empty if no user.)"""
+
+    if not user or not user_ids:
+        return set()
+    if not use_graph():
+        return User.followed_ids_for(user_ids, user)
+
+    return _synced(user).followed_among(user.id, user_ids)
+
+
+def follow_flags(user_ids, user):
+    """{id: Flags(following, follows_you, mutual)} of `user_ids` for `user`."""
+
+    if not user or not user_ids:
+        return {}
+    if not use_graph():
+        following = User.followed_ids_for(user_ids, user)
+        followers = {
+            id
+            for (id,) in db.session.query(FollowersFollowee.followee_id).filter(
+                FollowersFollowee.follower_id == user.id,
+                FollowersFollowee.followee_id.in_(user_ids),
+            )
+        }
+        return {
+            id: Flags(
+                id in following, id in followers, id in following and id in followers
+            )
+            for id in user_ids
+        }
+
+    return _synced(user, followers=True).flags(user.id, user_ids)
+
+
+def follows(user, other):
+    """Template helper: does `user` (maybe None) follow `other`?"""
+
+    return bool(user) and other.id in followed_ids_for([other.id], user)
+
+
+def log_change(follower_id, followed_id):
+    """Log, in the session's transaction, that an edge changed, so other
+    processes' graphs pick it up.
+    """
+
+    db.session.add(FollowEvent(follower_id=follower_id, followed_id=followed_id))
+
+
+def followed(follower, followee):
+    """Keep the in-process graph current after a follow."""
+
+    _change(follower.id, followee.id, True)
+
+
+def unfollowed(follower, followee):
+    """Keep the in-process graph current after an unfollow."""
+
+    _change(follower.id, followee.id, False)
+
+
+def user_removed(user_id):
+    """Keep the in-process graph current after an account is deleted."""
+
+    graph = _graph
+    if graph is None:
+        return
+    for other in graph.following_ids(user_id):
+        _change(user_id, other, False)
+    for other in graph.follower_ids(user_id):
+        _change(other, user_id, False)
+
+
+def init_app(app):
+    """Add the template helpers and the `follow-graph-stats` command."""
+
+    app.add_template_global(follows)
+    app.add_template_global(follow_flags)
+
+    @app.cli.command("follow-graph-stats")
+    def follow_graph_stats():
+        """Build the follow graph and report its size."""
+
+        start = time.perf_counter()
+        graph = load_graph()
+        elapsed = time.perf_counter() - start
+
+        click.echo(f"{len(graph):,} edges, built in {elapsed:.1f}s")
+        for part, size in graph.memory_usage().items():
+            click.echo(f"{part:<8} {size / 2**20:10.1f} MB")
@@ -0,0 +1,437 @@
+"""Fragment cache for the rendered HTML of message and user cards.
+
+Templates wrap the parts of a card that are the same for every viewer in
+
+    {% cache "home-message", msg %} ... {% endcache %}
+
+and the block is only rendered on a miss. Keys are versioned: they carry a
+digest of every field the fragment shows (a message's text and timestamp and
+its author's profile; a user's profile), so an edited profile simply misses
+and renders afresh, and nothing cached can be stale. Whatever depends on the
+viewer (the like star, follow buttons) stays outside the block.
+
+Deleted messages and edited profiles also `forget()` their old entries so
+they don't sit in the cache until they're evicted.
+
+The backend is picked by FRAGMENT_CACHE_URL: "lru" for an in-process LRU
+(the default), "memcached://host:port" for anything that speaks the memcached
+text protocol (`flask memcached-standin` serves a small one for development),
+or "none" to render everything. A list can `prefetch_fragments()` its cards in
+one round trip before its loop.
+
+Responses that looked up any fragments get X-Fragment-Hits and
+X-Fragment-Misses headers; `cache.stats()` has the process's hit ratio.
+"""
+
+import hashlib
+import logging
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+
+import click
+from flask import current_app, g, has_request_context
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from models import Message
+from usercache import CACHED_FIELDS
+
+logger = logging.getLogger("warbler.fragcache")
+
+DEFAULT_URL = "lru"
+DEFAULT_SIZE = 10000
+DEFAULT_TTL = 60 * 60
+
+# Every fragment name templates use, for `forget()`. Declared rather than
+# collected as templates compile: one loaded from the bytecode cache (see
+# templatecache.py) is never parsed, nor is one this process hasn't rendered.
+FRAGMENT_NAMES = frozenset(
+    {
+        "home-message",
+        "liked-message",
+        "profile-message",
+        "trending-message",
+        "users-card",
+        "following-card",
+        "followers-card",
+    }
+)
+
+
+def profile_fields(user):
+    return tuple(getattr(user, field) for field in CACHED_FIELDS)
+
+
+def version_of(obj):
+    """Everything about `obj` that a fragment of it can show."""
+
+    if isinstance(obj, Message):
+        return obj.id, obj.text, obj.timestamp, profile_fields(obj.user)
+    return profile_fields(obj)
+
+
+def fragment_key(name, obj):
+    """The cache key of fragment `name` of `obj` as it is now."""
+
+    salt = current_app.config.get("FRAGMENT_CACHE_SALT", "")
+    digest = hashlib.sha1(repr((salt, version_of(obj))).encode()).hexdigest()
+    return f"frag:{name}:{obj.id}:{digest}"
+
+
+class LRUBackend:
+    """An in-process LRU of rendered fragments, with a TTL."""
+
+    def __init__(self, maxsize=DEFAULT_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                if now > entry[0]:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = entry[1]
+
+        return found
+
+    def set_many(self, items, ttl):
+        expires = time.monotonic() + ttl
+
+        with self.lock:
+            for key, value in items.items():
+                self.entries[key] = (expires, value)
+                self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class MemcachedBackend:
+    """A client for the memcached text protocol: one connection per thread.
+
+    A cache that's down or misbehaving is logged and treated as empty, so
+    pages still render.
+    """
+
+    def __init__(self, host="127.0.0.1", port=11211, timeout=0.5):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connection(self):
+        if getattr(self.local, "sock", None) is None:
+            sock = socket.create_connection(self.address, self.timeout)
+            self.local.sock = sock
+            self.local.file = sock.makefile("rb")
+        return self.local.sock, self.local.file
+
+    def _call(self, fn, default=None):
+        try:
+            return fn(*self._connection())
+        except (OSError, ValueError) as err:
+            logger.warning("memcached %s:%s: %s", *self.address, err)
+            sock = getattr(self.local, "sock", None)
+            if sock is not None:
+                sock.close()
+            self.local.sock = None
+            return default
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+
+        def get(sock, file):
+            sock.sendall(f"get {' '.join(keys)}\r\n".encode())
+            found = {}
+            while True:
+                line = file.readline()
+                if line == b"END\r\n":
+                    return found
+                if not line.startswith(b"VALUE "):
+                    raise ValueError(f"unexpected reply {line!r}")
+                _, key, _flags, size = line.split()[:4]
+                found[key.decode()] = file.read(int(size) + 2)[:-2].decode()
+
+        return self._call(get, {})
+
+    def set_many(self, items, ttl):
+        def set_(sock, file):
+            commands = []
+            for key, value in items.items():
+                data = value.encode()
+                commands.append(f"set {key} 0 {ttl} {len(data)} noreply\r\n".encode())
+                commands.append(data + b"\r\n")
+            sock.sendall(b"".join(commands))
+
+        self._call(set_)
+
+    def delete_many(self, keys):
+        def delete(sock, file):
+            sock.sendall(
+                b"".join(f"delete {key} noreply\r\n".encode() for key in keys)
+            )
+
+        self._call(delete)
+
+    def clear(self):
+        def flush(sock, file):
+            sock.sendall(b"flush_all\r\n")
+            file.readline()
+
+        self._call(flush)
+
+
+class NullBackend:
+    """Caches nothing: every fragment is rendered."""
+
+    def get_many(self, keys):
+        return {}
+
+    def set_many(self, items, ttl):
+        pass
+
+    def delete_many(self, keys):
+        pass
+
+    def clear(self):
+        pass
+
+
+def backend_for(url, maxsize=DEFAULT_SIZE):
+    """The backend for a FRAGMENT_CACHE_URL."""
+
+    if url == "lru":
+        return LRUBackend(maxsize)
+    if url in ("none", ""):
+        return NullBackend()
+    if url.startswith("memcached://"):
+        host, _, port = url[len("memcached://"):].partition(":")
+        return MemcachedBackend(host or "127.0.0.1", int(port or 11211))
+    raise ValueError(f"Unknown FRAGMENT_CACHE_URL: {url}")
+
+
+class FragmentCache:
+    """Rendered fragments in a backend, with hit/miss counters."""
+
+    def __init__(self, backend=None, ttl=DEFAULT_TTL):
+        self.backend = backend or LRUBackend()
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, hits, misses):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+        if has_request_context():
+            g.fragment_hits = g.get("fragment_hits", 0) + hits
+            g.fragment_misses = g.get("fragment_misses", 0) + misses
+
+    def prefetch(self, name, objects):
+        """Look up fragment `name` of each of `objects` in one round trip."""
+
+        keys = [fragment_key(name, obj) for obj in objects]
+        prefetched = g.setdefault("fragments", {})
+        prefetched.update(dict.fromkeys(keys))
+        prefetched.update(self.backend.get_many(keys))
+
+    def render(self, name, obj, caller):
+        """Fragment `name` of `obj`, from the cache or else from `caller()`."""
+
+        key = fragment_key(name, obj)
+
+        prefetched = g.get("fragments") or {}
+        if key in prefetched:
+            html = prefetched.pop(key)
+        else:
+            html = self.backend.get_many([key]).get(key)
+
+        if html is not None:
+            self._count(1, 0)
+            return Markup(html)
+
+        self._count(0, 1)
+        html = caller()
+        self.backend.set_many({key: str(html)}, self.ttl)
+        return html
+
+    def forget(self, obj):
+        """Drop every fragment of `obj` as it is now (before it changes)."""
+
+        self.backend.delete_many([fragment_key(name, obj) for name in FRAGMENT_NAMES])
+
+    def clear(self):
+        """Forget everything and reset the counters."""
+
+        self.backend.clear()
+        with self.lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Hit/miss counts since the last clear."""
+
+        with self.lock:
+            lookups = self.hits + self.misses
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                hit_ratio=self.hits / lookups if lookups else 0.0,
+            )
+
+
+cache = FragmentCache()
+
+
+class FragmentCacheExtension(Extension):
+    """The `{% cache "name", obj %}...{% endcache %}` tag."""
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        name = parser.parse_expression()
+        if not isinstance(name, nodes.Const):
+            parser.fail("fragment name must be a string literal", lineno)
+        if name.value not in FRAGMENT_NAMES:
+            parser.fail(
+                f"fragment {name.value!r} isn't in fragcache.FRAGMENT_NAMES", lineno
+            )
+
+        parser.stream.expect("comma")
+        obj = parser.parse_expression()
+
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method("_render", [name, obj]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, name, obj, caller):
+        return cache.render(name, obj, caller)
+
+
+def prefetch_fragments(name, objects):
+    """Template global: prefetch fragment `name` of `objects`."""
+
+    cache.prefetch(name, objects)
+    return ""
+
+
+def forget(obj):
+    """Drop `obj`'s fragments after deleting it or before changing it."""
+
+    cache.forget(obj)
+
+
+def add_stats_headers(resp):
+    hits = g.get("fragment_hits")
+    misses = g.get("fragment_misses")
+
+    if hits is not None:
+        resp.headers["X-Fragment-Hits"] = str(hits)
+        resp.headers["X-Fragment-Misses"] = str(misses)
+
+    return resp
+
+
+class _StandInHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        store, lock = self.server.store, self.server.lock
+
+        for line in self.rfile:
+            command, *args = line.decode().split()
+            noreply = args[-1:] == ["noreply"]
+            reply = b""
+
+            if command == "get":
+                now = time.time()
+                with lock:
+                    for key in args:
+                        entry = store.get(key)
+                        if entry and (not entry[0] or entry[0] > now):
+                            reply += b"VALUE %s 0 %d\r\n%s\r\n" % (
+                                key.encode(),
+                                len(entry[1]),
+                                entry[1],
+                            )
+                reply += b"END\r\n"
+            elif command == "set":
+                key, _flags, ttl, size = args[:4]
+                data = self.rfile.read(int(size) + 2)[:-2]
+                with lock:
+                    store[key] = (time.time() + int(ttl) if int(ttl) else 0, data)
+                reply = b"STORED\r\n"
+            elif command == "delete":
+                with lock:
+                    found = store.pop(args[0], None) is not None
+                reply = b"DELETED\r\n" if found else b"NOT_FOUND\r\n"
+            elif command == "flush_all":
+                with lock:
+                    store.clear()
+                reply = b"OK\r\n"
+            else:
+                reply = b"ERROR\r\n"
+
+            if not noreply:
+                self.wfile.write(reply)
+
+
+class MemcachedStandIn(socketserver.ThreadingTCPServer):
+    """A tiny in-memory server for the parts of the memcached text protocol
+    that MemcachedBackend uses. For development and tests, not production.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=("127.0.0.1", 11211)):
+        super().__init__(address, _StandInHandler)
+        self.store = {}
+        self.lock = threading.Lock()
+
+
+def init_app(app):
+    """Set up the cache from `app`'s config and install the template tag."""
+
+    cache.backend = backend_for(
+        app.config.get("FRAGMENT_CACHE_URL", DEFAULT_URL),
+        app.config.get("FRAGMENT_CACHE_SIZE", DEFAULT_SIZE),
+    )
+    cache.ttl = app.config.get("FRAGMENT_CACHE_TTL", DEFAULT_TTL)
+
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.add_template_global(prefetch_fragments)
+    app.after_request(add_stats_headers)
+
+    @app.cli.command("memcached-standin")
+    @click.option("--port", default=11211)
+    def memcached_standin(port):
+        """Serve a development stand-in for memcached on localhost."""
+
+        server = MemcachedStandIn(("127.0.0.1", port))
+        click.echo(f"Serving memcached protocol on 127.0.0.1:{port}")
+        server.serve_forever()
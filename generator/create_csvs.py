@@ -2,76 +2,206 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. a production-shaped
+dataset for load testing:
+
+    python generator/create_csvs.py --users 1000000 --shards 16 --out-dir /data
+
+and load it with `python seed.py --data-dir /data`.
+
+Everything is generated offline and streamed to disk, and the same --seed
+(and --now) gives the same files. Users are split into --shards contiguous
+id ranges, each written by its own process to its own set of files
+(users-0000.csv, messages-0000.csv, ...); every row carries explicit ids so
+shards never need to agree on anything.
+
+Faker is slow, so each shard draws a pool of POOL_SIZE fake names, bios,
+cities and messages up front and samples from those.
+
+Popularity follows a power law: user #1 is the most followed and the most
+active, and user #k gets about 1 / k**alpha as many follows and messages.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+from datetime import datetime
+from glob import glob
+from multiprocessing import Pool
+from random import Random
+
 from faker import Faker
-from helpers import get_random_datetime
+
+from helpers import get_random_datetime, zipf_rank
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
-MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+MESSAGES_CSV_HEADERS = ['id', 'text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['followee_id', 'follower_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
+
+TABLES = ['users', 'messages', 'follows', 'likes']
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+POOL_SIZE = 1000
 
-fake = Faker()
+# bcrypt hash of "password"
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-# Generate random profile image URLs to use for users
+# Random profile image URLs to use for users
 
-image_urls = [
+IMAGE_URLS = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
     for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
+# Header image URLs to use for users (from splashbase)
+
+with open(os.path.join(os.path.dirname(__file__), 'header_image_urls.txt')) as urls:
+    HEADER_IMAGE_URLS = urls.read().split()
+
+
+def shard_path(args, table, shard):
+    """Where `shard`'s rows of `table` go."""
+
+    if args.shards == 1:
+        return os.path.join(args.out_dir, f"{table}.csv")
+    return os.path.join(args.out_dir, f"{table}-{shard:04d}.csv")
+
+
+def id_range(shard, shards, total):
+    """The ids (of `total`, numbered from 1) that belong to `shard`."""
+
+    return range(shard * total // shards + 1, (shard + 1) * total // shards + 1)
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followee, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(followee_id=followee, follower_id=follower))
+def out_degree(rng, mean, limit):
+    """How many rows (follows, likes) a user gets: heavy-tailed around `mean`."""
+
+    return min(limit, int(rng.expovariate(1 / mean))) if mean else 0
+
+
+def write_shard(args, shard):
+    """Write one shard's users, messages, follows and likes. Returns counts."""
+
+    rng = Random(f"{args.seed}-{shard}")
+    fake = Faker()
+    fake.seed_instance(f"{args.seed}-{shard}")
+
+    user_names = [fake.user_name() for _ in range(POOL_SIZE)]
+    domains = [fake.free_email_domain() for _ in range(POOL_SIZE)]
+    bios = [fake.sentence() for _ in range(POOL_SIZE)]
+    cities = [fake.city() for _ in range(POOL_SIZE)]
+    texts = [fake.paragraph()[:MAX_WARBLER_LENGTH] for _ in range(POOL_SIZE)]
+
+    num_messages = args.users * args.messages_per_user
+    counts = dict.fromkeys(TABLES, 0)
+
+    with open(shard_path(args, 'users', shard), 'w', newline='') as users_csv:
+        users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
+        users_writer.writeheader()
+
+        for user_id in id_range(shard, args.shards, args.users):
+            # the id suffix keeps usernames (and so emails) unique
+            username = f"{rng.choice(user_names)}_{user_id}"
+            users_writer.writerow(dict(
+                id=user_id,
+                email=f"{username}@{rng.choice(domains)}",
+                username=username,
+                image_url=rng.choice(IMAGE_URLS),
+                password=PASSWORD,
+                bio=rng.choice(bios),
+                header_image_url=rng.choice(HEADER_IMAGE_URLS),
+                location=rng.choice(cities)
+            ))
+            counts['users'] += 1
+
+    with open(shard_path(args, 'messages', shard), 'w', newline='') as messages_csv:
+        messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
+        messages_writer.writeheader()
+
+        for message_id in id_range(shard, args.shards, num_messages):
+            messages_writer.writerow(dict(
+                id=message_id,
+                text=rng.choice(texts),
+                timestamp=get_random_datetime(now=args.now, rng=rng),
+                user_id=zipf_rank(args.users, args.alpha, rng)
+            ))
+            counts['messages'] += 1
+
+    # Each user in the shard follows, and likes, a heavy-tailed number of
+    # others. NB: a follows row (followee_id=A, follower_id=B) means A
+    # follows B (see timeline.py).
+
+    with open(shard_path(args, 'follows', shard), 'w', newline='') as follows_csv, \
+            open(shard_path(args, 'likes', shard), 'w', newline='') as likes_csv:
+        follows_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
+        follows_writer.writeheader()
+        likes_writer = csv.DictWriter(likes_csv, fieldnames=LIKES_CSV_HEADERS)
+        likes_writer.writeheader()
+
+        for user_id in id_range(shard, args.shards, args.users):
+            wanted = out_degree(rng, args.follows_per_user, (args.users - 1) // 2)
+            followed = set()
+            # popular users get picked repeatedly; give up after a few tries
+            for _ in range(wanted * 4):
+                if len(followed) == wanted:
+                    break
+                other = zipf_rank(args.users, args.alpha, rng)
+                if other != user_id and other not in followed:
+                    followed.add(other)
+                    follows_writer.writerow(dict(followee_id=user_id, follower_id=other))
+            counts['follows'] += len(followed)
+
+            wanted = out_degree(rng, args.likes_per_user, num_messages // 2)
+            liked = set()
+            while len(liked) < wanted:
+                message_id = rng.randint(1, num_messages)
+                if message_id not in liked:
+                    liked.add(message_id)
+                    likes_writer.writerow(dict(user_id=user_id, message_id=message_id))
+            counts['likes'] += len(liked)
+
+    return counts
+
+
+def remove_old_files(args):
+    """Delete CSVs from an earlier run, so stale shards don't get loaded."""
+
+    for table in TABLES:
+        for path in glob(os.path.join(args.out_dir, f"{table}*.csv")):
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--messages-per-user', type=int, default=4)
+    parser.add_argument('--follows-per-user', type=int, default=16, help='on average')
+    parser.add_argument('--likes-per-user', type=int, default=4, help='on average')
+    parser.add_argument('--alpha', type=float, default=1.0, help='power-law exponent')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument(
+        '--now',
+        type=datetime.fromisoformat,
+        default=datetime.now(),
+        help='end of the message timestamp range (fix it to repeat a run exactly)'
+    )
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--out-dir', default=os.path.dirname(__file__) or '.')
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    remove_old_files(args)
+
+    with Pool(min(args.processes, args.shards)) as pool:
+        results = pool.starmap(write_shard, [(args, shard) for shard in range(args.shards)])
+
+    totals = {table: sum(counts[table] for counts in results) for table in TABLES}
+    print(', '.join(f"{rows:,} {table}" for table, rows in totals.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,36 @@
 """Support functions for CSV generation."""
 
+import random
 from datetime import datetime
-from random import uniform
 
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+def get_random_datetime(year_gap=2, now=None, rng=random):
+    """Get a random datetime within the last few years.
 
-    now = datetime.now()
+    Pass a fixed `now` and a seeded `random.Random` as `rng` to get the same
+    datetimes on every run.
+    """
+
+    now = now or datetime.now()
     then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+    random_timestamp = rng.uniform(then.timestamp(), now.timestamp())
 
     return datetime.fromtimestamp(random_timestamp)
+
+
+def zipf_rank(n, alpha, rng=random):
+    """A random rank in 1..`n`, rank k drawn with probability ~ 1 / k**alpha.
+
+    Uses the inverse CDF of the continuous power law, so it's O(1) however
+    big `n` is.
+    """
+
+    u = rng.random()
+    top = n + 1
+
+    if alpha == 1:
+        x = top ** u
+    else:
+        x = ((top ** (1 - alpha) - 1) * u + 1) ** (1 / (1 - alpha))
+
+    return min(n, int(x))
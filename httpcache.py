@@ -0,0 +1,167 @@
+"""Per-route HTTP caching policy: conditional GETs and long-lived statics.
+
+Pages built from the database answer conditional requests. A view decorated
+with `@conditional(version)` calls `version(**view_args)` first: a cheap
+function of whatever the page shows (counters, newest ids; a query or two
+against an index). Its result, the logged-in viewer's own profile,
+counters and unflushed likes, and a time window go into a weak ETag. If
+the browser's If-None-Match already has that ETag, the view is never
+called: no page queries, no template rendering, just a 304.
+
+The HTTP_ETAG_WINDOW (seconds) bounds how stale a revalidated page can be
+over changes its version doesn't capture (say, an author editing their
+profile); HTTP_ETAG_SALT should change with each deploy so template changes
+aren't hidden behind old ETags.
+
+Those pages differ per viewer, so they're `Vary: Cookie` and `private` for
+logged-in viewers. Anything else dynamic is `no-store`, as before. Static
+files get a long `max-age`, and `immutable` when the URL carries the file's
+version (see `static_url`, and assets.py for built, hashed files).
+"""
+
+import hashlib
+import os
+import time
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+
+import likes
+
+DEFAULT_ETAG_WINDOW = 300
+DEFAULT_STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+# Static files requested without a version can change under the same URL.
+UNVERSIONED_STATIC_MAX_AGE = 60 * 60
+
+# What of a user shows on pages about them, or on every page they view
+PROFILE_FIELDS = (
+    "id",
+    "username",
+    "image_url",
+    "header_image_url",
+    "bio",
+    "location",
+    "messages_count",
+    "following_count",
+    "followers_count",
+    "likes_count",
+)
+
+
+def profile_version(user):
+    """The version of `user`'s profile fields and counters."""
+
+    return tuple(getattr(user, field) for field in PROFILE_FIELDS)
+
+
+def make_etag(version):
+    """The ETag for a page at `version`, as seen by the current viewer."""
+
+    config = current_app.config
+    window = config.get("HTTP_ETAG_WINDOW", DEFAULT_ETAG_WINDOW)
+
+    parts = (
+        config.get("HTTP_ETAG_SALT", ""),
+        int(time.time() // window) if window else 0,
+        request.query_string,
+        profile_version(g.user) if g.user else None,
+        likes.pending_for(g.user),
+        version,
+    )
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def set_page_policy(resp):
+    """Revalidate every time; shared caches keep logged-in pages to themselves."""
+
+    resp.headers["Cache-Control"] = "private, no-cache" if g.user else "no-cache"
+    resp.vary.add("Cookie")
+
+
+def conditional(version):
+    """Decorator: answer conditional GETs of a view from `version(**view_args)`.
+
+    `version` may return None to leave the request to the view (e.g. so it
+    can 404).
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            # flashed messages are shown once, so the page must be rendered
+            if (
+                request.method not in ("GET", "HEAD")
+                or not current_app.config.get("HTTP_CACHE_ENABLED", True)
+                or session.get("_flashes")
+            ):
+                return view(**kwargs)
+
+            current = version(**kwargs)
+            if current is None:
+                return view(**kwargs)
+
+            etag = make_etag(current)
+            if request.if_none_match.contains_weak(etag):
+                resp = current_app.response_class(status=304)
+            else:
+                resp = make_response(view(**kwargs))
+                if resp.status_code != 200:
+                    return resp
+
+            resp.set_etag(etag, weak=True)
+            set_page_policy(resp)
+            return resp
+
+        return wrapper
+
+    return decorator
+
+
+_static_versions = {}
+
+
+def static_url(filename):
+    """URL of a static file, carrying its modification time as a version."""
+
+    path = os.path.join(current_app.static_folder, filename)
+
+    if current_app.debug or filename not in _static_versions:
+        try:
+            _static_versions[filename] = int(os.stat(path).st_mtime)
+        except OSError:
+            _static_versions[filename] = None
+
+    version = _static_versions[filename]
+    url = f"{current_app.static_url_path}/{filename}"
+    return f"{url}?v={version}" if version else url
+
+
+def add_cache_headers(resp):
+    """Apply the caching policy to responses that didn't set their own."""
+
+    if request.endpoint == "static":
+        if resp.status_code in (200, 304):
+            if request.args.get("v"):
+                max_age = current_app.config.get(
+                    "STATIC_MAX_AGE", DEFAULT_STATIC_MAX_AGE
+                )
+                resp.headers["Cache-Control"] = f"public, max-age={max_age}, immutable"
+            else:
+                resp.headers[
+                    "Cache-Control"
+                ] = f"public, max-age={UNVERSIONED_STATIC_MAX_AGE}"
+
+    elif "ETag" not in resp.headers and "Cache-Control" not in resp.headers:
+        resp.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+        resp.headers["Pragma"] = "no-cache"
+        resp.headers["Expires"] = "0"
+
+    return resp
+
+
+def init_app(app):
+    """Install the caching policy on `app`."""
+
+    app.add_template_global(static_url)
+    app.after_request(add_cache_headers)
@@ -0,0 +1,358 @@
+"""Avatars and header images, resized and served from a local cache.
+
+Users' `image_url` and `header_image_url` point anywhere, often at
+full-size photos. Templates instead call `thumbnail_url(url, size)`, naming
+one of the SIZES the page shows the image at, and get an /images/ URL for
+it. The first request for an image fetches it from its origin once, keeps
+the original under IMAGE_CACHE_DIR, and stores each size as it's asked
+for; later requests are sent from the disk. Images under /static (the
+defaults) are read from the static folder rather than fetched.
+
+The URL's path carries an HMAC of the origin URL (with SECRET_KEY), so the
+proxy only fetches images the app itself linked to, and a changed
+`image_url` gets a new URL. What's stored for a URL doesn't change, so
+responses are cached by browsers for IMAGE_MAX_AGE without revalidation.
+
+At most IMAGE_FETCH_CONCURRENCY origin fetches run at once per process;
+requests that can't get a slot within IMAGE_FETCH_TIMEOUT, and images that
+can't be fetched or read, are redirected to the origin, which the browser
+would have fetched before. Origins on private or loopback addresses are
+refused unless IMAGE_PROXY_ALLOW_PRIVATE is set (as for tests against a
+local server). It's the address a fetch actually connected to that's
+checked, not an earlier lookup of the host, so a DNS answer that changes
+in between can't point the proxy inside the network.
+
+Nothing is removed from the cache as it's served. `flask prune-images`
+(run it from cron, say hourly) deletes the oldest files until the cache is
+under IMAGE_CACHE_MAX_BYTES; an image pruned is fetched again when next
+asked for.
+"""
+
+import hashlib
+import hmac
+import io
+import ipaddress
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import click
+import requests
+from flask import abort, current_app, redirect, request, send_from_directory, url_for
+from PIL import Image, ImageOps
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from werkzeug.security import safe_join
+
+from assets import write_file
+
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+DEFAULT_FETCH_CONCURRENCY = 4
+DEFAULT_FETCH_TIMEOUT = 10
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_CACHE_MAX_BYTES = 1024 ** 3
+
+# Temporary files older than this were left by a crashed write
+STALE_TEMP_AGE = 60 * 60
+
+# name -> (width, height) of the box templates show an image in, doubled for
+# high-density screens. Square sizes are cropped to fill the box; a height
+# of None keeps the image's proportions. Images are never enlarged.
+SIZES = {
+    "nav": (64, 64),
+    "timeline": (96, 96),
+    "card": (140, 140),
+    "avatar": (400, 400),
+    "hero": (800, None),
+    "banner": (1600, None),
+}
+
+JPEG_QUALITY = 85
+
+fetch_concurrency = DEFAULT_FETCH_CONCURRENCY
+
+_fetch_slots = threading.BoundedSemaphore(fetch_concurrency)
+# Concurrent requests for an image take the same lock, so fetch it once.
+_locks = [threading.Lock() for _ in range(64)]
+
+
+class FetchError(Exception):
+    """An origin image that couldn't be fetched or read."""
+
+
+def image_key(url):
+    """The name `url`'s files are stored under (and its URL's check)."""
+
+    secret = current_app.config["SECRET_KEY"].encode()
+    return hmac.new(secret, url.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def thumbnail_url(url, size):
+    """URL of the image at `url`, as resized for `size`."""
+
+    if size not in SIZES:
+        raise ValueError(f"Unknown image size {size!r}")
+
+    if not url or not current_app.config.get("IMAGE_CACHE_DIR"):
+        return url
+    if not is_local(url) and urlsplit(url).scheme not in ("http", "https"):
+        return url
+
+    return url_for("images", size=size, key=image_key(url), url=url)
+
+
+def is_local(url):
+    return url.startswith(current_app.static_url_path + "/")
+
+
+def check_address(host, address):
+    """Raise FetchError unless `address` (of `host`) is public."""
+
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if not ip.is_global:
+        raise FetchError(f"{host} is on a private address")
+
+
+class _PublicOnly:
+    """Closes the connection unless its peer is on a public address."""
+
+    def _new_conn(self):
+        sock = super()._new_conn()
+        try:
+            check_address(self.host, sock.getpeername()[0])
+        except FetchError:
+            sock.close()
+            raise
+        return sock
+
+
+class _PublicHTTPConnection(_PublicOnly, HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicOnly, HTTPSConnection):
+    pass
+
+
+class _PublicHTTPPool(HTTPConnectionPool):
+    ConnectionCls = _PublicHTTPConnection
+
+
+class _PublicHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _PublicHTTPSConnection
+
+
+class PublicOnlyAdapter(HTTPAdapter):
+    """A transport that only talks to origins on public addresses."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _PublicHTTPPool,
+            "https": _PublicHTTPSPool,
+        }
+
+
+def origin_session():
+    """A requests Session for fetching from origins."""
+
+    session = requests.Session()
+    if not current_app.config.get("IMAGE_PROXY_ALLOW_PRIVATE"):
+        # an environment proxy would be the peer checked, not the origin
+        session.trust_env = False
+        session.mount("http://", PublicOnlyAdapter())
+        session.mount("https://", PublicOnlyAdapter())
+    return session
+
+
+def fetch(url):
+    """The bytes of the image at `url`, from its origin."""
+
+    if is_local(url):
+        name = url[len(current_app.static_url_path) + 1:].split("?")[0]
+        path = safe_join(current_app.static_folder, name)
+        try:
+            with open(path, "rb") as file:
+                return file.read()
+        except (OSError, TypeError) as exc:
+            raise FetchError(f"no static file {name}") from exc
+
+    config = current_app.config
+    timeout = config.get("IMAGE_FETCH_TIMEOUT", DEFAULT_FETCH_TIMEOUT)
+    max_bytes = config.get("IMAGE_MAX_BYTES", DEFAULT_MAX_BYTES)
+
+    if not _fetch_slots.acquire(timeout=timeout):
+        raise FetchError("too many fetches")
+    try:
+        with origin_session() as session, session.get(
+            url, timeout=timeout, stream=True, allow_redirects=False
+        ) as resp:
+            if resp.status_code != 200:
+                raise FetchError(f"{url} answered {resp.status_code}")
+
+            data = b""
+            for chunk in resp.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > max_bytes:
+                    raise FetchError(f"{url} is over {max_bytes} bytes")
+            return data
+    except requests.RequestException as exc:
+        raise FetchError(f"fetching {url} failed") from exc
+    finally:
+        _fetch_slots.release()
+
+
+def resize(data, size):
+    """`data` (an image) resized for `size`; return (bytes, extension)."""
+
+    width, height = SIZES[size]
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        raise FetchError("not an image") from exc
+
+    if height is not None:
+        # crop to the box's shape, then shrink
+        side = min(image.size)
+        image = ImageOps.fit(image, (side, side))
+    image.thumbnail((width, height or image.height))
+
+    output = io.BytesIO()
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        image.save(output, "PNG", optimize=True)
+        return output.getvalue(), "png"
+
+    image.convert("RGB").save(
+        output, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True
+    )
+    return output.getvalue(), "jpg"
+
+
+def _lock_for(key):
+    return _locks[int(key[:8], 16) % len(_locks)]
+
+
+def find_thumbnail(directory, size, key):
+    for ext in ("jpg", "png"):
+        name = f"{size}/{key}.{ext}"
+        if os.path.isfile(os.path.join(directory, name)):
+            return name
+    return None
+
+
+def make_thumbnail(directory, size, key, url):
+    """Store `url`'s image for `size`, fetching it if need be; return its name."""
+
+    with _lock_for(key):
+        name = find_thumbnail(directory, size, key)
+        if name:
+            return name
+
+        original = os.path.join(directory, "originals", key)
+        try:
+            with open(original, "rb") as file:
+                data = file.read()
+        except OSError:
+            data = fetch(url)
+            write_file(original, data)
+
+        thumbnail, ext = resize(data, size)
+        name = f"{size}/{key}.{ext}"
+        write_file(os.path.join(directory, name), thumbnail)
+        return name
+
+
+def serve_image(size, key):
+    """Send the image at the `url` param, resized for `size`."""
+
+    directory = current_app.config.get("IMAGE_CACHE_DIR")
+    url = request.args.get("url", "")
+    if (
+        not directory
+        or size not in SIZES
+        or not hmac.compare_digest(key, image_key(url))
+    ):
+        abort(404)
+
+    name = find_thumbnail(directory, size, key)
+    if name is None:
+        try:
+            name = make_thumbnail(directory, size, key, url)
+        except FetchError as exc:
+            current_app.logger.info("Not proxying image: %s", exc)
+            return redirect(url)
+
+    resp = send_from_directory(directory, name)
+    max_age = current_app.config.get("IMAGE_MAX_AGE", DEFAULT_MAX_AGE)
+    resp.headers["Cache-Control"] = f"public, max-age={max_age}, immutable"
+    return resp
+
+
+def prune(directory, max_bytes, now=None):
+    """Delete the oldest stored images until those left take at most
+    `max_bytes`, and temporary files left by failed writes; return
+    (files deleted, bytes left).
+    """
+
+    now = time.time() if now is None else now
+    files = []
+    deleted = 0
+
+    for parent, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(parent, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.startswith(".tmp-"):
+                if now - stat.st_mtime > STALE_TEMP_AGE:
+                    os.unlink(path)
+                    deleted += 1
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        deleted += 1
+
+    return deleted, total
+
+
+def init_app(app):
+    """Serve resized images at /images and add `thumbnail_url` to templates."""
+
+    global fetch_concurrency, _fetch_slots
+
+    fetch_concurrency = app.config.get(
+        "IMAGE_FETCH_CONCURRENCY", DEFAULT_FETCH_CONCURRENCY
+    )
+    _fetch_slots = threading.BoundedSemaphore(fetch_concurrency)
+
+    if app.config.get("IMAGE_CACHE_DIR"):
+        os.makedirs(app.config["IMAGE_CACHE_DIR"], exist_ok=True)
+
+    app.add_url_rule("/images/<size>/<key>", "images", serve_image)
+    app.add_template_global(thumbnail_url)
+
+    @app.cli.command("prune-images")
+    def prune_images():
+        """Delete the oldest cached images over IMAGE_CACHE_MAX_BYTES."""
+
+        directory = app.config.get("IMAGE_CACHE_DIR")
+        if not directory:
+            raise click.ClickException("IMAGE_CACHE_DIR isn't set")
+
+        max_bytes = app.config.get("IMAGE_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES)
+        deleted, left = prune(directory, max_bytes)
+        click.echo(f"Deleted {deleted} files; {left / 2**20:.1f} MB left")
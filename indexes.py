@@ -0,0 +1,150 @@
+"""Warbler's managed index set, and applying it to existing databases.
+
+The indexes the hot queries rely on are declared on the models (in their
+`__table_args__`, plus the Postgres-only username search indexes in
+`models.POSTGRES_INDEXES`). `db.create_all()` builds them for new tables but
+never touches tables that already exist, so `apply_indexes()` (the
+`flask apply-indexes` command) compares the declared set with what the
+database has and creates whatever is missing. On Postgres it builds them
+with CREATE INDEX CONCURRENTLY, so writes aren't blocked while it runs.
+
+Indexes are only ever added, never altered: rename an index to change its
+definition. `drop_indexes()` removes the whole managed set so bulk loads
+(see bulkload.py) don't maintain them row by row; `apply_indexes()` then
+rebuilds them.
+"""
+
+import click
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateIndex
+
+from models import db, POSTGRES_INDEXES
+
+
+def declared_indexes(dialect_name):
+    """{name: CREATE INDEX statement} for every index the models declare."""
+
+    declared = {}
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            declared[index.name] = (table.name, index)
+
+    if dialect_name == "postgresql":
+        for name, definition in POSTGRES_INDEXES.items():
+            declared[name] = ("users", f"CREATE INDEX {name} {definition}")
+
+    return declared
+
+
+def existing_indexes(bind):
+    """Names of the indexes (per table) the database already has."""
+
+    inspector = inspect(bind)
+    existing = {table: set() for table in inspector.get_table_names()}
+
+    if bind.dialect.name == "postgresql":
+        # The inspector skips expression indexes like the username ones
+        rows = bind.execute(
+            "SELECT tablename, indexname FROM pg_indexes"
+            " WHERE schemaname = current_schema()"
+        )
+        for table, name in rows:
+            existing.setdefault(table, set()).add(name)
+    else:
+        for table in existing:
+            existing[table] = {i["name"] for i in inspector.get_indexes(table)}
+
+    return existing
+
+
+def missing_indexes(bind):
+    """(name, CREATE INDEX statement) for declared indexes the database lacks.
+
+    Tables that don't exist yet are skipped; `db.create_all()` makes them
+    with their indexes.
+    """
+
+    existing = existing_indexes(bind)
+    missing = []
+
+    for name, (table, index) in declared_indexes(bind.dialect.name).items():
+        if table not in existing or name in existing[table]:
+            continue
+        if not isinstance(index, str):
+            index = str(CreateIndex(index).compile(dialect=bind.dialect))
+        missing.append((name, index))
+
+    return missing
+
+
+def apply_indexes(bind=None, dry_run=False, echo=None, concurrently=True):
+    """Create the declared indexes the database is missing.
+
+    Returns the names of the indexes created (or, with `dry_run`, that
+    would be). Pass `concurrently=False` when nothing else is writing, to
+    build them in one pass instead of Postgres's slower concurrent build.
+    """
+
+    bind = bind or db.engine
+    missing = missing_indexes(bind)
+
+    if dry_run:
+        for name, statement in missing:
+            if echo:
+                echo(statement)
+        return [name for name, _ in missing]
+
+    concurrently = concurrently and bind.dialect.name == "postgresql"
+
+    for name, statement in missing:
+        if concurrently:
+            # CONCURRENTLY can't run inside a transaction
+            statement = statement.replace(
+                "CREATE INDEX ", "CREATE INDEX CONCURRENTLY ", 1
+            )
+            with bind.connect() as conn:
+                conn.execution_options(isolation_level="AUTOCOMMIT").execute(
+                    statement
+                )
+        else:
+            with bind.begin() as conn:
+                conn.execute(statement)
+
+        if echo:
+            echo(f"Created {name}")
+
+    return [name for name, _ in missing]
+
+
+def drop_indexes(bind=None, echo=None):
+    """Drop every managed index the database has. Returns their names."""
+
+    bind = bind or db.engine
+    existing = existing_indexes(bind)
+    dropped = []
+
+    for name, (table, _) in declared_indexes(bind.dialect.name).items():
+        if name not in existing.get(table, ()):
+            continue
+
+        with bind.begin() as conn:
+            conn.execute(f"DROP INDEX {name}")
+        dropped.append(name)
+
+        if echo:
+            echo(f"Dropped {name}")
+
+    return dropped
+
+
+def init_app(app):
+    """Register the index CLI commands on `app`."""
+
+    @app.cli.command("apply-indexes")
+    @click.option("--dry-run", is_flag=True, help="Print the SQL; don't run it.")
+    def apply_indexes_command(dry_run):
+        """Create any declared indexes the database doesn't have yet."""
+
+        applied = apply_indexes(dry_run=dry_run, echo=click.echo)
+        click.echo(f"{len(applied)} missing indexes")
@@ -0,0 +1,221 @@
+"""Like/unlike writes, optionally buffered (write-behind).
+
+Every like and unlike goes through `Like.apply`, which is idempotent: a
+double-clicked like or an unlike of something not liked does nothing.
+
+By default each one is applied and committed in its request. With
+LIKES_WRITE_BEHIND on, they're recorded in a per-process buffer instead,
+keyed by (user, message) so a burst of toggles collapses to its final
+state, and a background thread applies the whole buffer in one transaction
+every LIKES_FLUSH_INTERVAL seconds, or as soon as LIKES_FLUSH_SIZE are
+waiting. A viral message's likes_count is then updated once per flush
+rather than once per like, and the writes don't hold up the requests.
+
+Either way, the likes and unlikes that took effect are then counted
+towards trending (see trending.py).
+
+Read-your-writes: the acting user's session remembers their recent
+unflushed toggles, and `liked_ids_for` lays those over what's in the
+database, so whichever worker serves their next page shows the stars they
+just set. (Counters, and the list of liked messages, catch up at the next
+flush.)
+"""
+
+import atexit
+import logging
+import threading
+import time
+
+from flask import current_app, session
+
+import trending
+from models import db, Message, Like
+
+logger = logging.getLogger("warbler.likes")
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_FLUSH_SIZE = 500
+
+PENDING_KEY = "pending_likes"
+
+
+class LikeBuffer:
+    """Unflushed likes and unlikes: {(user_id, message_id): liked}."""
+
+    def __init__(self):
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, user_id, message_id, liked):
+        """Record a like or unlike, replacing any earlier one of the pair."""
+
+        with self.lock:
+            self.pending[(user_id, message_id)] = liked
+            return len(self.pending)
+
+    def take(self):
+        """Remove and return everything pending."""
+
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            return pending
+
+    def restore(self, changes):
+        """Put back `changes` that failed to flush, unless since overridden."""
+
+        with self.lock:
+            for pair, liked in changes.items():
+                self.pending.setdefault(pair, liked)
+
+
+buffer = LikeBuffer()
+
+_wakeup = threading.Event()
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def flush():
+    """Apply everything in the buffer in one transaction; return the count.
+
+    Needs an app context. If the transaction fails, the changes go back in
+    the buffer for the next flush.
+    """
+
+    changes = buffer.take()
+    if not changes:
+        return 0
+
+    try:
+        changed = Like.apply(changes)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        buffer.restore(changes)
+        raise
+
+    trending.record(changed)
+    return len(changes)
+
+
+def _flush_forever(app):
+    interval = app.config.get("LIKES_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)
+
+    while True:
+        _wakeup.wait(interval)
+        _wakeup.clear()
+
+        with app.app_context():
+            try:
+                flush()
+            except Exception:
+                logger.exception("Flushing %d buffered likes failed", len(buffer))
+            finally:
+                db.session.remove()
+
+
+def _start_flusher(app):
+    """Start this process's flusher thread, if it isn't running yet.
+
+    Started on first use rather than at import, so it runs in each worker
+    process rather than a pre-fork parent.
+    """
+
+    global _flusher
+
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(
+                target=_flush_forever, args=(app,), name="like-flusher", daemon=True
+            )
+            _flusher.start()
+            atexit.register(_flush_at_exit, app)
+
+
+def _flush_at_exit(app):
+    with app.app_context():
+        flush()
+
+
+def _pending_ttl():
+    """How long the session overlays a toggle: a few flushes' worth."""
+
+    interval = current_app.config.get("LIKES_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)
+    return 3 * interval + 1
+
+
+def pending_for(user):
+    """`user`'s recent unflushed toggles from their session: {message_id: liked}."""
+
+    pending = session.get(PENDING_KEY)
+    if not user or not pending or pending["user_id"] != user.id:
+        return {}
+
+    since = time.time() - _pending_ttl()
+    return {
+        int(message_id): liked
+        for message_id, (liked, at) in pending["likes"].items()
+        if at > since
+    }
+
+
+def _remember(user, message_id, liked):
+    """Note a buffered toggle in the acting user's session."""
+
+    since = time.time() - _pending_ttl()
+    pending = session.get(PENDING_KEY)
+
+    if pending and pending["user_id"] == user.id:
+        recent = {
+            key: value for key, value in pending["likes"].items() if value[1] > since
+        }
+    else:
+        recent = {}
+
+    recent[str(message_id)] = [liked, time.time()]
+    session[PENDING_KEY] = dict(user_id=user.id, likes=recent)
+
+
+def set_liked(user, message_id, liked):
+    """Like (or unlike) `message_id` as `user`, now or write-behind."""
+
+    config = current_app.config
+
+    if not config.get("LIKES_WRITE_BEHIND"):
+        changed = Like.apply({(user.id, message_id): liked})
+        db.session.commit()
+        trending.record(changed)
+        return
+
+    _start_flusher(current_app._get_current_object())
+    waiting = buffer.add(user.id, message_id, liked)
+    _remember(user, message_id, liked)
+
+    if waiting >= config.get("LIKES_FLUSH_SIZE", DEFAULT_FLUSH_SIZE):
+        _wakeup.set()
+
+
+def like(user, message_id):
+    set_liked(user, message_id, True)
+
+
+def unlike(user, message_id):
+    set_liked(user, message_id, False)
+
+
+def liked_ids_for(message_ids, user):
+    """Which of `message_ids` `user` likes, counting their unflushed toggles."""
+
+    liked = Message.liked_ids_for(message_ids, user)
+
+    for message_id, is_liked in pending_for(user).items():
+        if message_id in message_ids:
+            if is_liked:
+                liked.add(message_id)
+            else:
+                liked.discard(message_id)
+
+    return liked
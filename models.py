@@ -1,12 +1,16 @@
 """SQLAlchemy models for Warbler."""
 
+from collections import Counter
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from flask import abort
+from sqlalchemy import DDL, bindparam, event, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from passwords import hash_password, check_password, needs_rehash
+from replicas import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
 
 
 class FollowersFollowee(db.Model):
@@ -22,6 +26,12 @@ class FollowersFollowee(db.Model):
         db.Integer, db.ForeignKey("users.id", ondelete="cascade"), primary_key=True
     )
 
+    # The primary key only serves lookups by followee_id; this serves the
+    # reverse direction (followers pages, counters, timeline fan-out).
+    __table_args__ = (
+        db.Index("ix_follows_follower_followee", "follower_id", "followee_id"),
+    )
+
 
 class User(db.Model):
     """User in the system."""
@@ -44,6 +54,40 @@ class User(db.Model):
 
     password = db.Column(db.Text, nullable=False)
 
+    # Authors with too many followers to fan out to on every post; their
+    # messages are merged into followers' timelines at read time instead.
+    is_high_fanout = db.Column(
+        db.Boolean, nullable=False, default=False, server_default=db.false()
+    )
+
+    # Denormalized counts, kept up to date by counters.py (and repaired in
+    # bulk by `flask reconcile-counters`) so profiles don't run COUNT(*)s.
+    messages_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+
+    following_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+
+    followers_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+
+    likes_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+
+    # Set when the account is deleted; its rows are then purged in the
+    # background (see accounts.py), the users row last.
+    deleted_at = db.Column(db.DateTime)
+
+    # Who-to-follow fills short lists with the most-followed users
+    # (recommend.popular), read off this index in order rather than sorted
+    __table_args__ = (
+        db.Index("ix_users_followers_count", followers_count.desc(), id),
+    )
+
     messages = db.relationship("Message", backref="user", lazy="dynamic")
 
     followers = db.relationship(
@@ -55,7 +99,9 @@ class User(db.Model):
         lazy="dynamic",
     )
 
-    likes = db.relationship("Like", backref="user", lazy="dynamic")
+    likes = db.relationship(
+        "Like", backref="user", lazy="dynamic", passive_deletes=True
+    )
 
     liked_messages = db.relationship(
         "Message",
@@ -77,6 +123,34 @@ class User(db.Model):
 
         return bool(self.following.filter_by(id=other_user.id).first())
 
+    @classmethod
+    def get_active_or_404(cls, user_id):
+        """The user with `user_id`; 404 if there's none or it's been deleted."""
+
+        user = cls.query.get_or_404(user_id)
+        if user.deleted_at is not None:
+            abort(404)
+        return user
+
+    @classmethod
+    def followed_ids_for(cls, user_ids, user):
+        """Which of `user_ids` does `user` follow?
+
+        Resolves follow state for a whole page of users in one query;
+        returns a set of user ids (empty if there's no user).
+        """
+
+        if not user or not user_ids:
+            return set()
+
+        # (followee_id=A, follower_id=B) means A follows B
+        rows = db.session.query(FollowersFollowee.follower_id).filter(
+            FollowersFollowee.followee_id == user.id,
+            FollowersFollowee.follower_id.in_(user_ids),
+        )
+
+        return {user_id for (user_id,) in rows}
+
     @classmethod
     def signup(cls, username, email, password, image_url):
         """Sign up user.
@@ -84,7 +158,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode("UTF-8")
+        hashed_pwd = hash_password(password)
 
         user = User(
             username=username, email=email, password=hashed_pwd, image_url=image_url
@@ -102,18 +176,52 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        An empty password fails without running bcrypt at all. A correct
+        password whose hash used an outdated cost factor is re-hashed at the
+        current cost (and committed).
         """
 
-        user = cls.query.filter_by(username=username).first()
+        if not password:
+            return False
+
+        user = cls.query.filter_by(username=username, deleted_at=None).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = check_password(user.password, password)
             if is_auth:
+                if needs_rehash(user.password):
+                    user.password = hash_password(password)
+                    db.session.commit()
                 return user
 
         return False
 
 
+# Username search indexes (see search.py). Postgres only: a trigram GIN index
+# for substring/fuzzy matches and a pattern-ops btree for prefix matches.
+# indexes.py adds these (and the indexes declared on the models) to
+# existing databases.
+
+POSTGRES_INDEXES = {
+    "ix_users_username_trgm": "ON users USING gin (lower(username) gin_trgm_ops)",
+    "ix_users_username_prefix": "ON users (lower(username) text_pattern_ops)",
+}
+
+event.listen(
+    User.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+for name, definition in POSTGRES_INDEXES.items():
+    event.listen(
+        User.__table__,
+        "after_create",
+        DDL(f"CREATE INDEX {name} {definition}").execute_if(dialect="postgresql"),
+    )
+
+
 class Message(db.Model):
     """An individual message ("warble")."""
 
@@ -123,13 +231,24 @@ class Message(db.Model):
 
     text = db.Column(db.String(140), nullable=False)
 
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow())
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
     user_id = db.Column(
         db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False
     )
 
-    likes = db.relationship("Like", backref="message", lazy="dynamic")
+    likes_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+
+    likes = db.relationship(
+        "Like", backref="message", lazy="dynamic", passive_deletes=True
+    )
+
+    # Profile pages read a user's messages newest-first, keyset on (timestamp, id)
+    __table_args__ = (
+        db.Index("ix_messages_user_timestamp", "user_id", "timestamp", "id"),
+    )
 
     # "Fat models, thin views"
 
@@ -138,23 +257,41 @@ class Message(db.Model):
 
         return bool(self.liking_users.filter_by(id=user.id).first())
 
+    @classmethod
+    def liked_ids_for(cls, message_ids, user):
+        """Which of `message_ids` does `user` like?
+
+        Resolves liked state for a whole page of messages in one query;
+        returns a set of message ids (empty if there's no user).
+        """
+
+        if not user or not message_ids:
+            return set()
+
+        rows = db.session.query(Like.message_id).filter(
+            Like.user_id == user.id, Like.message_id.in_(message_ids)
+        )
+
+        return {message_id for (message_id,) in rows}
+
     def like(self, user):
-        """when a message is liked, adds like to database"""
+        """when a message is liked, adds like to database
 
-        new_like = Like(user_id=user.id, message_id=self.id)
+        Liking a message twice is harmless (see `Like.apply`).
+        """
 
-        db.session.add(new_like)
+        Like.apply({(user.id, self.id): True})
         db.session.commit()
 
         return self
 
     def unlike(self, user):
-        """when a messae is unliked, delete like from database"""
+        """when a messae is unliked, delete like from database
+
+        Unliking a message that isn't liked is harmless.
+        """
 
-        like = Like.query.filter(
-            Like.message_id == self.id, Like.user_id == user.id
-        ).first()
-        db.session.delete(like)
+        Like.apply({(user.id, self.id): False})
         db.session.commit()
 
         return self
@@ -173,6 +310,250 @@ class Like(db.Model):
         db.Integer, db.ForeignKey("messages.id", ondelete="cascade"), primary_key=True
     )
 
+    # When liked, so an unlike takes off what the like added to trending.
+    # NULL for likes older than the column.
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # The primary key serves a user's likes; this serves a message's likers
+    # (unlike, like counts, deleting a message).
+    __table_args__ = (
+        db.Index("ix_likes_message_user", "message_id", "user_id"),
+    )
+
+    @classmethod
+    def apply(cls, changes):
+        """Like or unlike many messages at once, idempotently.
+
+        `changes` maps (user_id, message_id) to True (like) or False (unlike).
+        Liking what's already liked, unliking what isn't, and liking a message
+        or as a user that no longer exists all do nothing. The likes counters
+        move by what actually changed, one UPDATE per message and per user.
+
+        Runs in the session's transaction (the caller commits); returns the
+        {(user_id, message_id): (liked, liked_at)} that changed, where
+        `liked_at` is when the like was made (for an unlike, the like it
+        removed; None if that's unknown).
+        """
+
+        conn = db.session.connection()
+        now = datetime.utcnow()
+
+        wanted = [pair for pair, liked in changes.items() if liked]
+        unwanted = [pair for pair, liked in changes.items() if not liked]
+
+        if wanted:
+            live_users = _existing_ids(conn, User, {u for u, _ in wanted})
+            live_messages = _existing_ids(conn, Message, {m for _, m in wanted})
+            wanted = [
+                (u, m) for u, m in wanted if u in live_users and m in live_messages
+            ]
+
+        added = _insert_new_likes(conn, wanted, now)
+        changed = {pair: (True, now) for pair in added}
+        changed.update(
+            (pair, (False, liked_at))
+            for pair, liked_at in _delete_likes(conn, unwanted)
+        )
+
+        message_deltas = Counter()
+        user_deltas = Counter()
+        for (user_id, message_id), (liked, _) in changed.items():
+            message_deltas[message_id] += 1 if liked else -1
+            user_deltas[user_id] += 1 if liked else -1
+
+        _add_to_likes_counts(conn, Message.__table__, message_deltas)
+        _add_to_likes_counts(conn, User.__table__, user_deltas)
+
+        return changed
+
+
+def _existing_ids(conn, model, ids):
+    rows = conn.execute(select([model.id]).where(model.id.in_(ids)))
+    return {id for (id,) in rows}
+
+
+def _insert_new_likes(conn, pairs, now):
+    """Insert likes for `pairs` at `now`, skipping existing ones; return
+    those added.
+    """
+
+    likes = Like.__table__
+
+    if not pairs:
+        return []
+
+    if conn.dialect.name == "postgresql":
+        stmt = (
+            pg_insert(likes)
+            .values(
+                [dict(user_id=u, message_id=m, timestamp=now) for u, m in pairs]
+            )
+            .on_conflict_do_nothing()
+            .returning(likes.c.user_id, likes.c.message_id)
+        )
+        return [tuple(row) for row in conn.execute(stmt)]
+
+    stmt = likes.insert().prefix_with("OR IGNORE", dialect="sqlite")
+    return [
+        (u, m)
+        for u, m in pairs
+        if conn.execute(
+            stmt.values(user_id=u, message_id=m, timestamp=now)
+        ).rowcount
+    ]
+
+
+def _delete_likes(conn, pairs):
+    """Delete the likes for `pairs` that exist; return [(pair, liked_at)]
+    of those removed.
+    """
+
+    likes = Like.__table__
+
+    if not pairs:
+        return []
+
+    if conn.dialect.name == "postgresql":
+        stmt = (
+            likes.delete()
+            .where(tuple_(likes.c.user_id, likes.c.message_id).in_(pairs))
+            .returning(likes.c.user_id, likes.c.message_id, likes.c.timestamp)
+        )
+        return [((u, m), at) for u, m, at in conn.execute(stmt)]
+
+    removed = []
+    for u, m in pairs:
+        where = (likes.c.user_id == u) & (likes.c.message_id == m)
+        row = conn.execute(select([likes.c.timestamp]).where(where)).first()
+        if row and conn.execute(likes.delete().where(where)).rowcount:
+            removed.append(((u, m), row[0]))
+    return removed
+
+
+def _add_to_likes_counts(conn, table, deltas):
+    """Add `deltas` ({row id: n}) to `table`'s likes_count, in id order."""
+
+    params = [
+        dict(row_id=row_id, delta=delta)
+        for row_id, delta in sorted(deltas.items())
+        if delta
+    ]
+
+    if params:
+        conn.execute(
+            table.update()
+            .where(table.c.id == bindparam("row_id"))
+            .values(likes_count=table.c.likes_count + bindparam("delta")),
+            params,
+        )
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into one user's home timeline."""
+
+    __tablename__ = "timelines"
+
+    owner_id = db.Column(
+        db.Integer, db.ForeignKey("users.id", ondelete="cascade"), primary_key=True
+    )
+
+    message_id = db.Column(
+        db.Integer, db.ForeignKey("messages.id", ondelete="cascade"), primary_key=True
+    )
+
+    author_id = db.Column(
+        db.Integer, db.ForeignKey("users.id", ondelete="cascade"), nullable=False
+    )
+
+    timestamp = db.Column(db.DateTime, nullable=False)
+
+    message = db.relationship("Message")
+
+    __table_args__ = (
+        db.Index(
+            "ix_timelines_owner_timestamp", "owner_id", "timestamp", "message_id"
+        ),
+        db.Index("ix_timelines_owner_author", "owner_id", "author_id"),
+        db.Index("ix_timelines_message_id", "message_id"),
+        db.Index("ix_timelines_author_id", "author_id"),
+    )
+
+
+class Suggestion(db.Model):
+    """A precomputed who-to-follow suggestion (see recommend.py)."""
+
+    __tablename__ = "suggestions"
+
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("users.id", ondelete="cascade"), primary_key=True
+    )
+
+    rank = db.Column(db.Integer, primary_key=True)
+
+    suggested_id = db.Column(
+        db.Integer, db.ForeignKey("users.id", ondelete="cascade"), nullable=False
+    )
+
+    # How many of the people `user_id` follows follow `suggested_id`
+    score = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (db.Index("ix_suggestions_suggested_id", "suggested_id"),)
+
+
+class TrendingScore(db.Model):
+    """A message's time-decayed like score, as last snapshotted (see trending.py)."""
+
+    __tablename__ = "trending"
+
+    message_id = db.Column(
+        db.Integer, db.ForeignKey("messages.id", ondelete="cascade"), primary_key=True
+    )
+
+    # log2 of the message's likes, each weighted 2 ** (liked at / half-life)
+    score = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (db.Index("ix_trending_score", "score", "message_id"),)
+
+
+class AccountPurge(db.Model):
+    """A deleted account's purge and its progress (see accounts.py)."""
+
+    __tablename__ = "account_purges"
+
+    # Not a foreign key: the purge outlives the users row it deletes.
+    user_id = db.Column(db.Integer, primary_key=True)
+
+    # The step the purge is on, or last finished
+    stage = db.Column(db.Text, nullable=False)
+
+    rows_deleted = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+
+    requested_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    finished_at = db.Column(db.DateTime)
+
+
+class FollowEvent(db.Model):
+    """A follow or unfollow, for other processes' follow graphs (see
+    followgraph.py)."""
+
+    __tablename__ = "follow_events"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # Not foreign keys: events outlive purged accounts' follows.
+    follower_id = db.Column(db.Integer, nullable=False)
+
+    followed_id = db.Column(db.Integer, nullable=False)
+
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.Index("ix_follow_events_created_at", "created_at"),)
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -0,0 +1,218 @@
+"""Keyset (cursor) pagination for Warbler's list views.
+
+Instead of OFFSET, each page remembers the sort key of its first and last
+rows in an opaque `cursor` token; the next page asks for rows strictly past
+that key, e.g. `(timestamp, id) < (:ts, :id)`, which is a range read on an
+index whose trailing columns are the sort key. Page cost stays flat however
+deep you go or however big the account is.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from flask import abort, current_app, request, url_for
+from sqlalchemy import bindparam, tuple_
+from sqlalchemy.types import DateTime
+
+PER_PAGE = 50
+
+# Directions a cursor can point in, relative to the list's own sort order.
+NEXT = "next"
+PREV = "prev"
+
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+class Cursor:
+    """A decoded cursor: which way to page, and the key to page from."""
+
+    def __init__(self, direction=NEXT, values=None):
+        self.direction = direction
+        self.values = values
+
+    @property
+    def is_first_page(self):
+        return self.values is None
+
+
+class KeysetPage:
+    """One page of results plus the cursors to the pages on either side."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(direction, values):
+    """Pack a direction and key values into an opaque URL-safe token."""
+
+    values = [
+        v.strftime(DATETIME_FORMAT) if isinstance(v, datetime) else v for v in values
+    ]
+    raw = json.dumps([direction, values], separators=(",", ":")).encode("utf-8")
+
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _is_key_value(value, python_type):
+    """Could JSON `value` be a value of a column of `python_type`?"""
+
+    if isinstance(value, bool):
+        return False
+    if python_type is float:
+        return isinstance(value, (int, float))
+    return isinstance(value, python_type)
+
+
+def decode_cursor(token, columns):
+    """Unpack a token made by `encode_cursor` for a key of `columns`.
+
+    Raises ValueError if the token is malformed.
+    """
+
+    if not token:
+        return Cursor()
+
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        direction, values = json.loads(raw.decode("utf-8"))
+
+        if (
+            direction not in (NEXT, PREV)
+            or not isinstance(values, list)
+            or len(values) != len(columns)
+        ):
+            raise ValueError
+
+        decoded = []
+        for column, value in zip(columns, values):
+            if isinstance(column.type, DateTime):
+                value = datetime.strptime(value, DATETIME_FORMAT)
+            elif not _is_key_value(value, column.type.python_type):
+                raise ValueError
+            decoded.append(value)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError(f"Malformed cursor {token!r}")
+
+    return Cursor(direction, tuple(decoded))
+
+
+def cursor_from_request(columns):
+    """Decode the `cursor` query-string argument, or 400 if it's bogus."""
+
+    try:
+        return decode_cursor(request.args.get("cursor"), columns)
+    except ValueError:
+        abort(400)
+
+
+def _is_descending(cursor, descending):
+    """Which way to sort rows when fetching in `cursor`'s direction."""
+
+    return descending != (cursor.direction == PREV)
+
+
+def apply_keyset(query, columns, cursor, per_page=PER_PAGE, descending=True):
+    """Restrict `query` to the rows just past `cursor`, ordered by `columns`.
+
+    Fetches one extra row so `build_page` can tell whether there's more.
+    """
+
+    condition, order = keyset_clauses(columns, cursor, descending)
+    if condition is not None:
+        query = query.filter(condition)
+
+    return query.order_by(None).order_by(*order).limit(per_page + 1)
+
+
+def keyset_clauses(columns, cursor, descending=True):
+    """The (filter or None, order_by clauses) that `apply_keyset` adds.
+
+    For building keyset queries without an ORM Query (see asyncapi.py).
+    """
+
+    fetch_descending = _is_descending(cursor, descending)
+    condition = None
+
+    if not cursor.is_first_page:
+        key = tuple_(*columns)
+        bound = tuple_(
+            *[
+                bindparam(None, value, type_=column.type)
+                for column, value in zip(columns, cursor.values)
+            ]
+        )
+        condition = key < bound if fetch_descending else key > bound
+
+    order = [c.desc() if fetch_descending else c.asc() for c in columns]
+
+    return condition, order
+
+
+def build_page(rows, key, cursor, per_page=PER_PAGE):
+    """Turn rows fetched by `apply_keyset` into a KeysetPage.
+
+    `key(row)` returns the row's sort-key values, in cursor column order.
+    """
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if cursor.direction == PREV:
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, not cursor.is_first_page
+
+    if not rows:
+        return KeysetPage([])
+
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(NEXT, key(rows[-1])) if has_next else None,
+        prev_cursor=encode_cursor(PREV, key(rows[0])) if has_prev else None,
+    )
+
+
+def paginate(query, columns, per_page=None, descending=True, key=None):
+    """Return the KeysetPage of `query` named by the request's `cursor` arg.
+
+    `columns` are the sort key (ending in something unique, like an id).
+    `key(row)` returns a row's values for them; by default they're read
+    from the row's attributes of the same names. `per_page` defaults to
+    the PER_PAGE config value.
+    """
+
+    per_page = per_page or current_app.config.get("PER_PAGE", PER_PAGE)
+    cursor = cursor_from_request(columns)
+    rows = apply_keyset(query, columns, cursor, per_page, descending).all()
+
+    if key is None:
+
+        def key(row):
+            return tuple(getattr(row, column.key) for column in columns)
+
+    return build_page(rows, key, cursor, per_page)
+
+
+def page_url(cursor):
+    """URL of the current view with its `cursor` argument set to `cursor`."""
+
+    args = request.args.to_dict()
+    args["cursor"] = cursor
+
+    return url_for(request.endpoint, **dict(request.view_args, **args))
+
+
+def init_app(app):
+    """Make the pagination helpers available to templates."""
+
+    app.add_template_global(page_url)
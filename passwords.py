@@ -0,0 +1,130 @@
+"""Password hashing for Warbler, off the request thread.
+
+bcrypt is deliberately slow. Rather than every request thread hashing at
+once and fighting over the CPUs, hashes and checks run on a small, bounded
+pool of worker threads (bcrypt releases the GIL), so under load logins queue
+for a worker instead of all slowing down together. `stats()` reports the
+queue depth.
+
+The cost factor comes from BCRYPT_LOG_ROUNDS; `needs_rehash()` spots hashes
+made with a lower cost so they can be upgraded at the next login. Hashes are
+never downgraded, so a cheap cost in a dev or test profile doesn't weaken
+the hashes it logs in with.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_LOG_ROUNDS = 12
+
+log_rounds = DEFAULT_LOG_ROUNDS
+max_workers = os.cpu_count() or 2
+# How many hash jobs may wait for a worker before callers block.
+max_queued = 64
+
+_bcrypt = None
+_executor = None
+_slots = None
+_lock = threading.Lock()
+_stats = dict(queued=0, running=0, completed=0, max_queued=0)
+
+
+def get_bcrypt():
+    """Flask-Bcrypt, imported on first use so app startup doesn't pay for it."""
+
+    global _bcrypt
+
+    if _bcrypt is None:
+        from flask_bcrypt import Bcrypt
+
+        _bcrypt = Bcrypt()
+
+    return _bcrypt
+
+
+def _get_executor():
+    """The worker pool, started on first use."""
+
+    global _executor, _slots
+
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _slots = threading.BoundedSemaphore(max_workers + max_queued)
+                _executor = ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix="bcrypt"
+                )
+
+    return _executor
+
+
+def _run(fn, *args):
+    """Run `fn(*args)` on the pool and wait for its result."""
+
+    executor = _get_executor()
+    _slots.acquire()
+
+    with _lock:
+        _stats["queued"] += 1
+        _stats["max_queued"] = max(_stats["max_queued"], _stats["queued"])
+
+    def job():
+        with _lock:
+            _stats["queued"] -= 1
+            _stats["running"] += 1
+        try:
+            return fn(*args)
+        finally:
+            with _lock:
+                _stats["running"] -= 1
+                _stats["completed"] += 1
+            _slots.release()
+
+    return executor.submit(job).result()
+
+
+def hash_password(password):
+    """bcrypt hash (as text) of `password` at the configured cost."""
+
+    pw_hash = _run(get_bcrypt().generate_password_hash, password, log_rounds)
+    return pw_hash.decode("UTF-8")
+
+
+def check_password(pw_hash, password):
+    """Does `password` match `pw_hash`?"""
+
+    return _run(get_bcrypt().check_password_hash, pw_hash, password)
+
+
+def hash_cost(pw_hash):
+    """The cost factor a bcrypt hash was made with, or None if unparseable."""
+
+    try:
+        return int(pw_hash.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def needs_rehash(pw_hash):
+    """Was `pw_hash` made with a lower cost than we use now?"""
+
+    cost = hash_cost(pw_hash)
+    return cost is None or cost < log_rounds
+
+
+def stats():
+    """Queue depth, running and completed counts for the hashing pool."""
+
+    with _lock:
+        return dict(_stats, workers=max_workers)
+
+
+def init_app(app):
+    """Configure cost and pool size from `app`'s config."""
+
+    global log_rounds, max_workers, max_queued
+
+    log_rounds = app.config.get("BCRYPT_LOG_ROUNDS", DEFAULT_LOG_ROUNDS)
+    max_workers = app.config.get("PASSWORD_HASH_WORKERS", max_workers)
+    max_queued = app.config.get("PASSWORD_HASH_QUEUE", max_queued)
@@ -0,0 +1,143 @@
+"""Query-plan checks for Warbler's hot queries.
+
+`capture_plans()` records the queries run while it's active (say, while a
+test client requests a page); `check_plans()` then runs EXPLAIN on each and
+reports the ones that would read a whole table or sort their results rather
+than reading them in order from an index. test_query_plans.py uses it to
+catch a route regressing to a sequential scan.
+
+Test databases are tiny, so on Postgres the planner would happily seq-scan
+everything; the checks run with `enable_seqscan` and `enable_sort` off, so a
+Seq Scan or Sort that's still in the plan means no index can serve it. On
+SQLite, `EXPLAIN QUERY PLAN` reports the access path chosen from the schema
+alone.
+"""
+
+import re
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from models import db
+
+CHECKED_STATEMENTS = ("SELECT", "UPDATE", "DELETE")
+
+# SQLite: "SCAN users" / "SCAN TABLE users" (older versions) without an index
+SQLITE_SCAN = re.compile(r"\bSCAN (?:TABLE )?(\w+)(?!.*\bUSING\b)")
+SQLITE_SORT = "USE TEMP B-TREE FOR ORDER BY"
+
+POSTGRES_SCAN = re.compile(r"\bSeq Scan on (\w+)")
+POSTGRES_SORT = re.compile(r"^\s*(?:->\s*)?Sort\b")
+
+
+class PlanProblem:
+    """A captured statement whose plan scans a table or sorts."""
+
+    def __init__(self, statement, plan, reasons):
+        self.statement = statement
+        self.plan = plan
+        self.reasons = reasons
+
+    def __str__(self):
+        plan = "\n".join(f"    {line}" for line in self.plan)
+        return f"{', '.join(self.reasons)}:\n  {self.statement}\n{plan}"
+
+
+@contextmanager
+def capture_plans(engine=None):
+    """Record (statement, parameters) of the queries run in the block.
+
+    Only SELECTs, UPDATEs and DELETEs are kept (their plans are where a
+    missing index shows up). Yields the list they're appended to.
+    """
+
+    engine = engine or db.engine
+    captured = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        verb = statement.lstrip()[:6].upper()
+        if not executemany and verb in CHECKED_STATEMENTS:
+            captured.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield captured
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def explain(statement, parameters, engine=None):
+    """The plan for `statement`, as a list of lines."""
+
+    engine = engine or db.engine
+    conn = engine.raw_connection()
+
+    try:
+        cursor = conn.cursor()
+
+        if engine.dialect.name == "postgresql":
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("SET LOCAL enable_sort = off")
+            cursor.execute("EXPLAIN " + statement, parameters)
+            plan = [row[0] for row in cursor.fetchall()]
+        else:
+            cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            plan = [row[-1] for row in cursor.fetchall()]
+
+        cursor.close()
+        conn.rollback()
+    finally:
+        conn.close()
+
+    return plan
+
+
+def plan_problems(plan, dialect_name, tables):
+    """Why `plan` isn't index-backed (empty if it is).
+
+    Only scans of `tables` count; scans of subqueries or constant rows
+    are fine.
+    """
+
+    reasons = []
+
+    for line in plan:
+        if dialect_name == "postgresql":
+            scan = POSTGRES_SCAN.search(line)
+            sort = POSTGRES_SORT.search(line)
+        else:
+            scan = SQLITE_SCAN.search(line)
+            sort = SQLITE_SORT in line
+
+        if scan and scan.group(1) in tables:
+            reasons.append(f"scans {scan.group(1)}")
+        if sort:
+            reasons.append("sorts")
+
+    return reasons
+
+
+def check_plans(captured, engine=None, allow_scans=()):
+    """PlanProblems for the captured statements that aren't index-backed.
+
+    `allow_scans` names tables a full (but LIMITed, in-order) read of is
+    expected, e.g. the paginated user list.
+    """
+
+    engine = engine or db.engine
+    tables = set(db.metadata.tables) - set(allow_scans)
+    problems = []
+    seen = set()
+
+    for statement, parameters in captured:
+        if statement in seen:
+            continue
+        seen.add(statement)
+
+        plan = explain(statement, parameters, engine)
+        reasons = plan_problems(plan, engine.dialect.name, tables)
+        if reasons:
+            problems.append(PlanProblem(statement, plan, reasons))
+
+    return problems
@@ -0,0 +1,241 @@
+"""Per-request SQL instrumentation and query budgets.
+
+A lightweight stand-in for the debug toolbar's SQL panel that's cheap enough
+to leave on in production. For a sample of requests (QUERY_STATS_SAMPLE_RATE,
+0 to 1) engine events record every statement and its duration; the response
+gets X-Query-Count and X-Query-Time headers, and one JSON line goes to the
+`warbler.sql` logger with the slowest statements and any statement shape
+repeated N_PLUS_ONE_THRESHOLD or more times (usually an N+1 query from a
+template loop).
+
+Views declare how many queries they may run with `@query_budget(n)`. Going
+over is logged as a warning; with QUERY_BUDGET_ENFORCE on (as in the tests)
+it raises QueryBudgetExceeded, and budgeted views are measured on every
+request rather than a sample. Queries run inside `exempt()` (filling a
+per-process cache on first use) are reported but not charged to the budget.
+"""
+
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import db
+
+logger = logging.getLogger("warbler.sql")
+
+DEFAULT_SAMPLE_RATE = 0.1
+SLOWEST = 3
+N_PLUS_ONE_THRESHOLD = 10
+
+_IN_LIST = re.compile(r"\bIN \([^()]*\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(Exception):
+    """A view ran more queries than its `query_budget` allows."""
+
+
+def normalize(statement):
+    """The shape of `statement`: whitespace and IN-lists collapsed."""
+
+    return _IN_LIST.sub("IN (...)", _WHITESPACE.sub(" ", statement).strip())
+
+
+class QueryStats:
+    """The statements one request ran, with their durations."""
+
+    def __init__(self):
+        self.statements = []
+        self.total_time = 0.0
+        self.exempt = 0
+        self.exempting = 0
+
+    def __len__(self):
+        return len(self.statements)
+
+    @property
+    def charged(self):
+        """How many statements count against the view's budget."""
+
+        return len(self.statements) - self.exempt
+
+    def record(self, statement, duration):
+        self.statements.append((duration, statement))
+        self.total_time += duration
+        if self.exempting:
+            self.exempt += 1
+
+    def slowest(self, n=SLOWEST):
+        """The `n` slowest (seconds, statement), slowest first."""
+
+        return sorted(self.statements, key=lambda s: s[0], reverse=True)[:n]
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """(count, shape) of statement shapes run `threshold`+ times."""
+
+        shapes = Counter(normalize(statement) for _, statement in self.statements)
+        return [
+            (count, shape) for shape, count in shapes.most_common() if count >= threshold
+        ]
+
+
+def query_budget(max_queries):
+    """Declare that a view runs at most `max_queries` SQL statements."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            return view(*args, **kwargs)
+
+        wrapper.query_budget = max_queries
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def exempt():
+    """Don't charge the queries run inside to the current view's budget.
+
+    For per-process caches filled on first use: whichever request happens
+    to fill one shouldn't go over its budget for it.
+    """
+
+    stats = g.get("query_stats") if has_request_context() else None
+    if stats is None:
+        yield
+        return
+
+    stats.exempting += 1
+    try:
+        yield
+    finally:
+        stats.exempting -= 1
+
+
+def budget_for(endpoint):
+    """The query budget of the view for `endpoint`, or None."""
+
+    view = current_app.view_functions.get(endpoint)
+    return getattr(view, "query_budget", None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and g.get("query_stats") is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and g.get("query_stats") is not None:
+        starts = conn.info.get("query_start")
+        if starts:
+            g.query_stats.record(statement, time.perf_counter() - starts.pop())
+
+
+def start_request():
+    """Decide whether to measure this request."""
+
+    config = current_app.config
+    measure = random.random() < config.get("QUERY_STATS_SAMPLE_RATE", 0)
+
+    if not measure and config.get("QUERY_BUDGET_ENFORCE"):
+        measure = budget_for(request.endpoint) is not None
+
+    g.query_stats = QueryStats() if measure else None
+
+
+def finish_request(resp):
+    """Report a measured request's queries in headers and the log."""
+
+    stats = g.get("query_stats")
+    if stats is None:
+        return resp
+
+    g.query_stats = None
+
+    resp.headers["X-Query-Count"] = str(len(stats))
+    resp.headers["X-Query-Time"] = f"{stats.total_time * 1000:.2f}"
+
+    budget = budget_for(request.endpoint)
+    over_budget = budget is not None and stats.charged > budget
+    repeated = stats.repeated(
+        current_app.config.get("QUERY_N_PLUS_ONE_THRESHOLD", N_PLUS_ONE_THRESHOLD)
+    )
+
+    level = logging.WARNING if over_budget or repeated else logging.INFO
+    if logger.isEnabledFor(level):
+        logger.log(
+            level,
+            json.dumps(
+                dict(
+                    method=request.method,
+                    path=request.path,
+                    endpoint=request.endpoint,
+                    status=resp.status_code,
+                    queries=len(stats),
+                    exempt=stats.exempt,
+                    budget=budget,
+                    db_ms=round(stats.total_time * 1000, 2),
+                    slowest=[
+                        dict(ms=round(duration * 1000, 2), sql=statement)
+                        for duration, statement in stats.slowest()
+                    ],
+                    repeated=[
+                        dict(count=count, sql=shape) for count, shape in repeated
+                    ],
+                )
+            ),
+        )
+
+    if over_budget and current_app.config.get("QUERY_BUDGET_ENFORCE"):
+        raise QueryBudgetExceeded(
+            f"{request.endpoint} ran {stats.charged} queries (budget {budget}):\n"
+            + "\n".join(statement for _, statement in stats.statements)
+        )
+
+    return resp
+
+
+def count_queries(fn):
+    """Call `fn` and return how many SQL statements it ran.
+
+    For tests, e.g. to check a page's query count doesn't grow with its
+    content.
+    """
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        fn()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+
+    return len(statements)
+
+
+def init_app(app):
+    """Hook the instrumentation into `app` and its database engines."""
+
+    # every engine, so reads sent to a replica (see replicas.py) count too
+    for name, listener in (
+        ("before_cursor_execute", _before_cursor_execute),
+        ("after_cursor_execute", _after_cursor_execute),
+    ):
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+
+    app.before_request(start_request)
+    app.after_request(finish_request)
@@ -0,0 +1,295 @@
+"""Who-to-follow suggestions for Warbler.
+
+Suggestions are precomputed by an offline job, `flask build-suggestions`,
+and stored TOP_K per user in the `suggestions` table, so a page reads them
+with one primary key range scan (`suggestions_for`).
+
+The job loads the follow graph (see followgraph.py) as a sparse matrix A,
+A[i, j] = 1 when i follows j. Row i of A @ A counts, for each user j, how
+many of the people i follows also follow j: j's score for i. People i
+already follows, and i themself, are dropped, and the TOP_K highest scores
+kept, ties going to whoever has more followers. Rows are scored BLOCK_SIZE
+users at a time, spread over worker processes that share A (forked), and
+each block's suggestions are swapped in with one transaction, so readers
+never see a user's list half-written.
+
+Users the job hasn't seen (new signups, people who follow nobody) get the
+most-followed users instead, whose ids are cached per process.
+
+NumPy and SciPy are only needed by the job.
+"""
+
+import multiprocessing
+import threading
+import time
+from collections import namedtuple
+
+import click
+from flask import current_app
+
+import bulkload
+import followgraph
+import querystats
+from models import db, User, Suggestion
+
+TOP_K = 20
+DEFAULT_LIMIT = 5
+BLOCK_SIZE = 10000
+
+POPULAR_SIZE = 50
+POPULAR_TTL = 300
+
+SUGGESTION_COLUMNS = ["user_id", "rank", "suggested_id", "score"]
+
+SuggestedUser = namedtuple("SuggestedUser", "id username image_url score")
+
+
+##############################################################################
+# Batch job
+
+
+def follow_matrix(graph):
+    """A FollowGraph's follows as a SciPy CSR matrix (row follows column).
+
+    Shares nothing with the graph: changes made to it since it was built
+    (its pending adds and removes) aren't included.
+    """
+
+    import numpy as np
+    from scipy.sparse import csr_matrix
+
+    indptr = np.frombuffer(graph.out_offsets, dtype=np.uint32).astype(np.int64)
+    indices = np.frombuffer(graph.out_targets, dtype=np.uint32).astype(np.int32)
+    data = np.ones(len(indices), dtype=np.int32)
+    n = len(indptr) - 1
+
+    return csr_matrix((data, indices, indptr), shape=(n, n))
+
+
+def top_suggestions(matrix, popularity, lo, hi, k=TOP_K):
+    """Score users lo..hi-1 against everyone; return their top `k`.
+
+    `popularity` is each user's follower count, for breaking ties. Returns
+    arrays (user_ids, ranks, suggested_ids, scores), sorted by user then
+    rank.
+    """
+
+    import numpy as np
+
+    block = matrix[lo:hi]
+    scores = block @ matrix
+
+    # drop people already followed...
+    scores = (scores - scores.multiply(block)).tocoo()
+    # ...and the users themselves
+    keep = (scores.data > 0) & (scores.col != scores.row + lo)
+    rows, cols, counts = scores.row[keep], scores.col[keep], scores.data[keep]
+
+    # best first within each row: by score, then followers
+    key = counts.astype(np.int64) * (int(popularity.max(initial=0)) + 1)
+    key += popularity[cols]
+    order = np.lexsort((-key, rows))
+    rows, cols, counts = rows[order], cols[order], counts[order]
+
+    starts = np.searchsorted(rows, np.arange(hi - lo))
+    ranks = np.arange(len(rows)) - starts[rows]
+    top = ranks < k
+
+    return rows[top] + lo, ranks[top], cols[top], counts[top]
+
+
+# The matrix and follower counts, shared with forked workers
+_job = {}
+
+
+def _score_block(bounds):
+    lo, hi = bounds
+    suggestions = top_suggestions(
+        _job["matrix"], _job["popularity"], lo, hi, _job["k"]
+    )
+    return lo, hi, suggestions
+
+
+def score_blocks(matrix, k=TOP_K, processes=1, block_size=BLOCK_SIZE):
+    """Yield (lo, hi, suggestions) for each block of users, in order.
+
+    With `processes` > 1, blocks are scored in that many forked workers
+    (where fork is available; otherwise in this process).
+    """
+
+    import numpy as np
+
+    n = matrix.shape[0]
+    _job.update(
+        matrix=matrix,
+        popularity=np.asarray(matrix.sum(axis=0)).ravel().astype(np.int64),
+        k=k,
+    )
+    blocks = [(lo, min(lo + block_size, n)) for lo in range(0, n, block_size)]
+
+    try:
+        if processes > 1 and "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+            with context.Pool(processes) as pool:
+                yield from pool.imap(_score_block, blocks)
+        else:
+            yield from map(_score_block, blocks)
+    finally:
+        _job.clear()
+
+
+def build(k=TOP_K, processes=1, block_size=BLOCK_SIZE, echo=None):
+    """Recompute everyone's suggestions; return how many were stored."""
+
+    start = time.perf_counter()
+    matrix = follow_matrix(followgraph.load_graph())
+    if echo:
+        echo(
+            f"Loaded {matrix.nnz:,} follows in {time.perf_counter() - start:.1f}s"
+        )
+
+    if processes > 1:
+        # don't hand the forked workers our database connections
+        db.session.remove()
+        db.engine.dispose()
+
+    stored = 0
+    table = Suggestion.__table__
+
+    for lo, hi, suggestions in score_blocks(matrix, k, processes, block_size):
+        rows = list(zip(*(column.tolist() for column in suggestions)))
+
+        with db.engine.begin() as conn:
+            conn.execute(
+                table.delete().where(table.c.user_id.between(lo, hi - 1))
+            )
+            if rows:
+                bulkload.insert_rows(conn, table, SUGGESTION_COLUMNS, rows)
+
+        stored += len(rows)
+        if echo:
+            rate = hi / (time.perf_counter() - start)
+            echo(f"{hi:,} users, {stored:,} suggestions ({rate:,.0f} users/s)")
+
+    # and anyone the graph didn't cover (ids past its end)
+    with db.engine.begin() as conn:
+        conn.execute(table.delete().where(table.c.user_id >= matrix.shape[0]))
+
+    return stored
+
+
+##############################################################################
+# Reading
+
+
+_popular = None
+_popular_at = 0
+_popular_lock = threading.Lock()
+
+
+def popular():
+    """Ids of the POPULAR_SIZE most-followed users, cached for POPULAR_TTL.
+
+    Only ids are cached: names and images are read when they're shown, so
+    renames and deleted accounts show up at once in every process.
+    """
+
+    global _popular, _popular_at
+
+    ttl = current_app.config.get("SUGGESTIONS_POPULAR_TTL", POPULAR_TTL)
+
+    with _popular_lock, querystats.exempt():
+        if _popular is None or time.monotonic() - _popular_at > ttl:
+            rows = (
+                db.session.query(User.id)
+                .filter(User.deleted_at.is_(None))
+                .order_by(User.followers_count.desc(), User.id)
+                .limit(POPULAR_SIZE)
+            )
+            _popular = [user_id for (user_id,) in rows]
+            _popular_at = time.monotonic()
+
+        return _popular
+
+
+def reset_popular():
+    """Forget the cached most-followed users."""
+
+    global _popular
+    _popular = None
+
+
+def suggestions_for(user, limit=DEFAULT_LIMIT):
+    """Up to `limit` users for `user` to follow, best first.
+
+    A list of SuggestedUser; `score` is how many of the people `user`
+    follows follow them (None for fill-ins from `popular()`). One query,
+    plus another when the precomputed list runs short.
+    """
+
+    if not user:
+        return []
+
+    rows = (
+        db.session.query(User.id, User.username, User.image_url, Suggestion.score)
+        .join(Suggestion, Suggestion.suggested_id == User.id)
+        .filter(Suggestion.user_id == user.id, User.deleted_at.is_(None))
+        .order_by(Suggestion.rank)
+        .limit(TOP_K)
+    )
+    suggestions = _unfollowed([SuggestedUser(*row) for row in rows], user)
+
+    if len(suggestions) < limit:
+        seen = {suggestion.id for suggestion in suggestions}
+        ids = [user_id for user_id in popular() if user_id not in seen]
+        suggestions += _unfollowed(_popular_users(ids), user)
+
+    return suggestions[:limit]
+
+
+def _popular_users(ids):
+    """SuggestedUsers for those of `ids` not deleted, in the order given."""
+
+    if not ids:
+        return []
+
+    rows = db.session.query(User.id, User.username, User.image_url).filter(
+        User.id.in_(ids), User.deleted_at.is_(None)
+    )
+    order = {user_id: i for i, user_id in enumerate(ids)}
+
+    return sorted(
+        (SuggestedUser(*row, None) for row in rows), key=lambda u: order[u.id]
+    )
+
+
+def _unfollowed(candidates, user):
+    """`candidates` less `user` and anyone they follow (since the job ran)."""
+
+    followed = followgraph.followed_ids_for(
+        [candidate.id for candidate in candidates], user
+    )
+
+    return [
+        candidate
+        for candidate in candidates
+        if candidate.id != user.id and candidate.id not in followed
+    ]
+
+
+def init_app(app):
+    """Add the `suggestions_for` template helper and `build-suggestions`."""
+
+    app.add_template_global(suggestions_for)
+
+    @app.cli.command("build-suggestions")
+    @click.option("--processes", type=int, default=multiprocessing.cpu_count())
+    @click.option("--top-k", type=int, default=TOP_K)
+    @click.option("--block-size", type=int, default=BLOCK_SIZE)
+    def build_suggestions(processes, top_k, block_size):
+        """Precompute everyone's who-to-follow suggestions."""
+
+        stored = build(
+            k=top_k, processes=processes, block_size=block_size, echo=click.echo
+        )
+        click.echo(f"Stored {stored:,} suggestions")
@@ -0,0 +1,170 @@
+"""Connection pool tuning and read replicas.
+
+Every engine (the primary's and each replica's) gets its pool settings from
+config: DB_POOL_SIZE connections kept open plus DB_MAX_OVERFLOW more under
+load, waiting at most DB_POOL_TIMEOUT seconds for one; connections older
+than DB_POOL_RECYCLE seconds are replaced, and with DB_POOL_PRE_PING a
+connection is checked before each checkout, so one dropped by the server or
+a failover doesn't fail a request. On Postgres, DB_STATEMENT_TIMEOUT
+(milliseconds, 0 for none) has the server cancel runaway statements.
+
+Replicas are the SQLALCHEMY_BINDS whose keys start with "replica" (app.py
+builds them from DATABASE_REPLICA_URLS). Views decorated with
+`@replica_reads` are read-only pages: on a GET, their queries go to one
+replica, picked at random per request so a page is consistent with itself.
+Anything else (writes, flushes, every other view, CLI commands and
+background threads) uses the primary.
+
+Replicas lag behind. So that people see their own changes, a request that
+writes to the primary marks the session, and that session's reads stay on
+the primary for REPLICA_STICKY_SECONDS afterwards; set it above the
+replicas' usual lag.
+"""
+
+import random
+import re
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.dml import UpdateBase
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_POOL_RECYCLE = 30 * 60
+DEFAULT_STICKY_SECONDS = 5
+
+REPLICA_PREFIX = "replica"
+STICKY_KEY = "primary_until"
+
+_WRITE = re.compile(r"\s*(INSERT|UPDATE|DELETE|COPY)\b", re.IGNORECASE)
+
+
+def engine_options(config, sa_url, options):
+    """Add the pool and timeout settings in `config` to engine `options`."""
+
+    options.setdefault("pool_pre_ping", config.get("DB_POOL_PRE_PING", True))
+
+    # SQLite gets a pool suited to it; these don't apply
+    if sa_url.drivername.startswith("sqlite"):
+        return
+
+    options.setdefault("pool_size", config.get("DB_POOL_SIZE", DEFAULT_POOL_SIZE))
+    options.setdefault(
+        "max_overflow", config.get("DB_MAX_OVERFLOW", DEFAULT_MAX_OVERFLOW)
+    )
+    options.setdefault(
+        "pool_timeout", config.get("DB_POOL_TIMEOUT", DEFAULT_POOL_TIMEOUT)
+    )
+    options.setdefault(
+        "pool_recycle", config.get("DB_POOL_RECYCLE", DEFAULT_POOL_RECYCLE)
+    )
+
+    timeout = config.get("DB_STATEMENT_TIMEOUT", 0)
+    if timeout and sa_url.drivername.startswith("postgresql"):
+        connect_args = options.setdefault("connect_args", {})
+        connect_args["options"] = f"-c statement_timeout={int(timeout)}"
+
+
+class RoutingSession(SignallingSession):
+    """A session that sends a read-only view's reads to its replica."""
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = _request_replica()
+        if (
+            replica is not None
+            and not self._flushing
+            and not isinstance(clause, UpdateBase)
+        ):
+            return self.db.get_engine(self.app, bind=replica)
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with configured pools and replica routing."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        # Flask-SQLAlchemy 2.3 updates `options` in place; later versions
+        # also return them, so do both.
+        rv = super().apply_driver_hacks(app, sa_url, options)
+        engine_options(app.config, sa_url, options)
+        return rv
+
+
+def replica_binds(app=None):
+    """The bind keys of the configured replicas."""
+
+    binds = (app or current_app).config.get("SQLALCHEMY_BINDS") or {}
+    return sorted(key for key in binds if key.startswith(REPLICA_PREFIX))
+
+
+def replica_reads(view):
+    """Mark `view` as read-only: its GETs may be served from a replica."""
+
+    view.replica_reads = True
+    return view
+
+
+def _request_replica():
+    """The bind key this request reads from, or None for the primary."""
+
+    return g.get("replica") if has_request_context() else None
+
+
+def choose_replica():
+    """Before a request: pick its replica, if it may use one."""
+
+    g.replica = None
+    if request.method not in ("GET", "HEAD"):
+        return
+
+    view = current_app.view_functions.get(request.endpoint)
+    if not getattr(view, "replica_reads", False):
+        return
+
+    # this session wrote recently: a replica may not have its changes yet
+    if session.get(STICKY_KEY, 0) > time.time():
+        return
+
+    binds = replica_binds()
+    if binds:
+        g.replica = random.choice(binds)
+
+
+def stick_to_primary(response):
+    """After a request that wrote: keep the session on the primary a while."""
+
+    if g.get("wrote"):
+        sticky = current_app.config.get(
+            "REPLICA_STICKY_SECONDS", DEFAULT_STICKY_SECONDS
+        )
+        if sticky and replica_binds():
+            session[STICKY_KEY] = time.time() + sticky
+
+    return response
+
+
+def _note_write(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and _WRITE.match(statement):
+        g.wrote = True
+
+
+def init_app(app):
+    """Route read-only views to replicas and track writes in `app`."""
+
+    if not event.contains(Engine, "before_cursor_execute", _note_write):
+        event.listen(Engine, "before_cursor_execute", _note_write)
+
+    app.before_request(choose_replica)
+    app.after_request(stick_to_primary)
@@ -0,0 +1,106 @@
+"""Upgrading an existing database to the models' schema.
+
+`db.create_all()` creates missing tables but never alters existing ones,
+and the production profile doesn't run it at all. `migrate()` (the
+`flask migrate` command) brings an existing database up to date, and is
+safe to run again:
+
+1. creates the tables the database doesn't have yet;
+2. adds the columns the models declare but the database's tables lack
+   (`ALTER TABLE ... ADD COLUMN`, with the column's server default so
+   existing rows get a value);
+3. creates missing indexes (see indexes.py), on Postgres after enabling
+   `pg_trgm`, which the username search indexes use;
+4. recomputes the denormalized counters (see counters.py), since columns
+   added by step 2 start at zero.
+
+Columns are only ever added, never altered or dropped.
+"""
+
+import click
+from sqlalchemy import inspect
+
+import counters
+import indexes
+from models import db
+
+
+def missing_columns(bind):
+    """[(table, column)] the models declare but the database's tables lack."""
+
+    inspector = inspect(bind)
+    existing = set(inspector.get_table_names())
+    missing = []
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+
+        have = {column["name"] for column in inspector.get_columns(table.name)}
+        missing += [(table, c) for c in table.columns if c.name not in have]
+
+    return missing
+
+
+def add_column_statement(bind, table, column):
+    """The ALTER TABLE statement adding `column` to `table`."""
+
+    ddl = bind.dialect.ddl_compiler(bind.dialect, None)
+    spec = ddl.get_column_specification(column)
+
+    # Postgres can skip a column added meanwhile; SQLite has no IF NOT EXISTS
+    if bind.dialect.name == "postgresql":
+        return f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS {spec}"
+    return f"ALTER TABLE {table.name} ADD COLUMN {spec}"
+
+
+def add_missing_columns(bind=None, dry_run=False, echo=None):
+    """Add the declared columns the database lacks; return their names."""
+
+    bind = bind or db.engine
+    added = []
+
+    for table, column in missing_columns(bind):
+        statement = add_column_statement(bind, table, column)
+        if echo:
+            echo(statement)
+        if not dry_run:
+            with bind.begin() as conn:
+                conn.execute(statement)
+        added.append(f"{table.name}.{column.name}")
+
+    return added
+
+
+def migrate(dry_run=False, echo=None):
+    """Create missing tables, columns and indexes, then reconcile counters.
+
+    Returns the names of the columns added.
+    """
+
+    if not dry_run:
+        db.create_all()
+
+    added = add_missing_columns(dry_run=dry_run, echo=echo)
+
+    if db.engine.dialect.name == "postgresql" and not dry_run:
+        with db.engine.begin() as conn:
+            conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    indexes.apply_indexes(dry_run=dry_run, echo=echo)
+
+    if not dry_run:
+        counters.reconcile(echo=echo)
+
+    return added
+
+
+def init_app(app):
+    """Register the `migrate` CLI command on `app`."""
+
+    @app.cli.command("migrate")
+    @click.option("--dry-run", is_flag=True, help="Print the SQL; don't run it.")
+    def migrate_command(dry_run):
+        """Upgrade the database's tables, columns and indexes in place."""
+
+        added = migrate(dry_run=dry_run, echo=click.echo)
+        click.echo(f"{len(added)} missing columns")
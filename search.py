@@ -0,0 +1,349 @@
+"""Username search for Warbler.
+
+On Postgres, searches use the `pg_trgm` GIN index and the `text_pattern_ops`
+prefix index declared on `users` in models.py. On other databases (SQLite in
+development and tests) an in-process trigram inverted index is built from
+the `users` table on first use and kept current by the signup, profile edit
+and delete routes.
+
+Either way results are ranked: exact match, then prefix matches, then other
+substring matches, then fuzzy (trigram-similar) matches, closest first
+within each tier.
+"""
+
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import and_, case, func, literal_column, or_
+
+from models import db, User
+
+DEFAULT_LIMIT = 50
+AUTOCOMPLETE_LIMIT = 10
+
+NGRAM_SIZE = 3
+
+# Minimum trigram similarity for a fuzzy (non-substring) match; this is
+# pg_trgm's default `similarity_threshold`.
+SIMILARITY_THRESHOLD = 0.3
+
+LIKE_ESCAPE = "!"
+
+
+def ngrams(text, n=NGRAM_SIZE):
+    """The set of length-`n` substrings of `text`."""
+
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def similarity(a, b, n=NGRAM_SIZE):
+    """Jaccard similarity of the n-gram sets of `a` and `b`."""
+
+    grams_a, grams_b = ngrams(a, n), ngrams(b, n)
+    if not grams_a or not grams_b:
+        return 0.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+def _rank(name, query):
+    """Sort key for a lowercased `name` containing `query` (lower is better).
+
+    Fuzzy matches rank after these, as tier 3 (see NgramIndex._fuzzy).
+    """
+
+    if name == query:
+        tier = 0
+    elif name.startswith(query):
+        tier = 1
+    else:
+        tier = 2
+
+    return (tier, 0, len(name), name)
+
+
+class NgramIndex:
+    """In-process inverted index from username n-grams to user ids.
+
+    Also keeps usernames in sorted order for prefix (autocomplete) lookups.
+    """
+
+    def __init__(self, n=NGRAM_SIZE):
+        self.n = n
+        self.postings = defaultdict(set)
+        self.names = {}
+        self.sorted_names = []
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, user_id, username):
+        """Index (or re-index) `user_id` under `username`."""
+
+        name = username.lower()
+
+        with self.lock:
+            self.remove(user_id)
+            self.names[user_id] = name
+            insort(self.sorted_names, (name, user_id))
+            for gram in ngrams(name, self.n):
+                self.postings[gram].add(user_id)
+
+    def remove(self, user_id):
+        """Drop `user_id` from the index, if it's there."""
+
+        with self.lock:
+            name = self.names.pop(user_id, None)
+            if name is None:
+                return
+
+            pos = bisect_left(self.sorted_names, (name, user_id))
+            del self.sorted_names[pos]
+
+            for gram in ngrams(name, self.n):
+                ids = self.postings[gram]
+                ids.discard(user_id)
+                if not ids:
+                    del self.postings[gram]
+
+    def prefix(self, query, limit=AUTOCOMPLETE_LIMIT):
+        """Ids of up to `limit` users whose username starts with `query`."""
+
+        query = query.lower()
+        found = []
+
+        with self.lock:
+            pos = bisect_left(self.sorted_names, (query,))
+            while len(found) < limit and pos < len(self.sorted_names):
+                name, user_id = self.sorted_names[pos]
+                if not name.startswith(query):
+                    break
+                found.append(user_id)
+                pos += 1
+
+        return found
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Ids of the best `limit` matches for `query`, best first.
+
+        Substring matches come from intersecting posting lists; fuzzy
+        matches are only looked for when those don't fill the page.
+        """
+
+        query = query.lower()
+        grams = ngrams(query, self.n)
+
+        if not grams:
+            # Too short to have any n-grams: check every name, as LIKE would
+            with self.lock:
+                found = heapq.nsmallest(
+                    limit,
+                    (
+                        (_rank(name, query), user_id)
+                        for user_id, name in self.names.items()
+                        if query in name
+                    ),
+                )
+            return [user_id for _, user_id in found]
+
+        with self.lock:
+            postings = sorted(
+                (self.postings.get(gram, set()) for gram in grams), key=len
+            )
+            candidates = set.intersection(*postings)
+            found = heapq.nsmallest(
+                limit,
+                (
+                    (_rank(self.names[user_id], query), user_id)
+                    for user_id in candidates
+                    if query in self.names[user_id]
+                ),
+            )
+
+            if len(found) < limit:
+                found += heapq.nsmallest(
+                    limit - len(found), self._fuzzy(query, grams, candidates)
+                )
+
+        return [user_id for _, user_id in found]
+
+    def _fuzzy(self, query, grams, exclude):
+        """(rank, id) of users trigram-similar to `query`, not in `exclude`."""
+
+        hits = defaultdict(int)
+        for gram in grams:
+            for user_id in self.postings.get(gram, ()):
+                hits[user_id] += 1
+
+        for user_id, shared in hits.items():
+            if user_id in exclude:
+                continue
+            name = self.names[user_id]
+            # shared / len(grams) bounds the similarity, so check it first
+            if shared / len(grams) < SIMILARITY_THRESHOLD:
+                continue
+            score = similarity(name, query)
+            if score >= SIMILARITY_THRESHOLD:
+                yield ((3, -score, len(name), name), user_id)
+
+
+_index = None
+_index_built_at = 0
+_index_lock = threading.Lock()
+
+
+def use_sql_search():
+    """Should searches go to the database (pg_trgm) rather than NgramIndex?"""
+
+    backend = current_app.config.get("SEARCH_BACKEND", "auto")
+    if backend == "auto":
+        return db.engine.dialect.name == "postgresql"
+    return backend == "sql"
+
+
+def get_index():
+    """This process's NgramIndex, (re)built from `users` when missing or stale.
+
+    SEARCH_INDEX_TTL (seconds) bounds how long changes made by other
+    processes can go unseen; 0 means never rebuild.
+    """
+
+    global _index, _index_built_at
+
+    ttl = current_app.config.get("SEARCH_INDEX_TTL", 300)
+    stale = ttl and time.monotonic() - _index_built_at > ttl
+
+    if _index is None or stale:
+        with _index_lock:
+            if _index is None or stale:
+                index = NgramIndex()
+                rows = db.session.query(User.id, User.username).filter(
+                    User.deleted_at.is_(None)
+                )
+                for user_id, username in rows:
+                    index.add(user_id, username)
+                _index, _index_built_at = index, time.monotonic()
+
+    return _index
+
+
+def reset_index():
+    """Forget the in-process index (it's rebuilt on next use)."""
+
+    global _index
+    _index = None
+
+
+def user_changed(user):
+    """Keep the in-process index current after a signup or username edit."""
+
+    if _index is not None:
+        _index.add(user.id, user.username)
+
+
+def user_removed(user_id):
+    """Keep the in-process index current after an account is deleted."""
+
+    if _index is not None:
+        _index.remove(user_id)
+
+
+def _escape_like(text):
+    """Escape LIKE wildcards in user input (with LIKE_ESCAPE)."""
+
+    for char in (LIKE_ESCAPE, "%", "_"):
+        text = text.replace(char, LIKE_ESCAPE + char)
+    return text
+
+
+def _users_in_order(ids):
+    """Load users by id, preserving the order of `ids`."""
+
+    if not ids:
+        return []
+    # (another process's index may not have seen a deletion yet)
+    active = User.query.filter(User.id.in_(ids), User.deleted_at.is_(None))
+    users = {u.id: u for u in active}
+    return [users[id] for id in ids if id in users]
+
+
+def search_users(query, limit=None):
+    """The best-matching users for `query`, best first."""
+
+    limit = limit or current_app.config.get("SEARCH_LIMIT", DEFAULT_LIMIT)
+    query = query.strip().lower()
+
+    if not query:
+        return []
+
+    if not use_sql_search():
+        return _users_in_order(get_index().search(query, limit))
+
+    matches, order = search_terms(query)
+
+    return User.query.filter(matches).order_by(*order).limit(limit).all()
+
+
+def search_terms(query, trigrams=True):
+    """The (filter, order_by clauses) of a SQL search for lowercase `query`.
+
+    With `trigrams` (pg_trgm), fuzzy matches are found and ranked too;
+    without, only substrings match.
+    """
+
+    name = func.lower(User.username)
+    escaped = _escape_like(query)
+
+    # Queries shorter than a trigram can't use the trigram index and scan
+    # the usernames instead, which is cheap
+    matches = name.like(f"%{escaped}%", escape=LIKE_ESCAPE)
+    if trigrams and len(query) >= NGRAM_SIZE:
+        # pg_trgm's similarity operator, `%`, doubled since SQLAlchemy passes
+        # it through to psycopg2's pyformat SQL unescaped
+        matches = or_(matches, name.op("%%")(query))
+    matches = and_(matches, User.deleted_at.is_(None))
+
+    # The tiers are written into the SQL rather than bound: asyncpg (see
+    # asyncapi.py) would otherwise type them as text, from the CASE alone
+    tier = case(
+        [
+            (name == query, literal_column("0")),
+            (name.like(f"{escaped}%", escape=LIKE_ESCAPE), literal_column("1")),
+            (name.like(f"%{escaped}%", escape=LIKE_ESCAPE), literal_column("2")),
+        ],
+        else_=literal_column("3"),
+    )
+
+    order = [tier, func.length(User.username), name]
+    if trigrams:
+        order.insert(1, func.similarity(name, query).desc())
+
+    return matches, order
+
+
+def autocomplete(prefix, limit=AUTOCOMPLETE_LIMIT):
+    """Up to `limit` users whose username starts with `prefix`."""
+
+    prefix = prefix.strip().lower()
+
+    if not prefix:
+        return []
+
+    if not use_sql_search():
+        return _users_in_order(get_index().prefix(prefix, limit))
+
+    name = func.lower(User.username)
+    pattern = f"{_escape_like(prefix)}%"
+
+    return (
+        User.query.filter(
+            name.like(pattern, escape=LIKE_ESCAPE), User.deleted_at.is_(None)
+        )
+        .order_by(name)
+        .limit(limit)
+        .all()
+    )
@@ -1,20 +1,38 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db
-from models import User, Message, FollowersFollowee
+    python seed.py                   # drop, recreate and load generator/*.csv
+    python seed.py --resume          # carry on after an interrupted load
+    python seed.py --data-dir /data  # load another dataset (see generator/)
+"""
 
+import argparse
 
-db.drop_all()
-db.create_all()
+from app import app
+from models import db
+import bulkload
+import counters
+import timeline
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+parser = argparse.ArgumentParser(description="Load CSV data into the database.")
+parser.add_argument("--data-dir", default="generator")
+parser.add_argument("--chunk-size", type=int, default=bulkload.CHUNK_SIZE)
+parser.add_argument(
+    "--resume",
+    action="store_true",
+    help="keep what an interrupted load got through and load the rest",
+)
+args = parser.parse_args()
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+with app.app_context():
+    if not args.resume:
+        db.drop_all()
+        db.create_all()
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(FollowersFollowee, DictReader(follows))
+    counts = bulkload.load(
+        args.data_dir, resume=args.resume, chunk_size=args.chunk_size, echo=print
+    )
+    print(", ".join(f"{rows:,} {table}" for table, rows in counts.items()))
 
-db.session.commit()
+    # Bulk loads bypass the write paths, so derive counters and timelines
+    counters.reconcile(echo=print)
+    timeline.rebuild_all(echo=print)
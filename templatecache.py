@@ -0,0 +1,81 @@
+"""Compiled templates kept across deploys' worker restarts.
+
+Jinja compiles each template to Python bytecode the first time a process
+uses it, so after a deploy every worker compiles `base.html` and the rest
+again during its first requests. With TEMPLATE_CACHE_DIR set, the bytecode
+goes to files in that directory (Jinja's bytecode cache) and every worker
+loads it from there instead. An entry is used only while its template's
+source is unchanged, so a deploy never serves stale templates.
+
+`flask compile-templates` fills the cache as a build step, so not even the
+first worker compiles. With TEMPLATE_PRELOAD (the production profile) the
+app loads every template when it's created, so no request waits for one;
+a preloading master process hands them, loaded, to the workers it forks.
+Production also turns off TEMPLATES_AUTO_RELOAD, so loaded templates aren't
+checked against their files on every render.
+"""
+
+import io
+import os
+
+import click
+from jinja2 import FileSystemBytecodeCache
+
+from assets import write_file
+
+
+class AtomicBytecodeCache(FileSystemBytecodeCache):
+    """A bytecode cache whose files are never seen half-written.
+
+    Workers starting together may compile the same template at once; each
+    writes a temporary file and renames it into place.
+    """
+
+    def dump_bytecode(self, bucket):
+        output = io.BytesIO()
+        bucket.write_bytecode(output)
+        write_file(self._get_cache_filename(bucket), output.getvalue())
+
+
+def template_names(app):
+    """The names of all of `app`'s templates."""
+
+    return [name for name in app.jinja_env.list_templates() if name.endswith(".html")]
+
+
+def load_all(app):
+    """Load (compiling if need be) every template; return how many."""
+
+    names = template_names(app)
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def init_app(app):
+    """Use the bytecode cache and preload templates, as configured.
+
+    Call after anything that adds Jinja extensions.
+    """
+
+    directory = app.config.get("TEMPLATE_CACHE_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = AtomicBytecodeCache(directory)
+
+    if app.config.get("TEMPLATE_PRELOAD"):
+        load_all(app)
+
+    @app.cli.command("compile-templates")
+    def compile_templates_command():
+        """Compile every template into the bytecode cache."""
+
+        if not directory:
+            raise click.ClickException("TEMPLATE_CACHE_DIR isn't set")
+
+        # compile afresh, not from the cache or templates already loaded
+        app.jinja_env.bytecode_cache.clear()
+        if app.jinja_env.cache is not None:
+            app.jinja_env.cache.clear()
+        count = load_all(app)
+        click.echo(f"Compiled {count} templates into {directory}")
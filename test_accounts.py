@@ -0,0 +1,262 @@
+"""Account deletion and purge tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_accounts.py
+
+
+import os
+from unittest import TestCase
+
+from models import (
+    db,
+    User,
+    Message,
+    FollowersFollowee,
+    Like,
+    TimelineEntry,
+    Suggestion,
+    TrendingScore,
+    AccountPurge,
+)
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import accounts
+import counters
+import search
+import usercache
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+# Purge deleted accounts only when the tests say so, not on a thread
+
+app.config["ACCOUNT_PURGE_THREAD"] = False
+
+
+class AccountsTestCase(TestCase):
+    """Tests for tombstoning and purging deleted accounts"""
+
+    def setUp(self):
+        """Three users who post, follow and like each other."""
+
+        for model in (
+            Like,
+            TrendingScore,
+            TimelineEntry,
+            Suggestion,
+            Message,
+            FollowersFollowee,
+            User,
+            AccountPurge,
+        ):
+            model.query.delete()
+        db.session.commit()
+        usercache.cache.clear()
+        search.reset_index()
+
+        self.client = app.test_client()
+
+        ids = []
+        for name in ("one", "two", "three"):
+            user = User.signup(name, f"{name}@test.com", "password", None)
+            db.session.commit()
+            ids.append(user.id)
+        self.u1_id, self.u2_id, self.u3_id = ids
+
+        with self.client as c:
+            self.login(c, self.u2_id)
+            c.post(f"/users/follow/{self.u1_id}")
+            c.post("/messages/new", data={"text": "From two"})
+            self.login(c, self.u3_id)
+            c.post(f"/users/follow/{self.u1_id}")
+            self.login(c, self.u1_id)
+            c.post(f"/users/follow/{self.u2_id}")
+            for i in range(5):
+                c.post("/messages/new", data={"text": f"From one #{i}"})
+
+            own = Message.query.filter_by(user_id=self.u1_id).all()
+            self.msg_id = own[0].id
+            c.post(
+                f"/like/{Message.query.filter_by(user_id=self.u2_id).one().id}",
+                data={"return_to": "/"},
+            )
+            for user_id in (self.u2_id, self.u3_id):
+                self.login(c, user_id)
+                for msg in own[:3]:
+                    c.post(f"/like/{msg.id}", data={"return_to": "/"})
+
+        db.session.add_all(
+            [
+                Suggestion(
+                    user_id=self.u3_id, rank=0, suggested_id=self.u1_id, score=1
+                ),
+                Suggestion(
+                    user_id=self.u1_id, rank=0, suggested_id=self.u3_id, score=1
+                ),
+                TrendingScore(message_id=self.msg_id, score=1.0),
+            ]
+        )
+        db.session.commit()
+
+    def login(self, client, user_id):
+        """Put `user_id` in the test client's session."""
+
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def delete_u1(self):
+        with self.client as c:
+            self.login(c, self.u1_id)
+            resp = c.post("/users/delete")
+        self.assertEqual(resp.status_code, 302)
+
+    def assert_purged(self):
+        """Are all of u1's rows gone, and everyone's counters right?"""
+
+        self.assertIsNone(User.query.get(self.u1_id))
+        self.assertEqual(Message.query.filter_by(user_id=self.u1_id).count(), 0)
+        self.assertEqual(Like.query.count(), 0)
+        self.assertEqual(FollowersFollowee.query.count(), 0)
+        self.assertEqual(Suggestion.query.count(), 0)
+        self.assertEqual(TrendingScore.query.count(), 0)
+        self.assertEqual(
+            TimelineEntry.query.filter(
+                (TimelineEntry.owner_id == self.u1_id)
+                | (TimelineEntry.author_id == self.u1_id)
+            ).count(),
+            0,
+        )
+        self.assertEqual(Message.query.filter_by(user_id=self.u2_id).count(), 1)
+
+        # nothing for reconcile to repair: the purge uncounted everything
+        self.assertEqual(counters.reconcile(), 0)
+
+        job = AccountPurge.query.get(self.u1_id)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(job.stage, "user")
+
+    def test_tombstone(self):
+        """Does deleting hide the account at once, leaving rows for the purge?"""
+
+        self.delete_u1()
+
+        user = User.query.get(self.u1_id)
+        self.assertIsNotNone(user.deleted_at)
+        self.assertEqual(Message.query.filter_by(user_id=self.u1_id).count(), 5)
+        self.assertEqual(accounts.unfinished(), [self.u1_id])
+
+        resp = self.client.get(f"/users/{self.u1_id}")
+        self.assertEqual(resp.status_code, 404)
+        resp = self.client.get(f"/messages/{self.msg_id}")
+        self.assertEqual(resp.status_code, 404)
+        self.assertNotIn(b"@one", self.client.get("/users").data)
+        with app.test_request_context():
+            self.assertEqual(search.search_users("one"), [])
+        self.assertFalse(User.authenticate("one", "password"))
+
+        # a session left logged in elsewhere is logged out
+        with self.client as c:
+            self.login(c, self.u1_id)
+            resp = c.get("/")
+        self.assertIn(b"Sign up", resp.data)
+
+    def test_pages_before_purge(self):
+        """Are a deleted account's messages and follows off every page
+        before the purge reaches them?"""
+
+        pages = [
+            "/",
+            "/trending",
+            f"/users/{self.u2_id}/following",
+            f"/users/{self.u2_id}/followers",
+        ]
+
+        def shown():
+            self.login(self.client, self.u2_id)
+            return [
+                b"From one" in data or b"@one" in data
+                for data in (self.client.get(page).data for page in pages)
+            ]
+
+        self.assertEqual(shown(), [True] * 4)
+        self.delete_u1()
+        self.assertEqual(shown(), [False] * 4)
+        self.assertIn(b"From two", self.client.get("/").data)
+
+        # nor merged in as a high-fanout author's
+        TimelineEntry.query.filter_by(author_id=self.u1_id).delete()
+        User.query.get(self.u1_id).is_high_fanout = True
+        db.session.commit()
+        self.assertNotIn(b"From one", self.client.get("/").data)
+
+        self.assertEqual(Message.query.filter_by(user_id=self.u1_id).count(), 5)
+
+    def test_purge(self):
+        """Does the purge delete everything, in small batches?"""
+
+        self.delete_u1()
+        deleted = accounts.purge(self.u1_id, batch_size=2)
+
+        # 16 timeline entries (u1's 5 messages in 3 timelines, and u2's in
+        # u1's), 6 likes received, 5 messages, 1 like given, 3 follows, 2
+        # suggestions and the users row
+        self.assertEqual(deleted, 34)
+        self.assertEqual(AccountPurge.query.get(self.u1_id).rows_deleted, 34)
+        self.assert_purged()
+
+        # purging again does nothing
+        self.assertEqual(accounts.purge(self.u1_id), 0)
+
+    def test_resume(self):
+        """Does an interrupted purge pick up where it stopped?"""
+
+        self.delete_u1()
+        stages = accounts.STAGES
+
+        def crash(user_id, limit):
+            raise RuntimeError("worker died")
+
+        accounts.STAGES = [
+            (name, crash if name == "messages" else step) for name, step in stages
+        ]
+        try:
+            with self.assertRaises(RuntimeError):
+                accounts.purge(self.u1_id, batch_size=2)
+        finally:
+            accounts.STAGES = stages
+            db.session.rollback()
+
+        # the failed batch rolled back; the stages before it are done
+        job = AccountPurge.query.get(self.u1_id)
+        self.assertEqual(job.stage, "likes received")
+        self.assertIsNone(job.finished_at)
+        self.assertEqual(
+            Like.query.join(Message).filter(Message.user_id == self.u1_id).count(), 0
+        )
+        self.assertEqual(Message.query.filter_by(user_id=self.u1_id).count(), 5)
+
+        result = app.test_cli_runner().invoke(args=["purge-accounts"])
+        self.assertIn("Purged 1 accounts", result.output)
+        self.assert_purged()
+
+        result = app.test_cli_runner().invoke(args=["purge-status"])
+        self.assertIn(f"user {self.u1_id}:", result.output)
+        self.assertIn("finished at", result.output)
@@ -0,0 +1,84 @@
+"""App factory tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_app.py
+
+
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+from models import db
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, create_app
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class CreateAppTestCase(TestCase):
+    """Tests for profiles and lazy loading"""
+
+    def tearDown(self):
+        # each new app takes over `db`; hand it back
+        db.app = app
+
+    def test_profiles(self):
+        """Do profiles and overrides set up the app?"""
+
+        test_app = create_app("test", SEARCH_LIMIT=5)
+        self.assertTrue(test_app.testing)
+        self.assertFalse(test_app.config["WTF_CSRF_ENABLED"])
+        self.assertEqual(test_app.config["SEARCH_LIMIT"], 5)
+        self.assertIn("warbler.homepage", test_app.view_functions)
+
+        resp = test_app.test_client().get("/login")
+        self.assertEqual(resp.status_code, 200)
+
+        dev_app = create_app("dev")
+        self.assertIn("debugtoolbar", dev_app.blueprints)
+
+        self.assertRaises(ValueError, create_app, "staging")
+
+    def test_production(self):
+        """Does production leave out the toolbar and schema creation?"""
+
+        prod_app = create_app("production")
+        self.assertFalse(prod_app.config["CREATE_SCHEMA"])
+        self.assertNotIn("debugtoolbar", prod_app.blueprints)
+
+    def test_lazy_imports(self):
+        """Does importing the module leave the app and heavy imports alone?"""
+
+        code = (
+            "import sys, app; "
+            "print(sorted({'views', 'forms', 'wtforms', 'flask_bcrypt'}"
+            " & set(sys.modules)), 'app' in vars(app))"
+        )
+        out = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+
+        self.assertEqual(out.strip(), "[] False")
@@ -0,0 +1,121 @@
+"""Static asset build tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import os
+import tempfile
+from unittest import TestCase
+
+import brotli
+
+from models import db
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, create_app
+import assets
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class AssetsTestCase(TestCase):
+    """Tests for fingerprinted, precompressed static files"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = create_app("test", ASSET_BUILD_DIR=self.directory.name)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.directory.cleanup()
+        # each new app takes over `db`; hand it back
+        db.app = app
+
+    def build(self):
+        result = self.app.test_cli_runner().invoke(args=["build-assets"])
+        self.assertIn("Built", result.output)
+
+    def asset_url(self, filename):
+        with self.app.test_request_context():
+            return assets.asset_url(filename)
+
+    def test_unbuilt(self):
+        """Without a build, are static files used?"""
+
+        url = self.asset_url("stylesheets/style.css")
+        self.assertRegex(url, r"^/static/stylesheets/style\.css\?v=\d+$")
+
+    def test_build(self):
+        """Are files hashed, with stylesheets pointing at hashed images?"""
+
+        self.build()
+
+        url = self.asset_url("stylesheets/style.css")
+        self.assertRegex(url, r"^/assets/stylesheets/style\.[0-9a-f]{12}\.css$")
+        image_url = self.asset_url("images/nav-bg.png")
+        self.assertRegex(image_url, r"^/assets/images/nav-bg\.[0-9a-f]{12}\.png$")
+
+        css = self.client.get(url, headers={"Accept-Encoding": "identity"}).data
+        self.assertIn(image_url.encode(), css)
+        self.assertNotIn(b"/static/images/nav-bg.png", css)
+
+        resp = self.client.get("/login")
+        self.assertIn(url.encode(), resp.data)
+
+        # building again changes nothing
+        self.build()
+        self.assertEqual(self.asset_url("stylesheets/style.css"), url)
+
+    def test_serve(self):
+        """Are assets sent precompressed and cached for good?"""
+
+        self.build()
+        url = self.asset_url("stylesheets/style.css")
+        plain = self.client.get(url)
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertEqual(plain.mimetype, "text/css")
+        self.assertEqual(
+            plain.headers["Cache-Control"], "public, max-age=31536000, immutable"
+        )
+        self.assertIn("Accept-Encoding", plain.headers["Vary"])
+
+        resp = self.client.get(url, headers={"Accept-Encoding": "gzip, deflate, br"})
+        self.assertEqual(resp.headers["Content-Encoding"], "br")
+        self.assertEqual(resp.mimetype, "text/css")
+        self.assertEqual(brotli.decompress(resp.data), plain.data)
+        self.assertLess(len(resp.data), len(plain.data) / 2)
+
+        resp = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+
+        # images aren't compressed again
+        resp = self.client.get(
+            self.asset_url("images/warbler-logo.png"),
+            headers={"Accept-Encoding": "gzip, br"},
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+        self.assertEqual(self.client.get(url + ".br").status_code, 404)
+        self.assertEqual(self.client.get("/assets/nope.css").status_code, 404)
@@ -0,0 +1,187 @@
+"""Async read API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_asyncapi.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from starlette.testclient import TestClient
+
+from models import db, User, Message, FollowersFollowee, Like, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import timeline
+from asyncapi import api
+from pagination import NEXT, encode_cursor
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class AsyncAPITestCase(TestCase):
+    """Tests for the JSON read API"""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        names = ("alice", "bob", "carol")
+        users = [
+            User(email=f"{name}@test.com", username=name, password="x")
+            for name in names
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        alice, bob, carol = users
+        self.ids = {user.username: user.id for user in users}
+
+        # carol's messages aren't fanned out: they're merged in when read
+        carol.is_high_fanout = True
+        alice.following.append(bob)
+        alice.following.append(carol)
+
+        now = datetime.utcnow()
+        posts = [
+            Message(text=f"{user.username} {n}", user_id=user.id,
+                    timestamp=now - timedelta(minutes=n * 3 + offset))
+            for offset, user in enumerate(users)
+            for n in range(3)
+        ]
+        db.session.add_all(posts)
+        db.session.commit()
+        self.message_ids = {msg.text: msg.id for msg in posts}
+
+        timeline.rebuild_timeline(alice)
+        db.session.commit()
+
+        self.client = TestClient(api)
+        self.client.__enter__()
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+        db.session.remove()
+
+    def login(self, user_id):
+        """Give the test client a Flask session cookie for `user_id`."""
+
+        serializer = app.session_interface.get_signing_serializer(app)
+        self.client.cookies.set(
+            app.config["SESSION_COOKIE_NAME"],
+            serializer.dumps({CURR_USER_KEY: user_id}),
+        )
+
+    def test_timeline(self):
+        """Does the timeline match the homepage's, high-fanout authors and all?"""
+
+        resp = self.client.get("/api/timeline")
+        self.assertEqual(resp.status_code, 401)
+
+        self.login(self.ids["alice"])
+        resp = self.client.get("/api/timeline")
+        self.assertEqual(resp.status_code, 200)
+
+        texts = [msg["text"] for msg in resp.json()["messages"]]
+        self.assertIn("carol 0", texts)
+
+        with app.app_context():
+            alice = User.query.get(self.ids["alice"])
+            expected = [msg.text for msg in timeline.home_timeline(alice)]
+        self.assertEqual(texts, expected)
+
+        resp = self.client.get("/api/timeline?cursor=bogus")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json(), {"error": "Malformed cursor"})
+
+    def test_profile(self):
+        """Does a profile come with its messages, newest first, and paging?"""
+
+        resp = self.client.get(f"/api/users/{self.ids['bob']}")
+        self.assertEqual(resp.status_code, 200)
+
+        data = resp.json()
+        self.assertEqual(data["user"]["username"], "bob")
+        self.assertEqual(
+            [msg["text"] for msg in data["messages"]], ["bob 0", "bob 1", "bob 2"]
+        )
+        self.assertIsNone(data["next_cursor"])
+
+        newest = Message.query.get(self.message_ids["bob 0"])
+        cursor = encode_cursor(NEXT, (newest.timestamp, newest.id))
+        resp = self.client.get(f"/api/users/{self.ids['bob']}?cursor={cursor}")
+        self.assertEqual(
+            [msg["text"] for msg in resp.json()["messages"]], ["bob 1", "bob 2"]
+        )
+
+        resp = self.client.get("/api/users/999999")
+        self.assertEqual(resp.status_code, 404)
+
+    def test_message(self):
+        """Does a message show with its author?"""
+
+        message_id = self.message_ids["carol 2"]
+        resp = self.client.get(f"/api/messages/{message_id}")
+        self.assertEqual(resp.status_code, 200)
+
+        data = resp.json()["message"]
+        self.assertEqual(data["text"], "carol 2")
+        self.assertEqual(data["user"]["username"], "carol")
+        self.assertEqual(
+            data["timestamp"], Message.query.get(message_id).timestamp.isoformat()
+        )
+
+        resp = self.client.get("/api/messages/999999")
+        self.assertEqual(resp.status_code, 404)
+
+    def test_search(self):
+        """Are users found by name?"""
+
+        resp = self.client.get("/api/users?q=CAR")
+        self.assertEqual(
+            resp.json(),
+            {
+                "users": [
+                    dict(
+                        id=self.ids["carol"],
+                        username="carol",
+                        image_url="/static/images/default-pic.png",
+                    )
+                ]
+            },
+        )
+
+        resp = self.client.get("/api/users?q=")
+        self.assertEqual(resp.json(), {"users": []})
+
+    def test_flask_pages(self):
+        """Are other paths served by the Flask app?"""
+
+        resp = self.client.get("/signup")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Join Warbler today", resp.text)
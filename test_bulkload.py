@@ -0,0 +1,119 @@
+"""Bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_bulkload.py
+
+
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message, FollowersFollowee, Like, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app
+import bulkload
+import indexes
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class BulkLoadTestCase(TestCase):
+    """Tests for loading CSV datasets"""
+
+    def setUp(self):
+        """Empty the tables and write a small sharded dataset."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.data_dir = tempfile.mkdtemp()
+
+        self.write("users-0001.csv", "email,username,password", [
+            f"u{n}@test.com,user{n},HASHED_PASSWORD" for n in range(1, 4)
+        ])
+        self.write("users-0002.csv", "email,username,password", [
+            f"u{n}@test.com,user{n},HASHED_PASSWORD" for n in range(4, 6)
+        ])
+        self.write("messages.csv", "text,timestamp,user_id", [
+            "Hello,2017-01-21 11:04:53.522807,1",
+            "World,2017-10-21 07:01:06.023966,4",
+        ])
+        self.write("follows.csv", "followee_id,follower_id", ["1,4", "5,1"])
+        self.write("likes.csv", "user_id,message_id", ["5,2"])
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def write(self, filename, header, lines):
+        """Write a CSV file into the test data directory."""
+
+        with open(os.path.join(self.data_dir, filename), "w") as file:
+            file.write("\n".join([header] + lines) + "\n")
+
+    def test_load(self):
+        """Are sharded files loaded with ids numbered across the shards?"""
+
+        counts = bulkload.load(self.data_dir, chunk_size=2)
+
+        self.assertEqual(
+            counts, dict(users=5, messages=2, follows=2, likes=1)
+        )
+        self.assertEqual(User.query.get(4).username, "user4")
+        self.assertEqual(Message.query.get(2).user.username, "user4")
+        self.assertEqual(
+            Message.query.get(1).timestamp, datetime(2017, 1, 21, 11, 4, 53, 522807)
+        )
+        self.assertEqual(User.query.get(5).liked_messages.one().text, "World")
+
+        # indexes are back, and new rows get fresh ids
+        self.assertEqual(indexes.missing_indexes(db.engine), [])
+        user = User(email="new@test.com", username="new", password="x")
+        db.session.add(user)
+        db.session.commit()
+        self.assertEqual(user.id, 6)
+
+    def test_resume(self):
+        """Does a resumed load pick up after the last committed chunk?"""
+
+        bulkload.progress.create(db.engine, checkfirst=True)
+        bulkload.load_file(
+            db.engine,
+            User.__table__,
+            os.path.join(self.data_dir, "users-0001.csv"),
+            chunk_size=2,
+        )
+        # ...then the first two rows of the second shard, and "crash"
+        db.engine.execute(
+            bulkload.progress.insert(), filename="users-0002.csv", rows=1
+        )
+        db.session.add(User(id=4, email="u4@test.com", username="user4",
+                            password="HASHED_PASSWORD"))
+        db.session.commit()
+
+        counts = bulkload.load(self.data_dir, resume=True, chunk_size=2)
+
+        self.assertEqual(counts["users"], 5)
+        self.assertEqual(User.query.count(), 5)
+        self.assertEqual(User.query.get(5).username, "user5")
+        self.assertEqual(Message.query.count(), 2)
@@ -0,0 +1,118 @@
+"""Denormalized counter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_counters.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, FollowersFollowee, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class CountersTestCase(TestCase):
+    """Tests for maintained user/message counters"""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.client = app.test_client()
+
+        u1 = User(email="one@test.com", username="one", password="HASHED_PASSWORD")
+        u2 = User(email="two@test.com", username="two", password="HASHED_PASSWORD")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+    def login(self, client, user_id):
+        """Put `user_id` in the test client's session."""
+
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def counts(self, user_id):
+        """(messages, following, followers, likes) counters for a user."""
+
+        u = User.query.get(user_id)
+        db.session.refresh(u)
+        return (u.messages_count, u.following_count,
+                u.followers_count, u.likes_count)
+
+    def test_write_paths_maintain_counters(self):
+        """Do posting, following and liking keep the counters in step?"""
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.post("/messages/new", data={"text": "Hello"})
+            msg = Message.query.one()
+
+            self.login(c, self.u2_id)
+            c.post(f"/users/follow/{self.u1_id}")
+            c.post(f"/like/{msg.id}", data={"return_to": "/"})
+
+        self.assertEqual(self.counts(self.u1_id), (1, 0, 1, 0))
+        self.assertEqual(self.counts(self.u2_id), (0, 1, 0, 1))
+        self.assertEqual(Message.query.one().likes_count, 1)
+
+        with self.client as c:
+            self.login(c, self.u2_id)
+            c.post(f"/users/stop-following/{self.u1_id}")
+
+            self.login(c, self.u1_id)
+            c.post(f"/messages/{msg.id}/delete")
+
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 0))
+        self.assertEqual(self.counts(self.u2_id), (0, 0, 0, 0))
+
+    def test_reconcile_repairs_drift(self):
+        """Does reconcile() recompute counters that bypassed the write paths?"""
+
+        msg = Message(text="Bulk loaded", user_id=self.u1_id)
+        db.session.add(msg)
+        db.session.add(FollowersFollowee(followee_id=self.u2_id,
+                                         follower_id=self.u1_id))
+        db.session.commit()
+        db.session.add(Like(user_id=self.u2_id, message_id=msg.id))
+        db.session.commit()
+
+        repaired = counters.reconcile(batch_size=1)
+
+        self.assertEqual(repaired, 3)
+        self.assertEqual(self.counts(self.u1_id), (1, 0, 1, 0))
+        self.assertEqual(self.counts(self.u2_id), (0, 1, 0, 1))
+        self.assertEqual(Message.query.one().likes_count, 1)
+
+        # A second pass finds nothing left to repair
+        self.assertEqual(counters.reconcile(), 0)
@@ -0,0 +1,302 @@
+"""Follow graph tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_followgraph.py
+
+
+import os
+from unittest import TestCase
+
+from models import (
+    db,
+    User,
+    Message,
+    FollowersFollowee,
+    FollowEvent,
+    Like,
+    TimelineEntry,
+)
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import followgraph
+from followgraph import FollowGraph, Flags
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class FollowGraphTestCase(TestCase):
+    """Tests for the CSR arrays and their pending changes"""
+
+    def setUp(self):
+        # 1 -> 2, 1 -> 3, 2 -> 1, 3 -> 4
+        self.graph = FollowGraph(5, [(1, 2), (1, 3), (2, 1), (3, 4)])
+
+    def test_arrays(self):
+        """Are both directions laid out as sorted rows?"""
+
+        self.assertEqual(list(self.graph.out_offsets), [0, 0, 2, 3, 4, 4])
+        self.assertEqual(list(self.graph.out_targets), [2, 3, 1, 4])
+        self.assertEqual(list(self.graph.in_offsets), [0, 0, 1, 2, 3, 4])
+        self.assertEqual(list(self.graph.in_targets), [2, 1, 1, 3])
+
+    def test_membership(self):
+        """Are follows answered in both directions, including unknown ids?"""
+
+        self.assertTrue(self.graph.follows(1, 3))
+        self.assertFalse(self.graph.follows(3, 1))
+        self.assertFalse(self.graph.follows(99, 1))
+        self.assertEqual(self.graph.followed_among(1, [2, 3, 4, 99]), {2, 3})
+        self.assertEqual(self.graph.followers_among(1, [2, 3, 99]), {2})
+        self.assertEqual(self.graph.following_ids(1), [2, 3])
+        self.assertEqual(self.graph.follower_ids(4), [3])
+
+    def test_flags(self):
+        """Are follows-you and mutual flags right?"""
+
+        self.assertEqual(
+            self.graph.flags(1, [2, 3, 4]),
+            {
+                2: Flags(True, True, True),
+                3: Flags(True, False, False),
+                4: Flags(False, False, False),
+            },
+        )
+
+    def test_changes(self):
+        """Do follows and unfollows after the build show up and cancel out?"""
+
+        self.graph.add(4, 1)
+        self.graph.add(6, 1)
+        self.graph.remove(1, 2)
+
+        self.assertTrue(self.graph.follows(4, 1))
+        self.assertTrue(self.graph.follows(6, 1))
+        self.assertFalse(self.graph.follows(1, 2))
+        self.assertEqual(self.graph.follower_ids(1), [2, 4, 6])
+        self.assertEqual(self.graph.following_count(1), 1)
+        self.assertEqual(len(self.graph), 5)
+
+        self.graph.add(1, 2)
+        self.graph.remove(4, 1)
+        self.assertTrue(self.graph.follows(1, 2))
+        self.assertFalse(self.graph.follows(4, 1))
+        self.assertFalse(self.graph.removed_out[1])
+        self.assertFalse(self.graph.added_out[4])
+
+        self.graph.remove_user(1)
+        self.assertEqual(self.graph.following_ids(1), [])
+        self.assertEqual(self.graph.follower_ids(1), [])
+        self.assertEqual(len(self.graph), 1)
+
+    def test_compacted(self):
+        """Are pending changes folded into new arrays?"""
+
+        self.graph.add(4, 1)
+        self.graph.add(6, 1)
+        self.graph.remove(1, 2)
+        self.assertEqual(self.graph.pending(), 3)
+
+        compacted = self.graph.compacted()
+        self.assertEqual(compacted.pending(), 0)
+        self.assertEqual(list(compacted.out_targets), [3, 1, 4, 1, 1])
+        self.assertEqual(compacted.follower_ids(1), [2, 4, 6])
+        self.assertEqual(len(compacted), len(self.graph))
+
+    def test_memory_usage(self):
+        """Are the arrays 4 bytes an entry?"""
+
+        usage = self.graph.memory_usage()
+        self.assertEqual(usage["edges"], 8 * 4)
+        self.assertEqual(usage["offsets"], 12 * 4)
+
+
+class FollowGraphViewsTestCase(TestCase):
+    """Tests for follow buttons and badges drawn from the graph"""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        FollowEvent.query.delete()
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        followgraph.reset_graph()
+        self.client = app.test_client()
+
+        users = [
+            User(email=f"{name}@test.com", username=name, password="x")
+            for name in ("alice", "bob", "carol")
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+
+        self.alice_id, self.bob_id, self.carol_id = [user.id for user in users]
+
+        self.enabled = app.config["FOLLOW_GRAPH_ENABLED"]
+
+    def tearDown(self):
+        app.config["FOLLOW_GRAPH_ENABLED"] = self.enabled
+        followgraph.reset_graph()
+
+    def login(self, client, user_id):
+        """Put `user_id` in the test client's session."""
+
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def follow(self, client, follower_id, followee_id):
+        self.login(client, follower_id)
+        client.post(f"/users/follow/{followee_id}")
+
+    def test_follow_buttons(self):
+        """Do the buttons and badges follow along with follows?"""
+
+        with self.client as c:
+            self.follow(c, self.bob_id, self.alice_id)
+
+            self.login(c, self.alice_id)
+            resp = c.get(f"/users/{self.bob_id}")
+            self.assertIn(b"Follows you", resp.data)
+            self.assertIn(b">Follow<", resp.data)
+
+            # alice follows back: the graph is already built, so it's updated
+            self.assertIsNotNone(followgraph._graph)
+            c.post(f"/users/follow/{self.bob_id}")
+            resp = c.get(f"/users/{self.bob_id}")
+            self.assertIn(b"You follow each other", resp.data)
+            self.assertIn(b"Unfollow", resp.data)
+
+            resp = c.get("/users")
+            self.assertEqual(resp.data.count(b"Unfollow"), 1)
+
+            c.post(f"/users/stop-following/{self.bob_id}")
+            resp = c.get(f"/users/{self.bob_id}")
+            self.assertIn(b"Follows you", resp.data)
+            self.assertNotIn(b"Unfollow", resp.data)
+
+    def test_viewer_resynced(self):
+        """Does a viewer see follows the graph missed (another process's)?"""
+
+        with app.app_context():
+            followgraph.get_graph()
+
+            # as if followed through some other worker
+            alice = User.query.get(self.alice_id)
+            alice.following.append(User.query.get(self.carol_id))
+            alice.following_count += 1
+            db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.alice_id)
+            resp = c.get(f"/users/{self.carol_id}")
+            self.assertIn(b"Unfollow", resp.data)
+
+    def elsewhere(self, follower_id, followed_id, following=True):
+        """Follow or unfollow as another process would: row and event."""
+
+        row = dict(followee_id=follower_id, follower_id=followed_id)
+        if following:
+            db.session.add(FollowersFollowee(**row))
+        else:
+            FollowersFollowee.query.filter_by(**row).delete()
+        db.session.add(FollowEvent(follower_id=follower_id, followed_id=followed_id))
+        db.session.commit()
+
+    def test_polled(self):
+        """Are other processes' follows and unfollows picked up by a poll?"""
+
+        with self.client as c:
+            self.follow(c, self.alice_id, self.bob_id)
+            self.assertEqual(FollowEvent.query.count(), 1)
+
+        with app.app_context():
+            graph = followgraph.get_graph()
+
+            self.elsewhere(self.bob_id, self.carol_id)
+            self.elsewhere(self.alice_id, self.bob_id, following=False)
+            # an event whose follow was undone before the poll
+            db.session.add(FollowEvent(follower_id=self.carol_id, followed_id=1))
+            db.session.commit()
+            self.assertTrue(graph.follows(self.alice_id, self.bob_id))
+
+            followgraph.poll()
+            self.assertTrue(graph.follows(self.bob_id, self.carol_id))
+            self.assertFalse(graph.follows(self.alice_id, self.bob_id))
+            self.assertFalse(graph.follows(self.carol_id, 1))
+
+            # read again, by the lookback: no change
+            followgraph.poll()
+            self.assertEqual(graph.following_ids(self.bob_id), [self.carol_id])
+
+    def test_compaction(self):
+        """Does a compacted graph keep changes made while it was built?"""
+
+        with app.app_context():
+            self.elsewhere(self.alice_id, self.bob_id)
+            old = followgraph.get_graph()
+            old.add(self.bob_id, self.carol_id)
+
+            def build(graph):
+                compacted = graph.compacted()
+                # changed before the new graph is swapped in
+                followgraph.followed(
+                    User.query.get(self.carol_id), User.query.get(self.alice_id)
+                )
+                return compacted
+
+            followgraph._replace(app, build)
+
+            graph = followgraph.get_graph()
+            self.assertIsNot(graph, old)
+            self.assertEqual(graph.pending(), 1)
+            self.assertEqual(len(graph.out_targets), 2)
+            self.assertTrue(graph.follows(self.alice_id, self.bob_id))
+            self.assertTrue(graph.follows(self.carol_id, self.alice_id))
+
+    def test_preload(self):
+        """Is the graph built when the app is?"""
+
+        with app.app_context():
+            self.elsewhere(self.alice_id, self.bob_id)
+            db.session.remove()
+
+        followgraph.preload(app)
+        self.assertTrue(followgraph._graph.follows(self.alice_id, self.bob_id))
+
+    def test_disabled(self):
+        """With the graph off, are the same answers queried instead?"""
+
+        app.config["FOLLOW_GRAPH_ENABLED"] = False
+
+        with self.client as c:
+            self.follow(c, self.bob_id, self.alice_id)
+            self.follow(c, self.alice_id, self.bob_id)
+
+            resp = c.get(f"/users/{self.bob_id}")
+            self.assertIn(b"You follow each other", resp.data)
+            self.assertIn(b"Unfollow", resp.data)
+
+        self.assertIsNone(followgraph._graph)
@@ -0,0 +1,232 @@
+"""Fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragcache.py
+
+
+import os
+import threading
+from unittest import TestCase
+
+from models import db, User, Message, FollowersFollowee, Like, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import fragcache
+import recommend
+import usercache
+from fragcache import LRUBackend, MemcachedBackend, MemcachedStandIn
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class BackendTestCase(TestCase):
+    """Tests for the fragment cache backends"""
+
+    def check_backend(self, backend):
+        backend.set_many({"a": "<p>A</p>", "b": "<p>é</p>"}, 60)
+        self.assertEqual(
+            backend.get_many(["a", "b", "c"]), {"a": "<p>A</p>", "b": "<p>é</p>"}
+        )
+
+        backend.delete_many(["a"])
+        self.assertEqual(backend.get_many(["a", "b"]), {"b": "<p>é</p>"})
+
+        backend.clear()
+        self.assertEqual(backend.get_many(["b"]), {})
+
+    def test_lru(self):
+        """Does the LRU store, evict and expire fragments?"""
+
+        backend = LRUBackend(maxsize=2)
+        self.check_backend(backend)
+
+        backend.set_many({"a": "A", "b": "B"}, 60)
+        backend.get_many(["a"])
+        backend.set_many({"c": "C"}, 60)
+        self.assertEqual(backend.get_many(["a", "b", "c"]), {"a": "A", "c": "C"})
+
+        backend.set_many({"d": "D"}, -1)
+        self.assertEqual(backend.get_many(["d"]), {})
+
+    def test_memcached(self):
+        """Does the memcached client work against the stand-in?"""
+
+        server = MemcachedStandIn(("127.0.0.1", 0))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        try:
+            self.check_backend(MemcachedBackend(*server.server_address))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_memcached_down(self):
+        """Is an unreachable memcached treated as an empty cache?"""
+
+        server = MemcachedStandIn(("127.0.0.1", 0))
+        address = server.server_address
+        server.server_close()
+
+        backend = MemcachedBackend(*address)
+        with self.assertLogs("warbler.fragcache", "WARNING"):
+            self.assertEqual(backend.get_many(["a"]), {})
+
+
+class FragmentViewsTestCase(TestCase):
+    """Tests for cached fragments in pages"""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        fragcache.cache.clear()
+        usercache.cache.clear()
+        recommend.reset_popular()
+        self.client = app.test_client()
+
+        alice = User(email="alice@test.com", username="alice", password="x")
+        bob = User.signup("bob", "bob@test.com", "password", None)
+        db.session.add(alice)
+        db.session.commit()
+
+        self.alice_id = alice.id
+        self.bob_id = bob.id
+
+        with self.client as c:
+            self.login(c, self.alice_id)
+            c.post(f"/users/follow/{self.bob_id}")
+            self.login(c, self.bob_id)
+            for text in ("First", "Second"):
+                c.post("/messages/new", data={"text": text})
+
+        self.msg_id = Message.query.filter_by(text="First").one().id
+
+    def login(self, client, user_id):
+        """Put `user_id` in the test client's session."""
+
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def fragments(self, resp):
+        return int(resp.headers["X-Fragment-Hits"]), int(
+            resp.headers["X-Fragment-Misses"]
+        )
+
+    def test_hits(self):
+        """Are fragments rendered once, with the like star kept out?"""
+
+        with self.client as c:
+            self.login(c, self.alice_id)
+
+            first = c.get("/")
+            self.assertEqual(self.fragments(first), (0, 2))
+
+            second = c.get("/")
+            self.assertEqual(self.fragments(second), (2, 0))
+            self.assertEqual(first.data, second.data)
+
+            c.post(f"/like/{self.msg_id}", data={"return_to": "/"})
+            resp = c.get("/")
+            self.assertEqual(self.fragments(resp), (2, 0))
+            self.assertIn(b"fas fa-star", resp.data)
+            self.assertIn(b"far fa-star", resp.data)
+
+            self.login(c, self.bob_id)
+            resp = c.get(f"/users/{self.bob_id}")
+            self.assertEqual(self.fragments(resp), (0, 2))
+            resp = c.get(f"/users/{self.alice_id}/following")
+            self.assertEqual(self.fragments(resp), (0, 1))
+            resp = c.get(f"/users/{self.alice_id}/following")
+            self.assertEqual(self.fragments(resp), (1, 0))
+
+        stats = fragcache.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (5, 5))
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_profile_edit(self):
+        """Do a user's fragments change when their profile does?"""
+
+        with self.client as c:
+            self.login(c, self.alice_id)
+            c.get("/")
+
+            self.login(c, self.bob_id)
+            c.post(
+                "/users/profile",
+                data={
+                    "username": "robert",
+                    "email": "bob@test.com",
+                    "image_url": "",
+                    "header_image_url": "",
+                    "bio": "",
+                    "location": "",
+                    "password": "password",
+                },
+            )
+
+            self.login(c, self.alice_id)
+            resp = c.get("/")
+            self.assertEqual(self.fragments(resp), (0, 2))
+            self.assertIn(b"@robert", resp.data)
+            self.assertNotIn(b"@bob", resp.data)
+
+    def test_delete_forgets(self):
+        """Does deleting a message drop its cached fragments?"""
+
+        with self.client as c:
+            self.login(c, self.bob_id)
+            c.get(f"/users/{self.bob_id}")
+
+            with app.test_request_context():
+                msg = Message.query.get(self.msg_id)
+                key = fragcache.fragment_key("profile-message", msg)
+            self.assertTrue(fragcache.cache.backend.get_many([key]))
+
+            c.post(f"/messages/{self.msg_id}/delete")
+            self.assertFalse(fragcache.cache.backend.get_many([key]))
+
+    def test_memcached_pages(self):
+        """Do pages render the same from the memcached backend?"""
+
+        server = MemcachedStandIn(("127.0.0.1", 0))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        backend = fragcache.cache.backend
+        fragcache.cache.backend = MemcachedBackend(*server.server_address)
+
+        try:
+            with self.client as c:
+                self.login(c, self.alice_id)
+                first = c.get("/")
+                second = c.get("/")
+
+            self.assertEqual(self.fragments(second), (2, 0))
+            self.assertEqual(first.data, second.data)
+        finally:
+            fragcache.cache.backend = backend
+            server.shutdown()
+            server.server_close()
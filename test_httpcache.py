@@ -0,0 +1,180 @@
+"""HTTP caching policy tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_httpcache.py
+
+
+import os
+from unittest import TestCase
+
+from flask import template_rendered
+
+from models import db, User, Message, FollowersFollowee, Like, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class HTTPCacheTestCase(TestCase):
+    """Tests for ETags, 304s and the static file policy"""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.client = app.test_client()
+
+        alice = User(email="alice@test.com", username="alice", password="x")
+        bob = User(email="bob@test.com", username="bob", password="x")
+        db.session.add_all([alice, bob])
+        db.session.commit()
+
+        self.alice_id = alice.id
+        self.bob_id = bob.id
+
+        with self.client as c:
+            self.login(c, self.alice_id)
+            c.post(f"/users/follow/{self.bob_id}")
+            self.login(c, self.bob_id)
+            c.post("/messages/new", data={"text": "Hello"})
+
+        self.msg_id = Message.query.one().id
+
+        self.rendered = []
+        template_rendered.connect(self.record, app)
+
+    def tearDown(self):
+        template_rendered.disconnect(self.record, app)
+
+    def record(self, sender, template, context, **extra):
+        self.rendered.append(template.name)
+
+    def login(self, client, user_id):
+        """Put `user_id` in the test client's session."""
+
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_not_modified(self):
+        """Do unchanged pages get a 304 without being rendered?"""
+
+        with self.client as c:
+            self.login(c, self.alice_id)
+
+            for url in ("/", f"/users/{self.bob_id}", f"/messages/{self.msg_id}"):
+                first = c.get(url)
+                self.assertEqual(first.status_code, 200)
+                self.assertTrue(first.headers["ETag"].startswith('W/"'))
+
+                self.rendered = []
+                second = c.get(url, headers={"If-None-Match": first.headers["ETag"]})
+                self.assertEqual(second.status_code, 304, url)
+                self.assertEqual(second.data, b"")
+                self.assertEqual(self.rendered, [])
+
+                self.assertEqual(second.headers["Cache-Control"], "private, no-cache")
+                self.assertIn("Cookie", second.headers["Vary"])
+
+    def test_changes_bust_etag(self):
+        """Do new messages and likes change the ETag?"""
+
+        with self.client as c:
+            self.login(c, self.alice_id)
+            home = c.get("/").headers["ETag"]
+            profile = c.get(f"/users/{self.bob_id}").headers["ETag"]
+
+            self.login(c, self.bob_id)
+            c.post("/messages/new", data={"text": "Again"})
+
+            self.login(c, self.alice_id)
+            resp = c.get("/", headers={"If-None-Match": home})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(b"Again", resp.data)
+            resp = c.get(f"/users/{self.bob_id}", headers={"If-None-Match": profile})
+            self.assertEqual(resp.status_code, 200)
+
+            home = c.get("/").headers["ETag"]
+            c.post(f"/like/{self.msg_id}", data={"return_to": "/"})
+            resp = c.get("/", headers={"If-None-Match": home})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_viewers_get_own_etags(self):
+        """Does the same page get a different ETag for another viewer?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess.clear()
+
+            url = f"/messages/{self.msg_id}"
+            anon = c.get(url)
+            self.assertEqual(anon.headers["Cache-Control"], "no-cache")
+
+            self.login(c, self.alice_id)
+            resp = c.get(url, headers={"If-None-Match": anon.headers["ETag"]})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers["ETag"], anon.headers["ETag"])
+
+    def test_flashes_render(self):
+        """Is a page with a pending flash message rendered regardless?"""
+
+        with self.client as c:
+            self.login(c, self.alice_id)
+            etag = c.get("/").headers["ETag"]
+
+            with c.session_transaction() as sess:
+                sess["_flashes"] = [("success", "Flashed!")]
+
+            resp = c.get("/", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(b"Flashed!", resp.data)
+
+    def test_missing_page(self):
+        """Do missing messages still 404?"""
+
+        resp = self.client.get(f"/messages/{self.msg_id + 1}")
+        self.assertEqual(resp.status_code, 404)
+        self.assertNotIn("ETag", resp.headers)
+
+    def test_static_and_other_pages(self):
+        """Are static files cached for long, and other pages not at all?"""
+
+        resp = self.client.get("/static/stylesheets/style.css?v=1")
+        self.assertEqual(
+            resp.headers["Cache-Control"], "public, max-age=31536000, immutable"
+        )
+
+        resp = self.client.get("/static/stylesheets/style.css")
+        self.assertEqual(resp.headers["Cache-Control"], "public, max-age=3600")
+
+        resp = self.client.get("/login")
+        self.assertIn("no-store", resp.headers["Cache-Control"])
+
+        with app.test_request_context():
+            url = app.jinja_env.globals["static_url"]("stylesheets/style.css")
+        self.assertRegex(url, r"^/static/stylesheets/style\.css\?v=\d+$")
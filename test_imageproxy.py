@@ -0,0 +1,272 @@
+"""Image proxy tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_imageproxy.py
+
+
+import io
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+
+from PIL import Image
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, create_app
+import imageproxy
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+def make_image(width, height, fmt="JPEG"):
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), "teal").save(output, fmt)
+    return output.getvalue()
+
+
+class Origin(BaseHTTPRequestHandler):
+    """A server of `files`, counting requests and how many run at once."""
+
+    files = {}
+    hits = []
+    running = 0
+    max_running = 0
+    delay = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.hits.append(self.path)
+            cls.running += 1
+            cls.max_running = max(cls.max_running, cls.running)
+        time.sleep(cls.delay)
+        # done before the client sees the response, so it can't overlap
+        with cls.lock:
+            cls.running -= 1
+
+        if self.path not in cls.files:
+            self.send_error(404)
+            return
+        data = cls.files[self.path]
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class ImageProxyTestCase(TestCase):
+    """Tests for resizing and caching users' images"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), Origin)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.origin = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        Origin.files = {"/photo.jpg": make_image(600, 400)}
+        Origin.hits = []
+        Origin.max_running = 0
+        Origin.delay = 0
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = create_app(
+            "test", IMAGE_CACHE_DIR=self.directory.name, IMAGE_PROXY_ALLOW_PRIVATE=True
+        )
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.directory.cleanup()
+        # each new app takes over `db`; hand it back
+        db.app = app
+
+    def thumbnail_url(self, url, size):
+        with self.app.test_request_context():
+            return imageproxy.thumbnail_url(url, size)
+
+    def get_image(self, url, size):
+        resp = self.client.get(self.thumbnail_url(url, size))
+        self.assertEqual(resp.status_code, 200)
+        return resp, Image.open(io.BytesIO(resp.data))
+
+    def test_resize(self):
+        """Is the origin fetched once, and each size made from it?"""
+
+        url = f"{self.origin}/photo.jpg"
+        resp, image = self.get_image(url, "card")
+        self.assertEqual(image.size, (140, 140))
+        self.assertEqual(resp.mimetype, "image/jpeg")
+        self.assertEqual(
+            resp.headers["Cache-Control"], "public, max-age=2592000, immutable"
+        )
+
+        resp, image = self.get_image(url, "hero")
+        self.assertEqual(image.size, (600, 400))
+        resp, image = self.get_image(url, "timeline")
+        self.assertEqual(image.size, (96, 96))
+        self.get_image(url, "card")
+
+        self.assertEqual(Origin.hits, ["/photo.jpg"])
+
+    def test_static_images(self):
+        """Are the default images read from the static folder?"""
+
+        resp, image = self.get_image("/static/images/warbler-hero.jpg", "hero")
+        self.assertEqual(image.width, 800)
+        self.assertLess(len(resp.data), 200 * 1024)
+
+        resp = self.client.get(self.thumbnail_url("/static/../app.py", "card"))
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(Origin.hits, [])
+
+    def test_failures(self):
+        """Are unsigned URLs refused and broken origins left to the browser?"""
+
+        url = f"{self.origin}/photo.jpg"
+        proxied = self.thumbnail_url(url, "card")
+        resp = self.client.get(proxied.replace("photo", "other"))
+        self.assertEqual(resp.status_code, 404)
+
+        missing = f"{self.origin}/missing.jpg"
+        resp = self.client.get(self.thumbnail_url(missing, "card"))
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp.headers["Location"], missing)
+
+        Origin.files["/text.jpg"] = b"not an image"
+        resp = self.client.get(self.thumbnail_url(f"{self.origin}/text.jpg", "card"))
+        self.assertEqual(resp.status_code, 302)
+
+        # refused once connected, by the address connected to, whatever
+        # the name looked up to before
+        self.app.config["IMAGE_PROXY_ALLOW_PRIVATE"] = False
+        resp = self.client.get(self.thumbnail_url(url, "card"))
+        self.assertEqual(resp.status_code, 302)
+        by_name = url.replace("127.0.0.1", "localhost")
+        resp = self.client.get(self.thumbnail_url(by_name, "card"))
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(Origin.hits, ["/missing.jpg", "/text.jpg"])
+
+        with self.app.test_request_context():
+            self.assertEqual(
+                imageproxy.thumbnail_url("data:image/png,", "card"), "data:image/png,"
+            )
+            self.assertRaises(ValueError, imageproxy.thumbnail_url, url, "huge")
+
+    def test_prune(self):
+        """Does pruning delete the oldest images over the limit?"""
+
+        directory = self.directory.name
+        Origin.files["/other.jpg"] = make_image(300, 300)
+        for name in ("photo", "other"):
+            self.get_image(f"{self.origin}/{name}.jpg", "card")
+        stale = os.path.join(directory, "card", ".tmp-stale")
+        with open(stale, "wb") as file:
+            file.write(b"half")
+
+        files = sorted(
+            os.path.join(parent, name)
+            for parent, _, names in os.walk(directory)
+            for name in names
+        )
+        sizes = {path: os.path.getsize(path) for path in files}
+        with self.app.test_request_context():
+            other = imageproxy.image_key(f"{self.origin}/other.jpg")
+        # photo's files first, an hour apart
+        for age, path in enumerate(sorted(files, key=lambda p: other in p)):
+            os.utime(path, (time.time() - (10 - age) * 3600,) * 2)
+
+        newest = max(files, key=os.path.getmtime)
+        deleted, left = imageproxy.prune(directory, sizes[newest])
+        self.assertEqual(left, sizes[newest])
+        self.assertEqual(deleted, len(files) - 1)
+        self.assertTrue(os.path.exists(newest))
+
+        # a pruned image is fetched again
+        Origin.hits = []
+        self.get_image(f"{self.origin}/photo.jpg", "card")
+        self.assertEqual(Origin.hits, ["/photo.jpg"])
+
+        result = self.app.test_cli_runner().invoke(args=["prune-images"])
+        self.assertIn("Deleted 0 files", result.output)
+
+    def test_concurrency(self):
+        """Do origin fetches wait for one of IMAGE_FETCH_CONCURRENCY slots?"""
+
+        self.app = create_app(
+            "test",
+            IMAGE_CACHE_DIR=self.directory.name,
+            IMAGE_PROXY_ALLOW_PRIVATE=True,
+            IMAGE_FETCH_CONCURRENCY=2,
+        )
+        Origin.delay = 0.1
+        for i in range(6):
+            Origin.files[f"/{i}.jpg"] = make_image(100, 100)
+
+        statuses = []
+
+        def get(i):
+            url = self.thumbnail_url(f"{self.origin}/{i}.jpg", "card")
+            statuses.append(self.app.test_client().get(url).status_code)
+
+        threads = [threading.Thread(target=get, args=(i,)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [200] * 6)
+        self.assertEqual(len(Origin.hits), 6)
+        self.assertEqual(Origin.max_running, 2)
+
+    def test_templates(self):
+        """Do pages link to the proxied images?"""
+
+        User.query.delete()
+        user = User.signup("imageuser", "image@test.com", "password", None)
+        db.session.commit()
+
+        with self.app.test_request_context():
+            avatar = imageproxy.thumbnail_url(user.image_url, "avatar")
+            banner = imageproxy.thumbnail_url(user.header_image_url, "banner")
+
+        resp = self.client.get(f"/users/{user.id}")
+        html = resp.get_data(as_text=True)
+        self.assertIn(avatar.replace("&", "&amp;"), html)
+        self.assertIn(banner.replace("&", "&amp;"), html)
+        self.assertNotIn('src="/static/images/default-pic.png"', html)
+
+        User.query.delete()
+        db.session.commit()
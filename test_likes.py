@@ -0,0 +1,167 @@
+"""Like/unlike write path tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_likes.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, FollowersFollowee, Like, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import likes
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class LikesTestCase(TestCase):
+    """Tests for idempotent and write-behind likes"""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        likes.buffer.take()
+        self.client = app.test_client()
+
+        author = User(email="author@test.com", username="author", password="x")
+        fan = User(email="fan@test.com", username="fan", password="x")
+        db.session.add_all([author, fan])
+        db.session.commit()
+
+        msg = Message(text="Like me", user_id=author.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.author_id = author.id
+        self.fan_id = fan.id
+        self.msg_id = msg.id
+
+        self.config = {
+            key: app.config[key]
+            for key in ("LIKES_WRITE_BEHIND", "LIKES_FLUSH_INTERVAL")
+        }
+        # flush by hand, not from the background thread
+        app.config["LIKES_FLUSH_INTERVAL"] = 3600
+
+    def tearDown(self):
+        app.config.update(self.config)
+        likes.buffer.take()
+
+    def login(self, client, user_id):
+        """Put `user_id` in the test client's session."""
+
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def state(self):
+        """(likes rows, message likes_count, fan likes_count)"""
+
+        db.session.expire_all()
+        return (
+            Like.query.count(),
+            Message.query.get(self.msg_id).likes_count,
+            User.query.get(self.fan_id).likes_count,
+        )
+
+    def test_apply_is_idempotent(self):
+        """Do repeated likes and unliking what isn't liked change nothing?"""
+
+        pair = (self.fan_id, self.msg_id)
+
+        changed = Like.apply({pair: True})
+        self.assertEqual(list(changed), [pair])
+        liked, liked_at = changed[pair]
+        self.assertTrue(liked)
+        self.assertEqual(Like.apply({pair: True}), {})
+        db.session.commit()
+        self.assertEqual(self.state(), (1, 1, 1))
+
+        # an unlike says when the like it removed was made
+        self.assertEqual(Like.apply({pair: False}), {pair: (False, liked_at)})
+        self.assertEqual(Like.apply({pair: False}), {})
+        db.session.commit()
+        self.assertEqual(self.state(), (0, 0, 0))
+
+        # likes of messages that are gone are dropped, not errors
+        self.assertEqual(Like.apply({(self.fan_id, self.msg_id + 1): True}), {})
+
+    def test_double_click(self):
+        """Does liking (or unliking) twice in a row work?"""
+
+        with self.client as c:
+            self.login(c, self.fan_id)
+
+            for _ in range(2):
+                resp = c.post(f"/like/{self.msg_id}", data={"return_to": "/"})
+                self.assertEqual(resp.status_code, 302)
+            self.assertEqual(self.state(), (1, 1, 1))
+
+            for _ in range(2):
+                resp = c.post(f"/unlike/{self.msg_id}", data={"return_to": "/"})
+                self.assertEqual(resp.status_code, 302)
+            self.assertEqual(self.state(), (0, 0, 0))
+
+    def test_write_behind(self):
+        """Are buffered toggles coalesced, visible to their user, and flushed?"""
+
+        app.config["LIKES_WRITE_BEHIND"] = True
+        url = f"/messages/{self.msg_id}"
+
+        with self.client as c:
+            self.login(c, self.fan_id)
+
+            for path in ("like", "unlike", "like"):
+                c.post(f"/{path}/{self.msg_id}", data={"return_to": "/"})
+
+            self.assertEqual(likes.buffer.pending, {(self.fan_id, self.msg_id): True})
+            self.assertEqual(self.state(), (0, 0, 0))
+
+            # the fan sees their like straight away...
+            self.assertIn(b"fas fa-star", c.get(url).data)
+
+            # ...and another user in the same browser doesn't
+            self.login(c, self.author_id)
+            self.assertNotIn(b"fas fa-star", c.get(url).data)
+
+        with app.app_context():
+            self.assertEqual(likes.flush(), 1)
+        self.assertEqual(self.state(), (1, 1, 1))
+        self.assertEqual(len(likes.buffer), 0)
+
+        with self.client as c:
+            self.login(c, self.fan_id)
+            c.post(f"/unlike/{self.msg_id}", data={"return_to": "/"})
+            c.post(f"/like/{self.msg_id}", data={"return_to": "/"})
+            c.post(f"/unlike/{self.msg_id}", data={"return_to": "/"})
+            self.assertNotIn(b"fas fa-star", c.get(url).data)
+
+        with app.app_context():
+            likes.flush()
+        self.assertEqual(self.state(), (0, 0, 0))
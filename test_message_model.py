@@ -156,7 +156,7 @@ class MessageModelTestCase(TestCase):
         liker = User.query.order_by(User.id.desc()).first()
 
         # gets u1
-        nonliker = User.query.first()
+        nonliker = User.query.order_by(User.id).first()
 
         new_like = Like(user_id=liker.id, message_id=msg_to_like.id)
         db.session.add(new_like)
@@ -20,7 +20,9 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY, do_logout
+from app import app, CURR_USER_KEY
+from views import do_logout
+from querystats import count_queries
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -32,6 +34,10 @@ db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
 
+# Fail any view that runs more queries than its @query_budget
+
+app.config['QUERY_BUDGET_ENFORCE'] = True
+
 
 class MessageViewTestCase(TestCase):
     """Test views for messages."""
@@ -55,6 +61,7 @@ class MessageViewTestCase(TestCase):
                                      image_url=None)
 
         db.session.commit()
+        self.testuser_id = self.testuser.id
 
     def test_add_message(self):
         """Can user add a message?"""
@@ -161,7 +168,7 @@ class MessageViewTestCase(TestCase):
             c.post("/messages/new", data={"text": "Hello"})
 
             # gets the user who is logged in (testuser)
-            liker = User.query.first()
+            liker = User.query.get(self.testuser_id)
             msg_to_like = Message.query.first()
 
             # testuser likes her own post
@@ -185,7 +192,7 @@ class MessageViewTestCase(TestCase):
             c.post("/messages/new", data={"text": "Hello"})
 
             # gets the user who is logged in (testuser)
-            liker = User.query.first()
+            liker = User.query.get(self.testuser_id)
             msg_to_like = Message.query.first()
 
             # testuser likes her own post
@@ -203,6 +210,33 @@ class MessageViewTestCase(TestCase):
             self.assertEqual(msg.text, "Hello")
             self.assertIn(b'<i class="far fa-star pl-1">', resp.data)
 
+    def test_liked_state_query_count_is_constant(self):
+        """Does rendering liked state cost the same queries for 1 or 10 messages?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post("/messages/new", data={"text": "First"})
+            first = Message.query.one()
+            c.post(f"/like/{first.id}", data={"return_to": "/"})
+
+            pages = ["/", f"/users/{self.testuser.id}",
+                     f"/users/{self.testuser.id}/likes"]
+            few = [count_queries(lambda: c.get(page)) for page in pages]
+
+            for i in range(9):
+                c.post("/messages/new", data={"text": f"Message {i}"})
+            for msg in Message.query.filter(Message.id != first.id):
+                c.post(f"/like/{msg.id}", data={"return_to": "/"})
+
+            many = [count_queries(lambda: c.get(page)) for page in pages]
+
+            self.assertEqual(few, many)
+
+            resp = c.get("/")
+            self.assertEqual(resp.data.count(b'<i class="fas fa-star pl-1">'), 10)
+
     def test_404(self):
         """Does 404 page load"""
 
@@ -0,0 +1,163 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pagination.py
+
+
+import base64
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from flask import template_rendered
+
+from models import db, User, Message, FollowersFollowee, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from pagination import PREV, encode_cursor, decode_cursor
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class PaginationTestCase(TestCase):
+    """Tests for cursor-paginated list views"""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        app.config["PER_PAGE"] = 2
+
+        self.client = app.test_client()
+
+        u = User(email="test@test.com", username="testuser",
+                 password="HASHED_PASSWORD")
+        db.session.add(u)
+        db.session.commit()
+        self.user_id = u.id
+
+        # Five messages, two sharing a timestamp to exercise the id tiebreak
+        start = datetime(2018, 1, 1)
+        stamps = [start, start + timedelta(days=1), start + timedelta(days=1),
+                  start + timedelta(days=2), start + timedelta(days=3)]
+        for i, stamp in enumerate(stamps):
+            db.session.add(Message(text=f"msg{i}", timestamp=stamp,
+                                   user_id=u.id))
+        db.session.commit()
+
+    def tearDown(self):
+        app.config.pop("PER_PAGE")
+
+    def run(self, result=None):
+        """Capture the context of every template rendered during a test."""
+
+        def record(sender, template, context, **extra):
+            self.rendered = context
+
+        template_rendered.connect(record, app)
+        try:
+            return super().run(result)
+        finally:
+            template_rendered.disconnect(record, app)
+
+    def get_page(self):
+        """The KeysetPage the last request rendered."""
+
+        return self.rendered["page"]
+
+    def test_cursor_round_trip(self):
+        """Do cursors decode back to what they encoded?"""
+
+        key = (datetime(2018, 1, 2, 3, 4, 5, 6), 42)
+        token = encode_cursor(PREV, key)
+        cursor = decode_cursor(token, (Message.timestamp, Message.id))
+
+        self.assertEqual(cursor.direction, PREV)
+        self.assertEqual(cursor.values, key)
+        self.assertNotIn("=", token)
+
+    def test_bad_cursor_is_400(self):
+        """Does a malformed cursor get a 400 instead of a 500?"""
+
+        resp = self.client.get(f"/users/{self.user_id}?cursor=nonsense")
+        self.assertEqual(resp.status_code, 400)
+
+    def test_wrongly_typed_cursor_is_400(self):
+        """Is a cursor of valid JSON but the wrong shape a 400 too?"""
+
+        for raw in (
+            '["next", 5]',
+            '["next", {"a": 1, "b": 2}]',
+            '["next", [7, 42]]',
+            '["next", ["2018-01-02T03:04:05.000006", "42"]]',
+            '["next", ["2018-01-02T03:04:05.000006", [42]]]',
+            '{"next": 1, "prev": 2}',
+        ):
+            token = base64.urlsafe_b64encode(raw.encode()).decode()
+            resp = self.client.get(f"/users/{self.user_id}?cursor={token}")
+            self.assertEqual(resp.status_code, 400, raw)
+
+    def test_page_older_and_newer(self):
+        """Can you walk a profile's messages older and back newer?"""
+
+        url = f"/users/{self.user_id}"
+        ordered = [m.id for m in
+                   Message.query.order_by(Message.timestamp.desc(),
+                                          Message.id.desc())]
+        seen = []
+        cursor = None
+
+        with self.client as c:
+            while True:
+                c.get(url, query_string={"cursor": cursor} if cursor else {})
+                page = self.get_page()
+                seen += [m.id for m in page.items]
+                if not page.next_cursor:
+                    break
+                cursor = page.next_cursor
+
+            self.assertEqual(seen, ordered)
+
+            # and one step back towards newer messages
+            back = c.get(url, query_string={"cursor": page.prev_cursor})
+            self.assertEqual([m.id for m in self.get_page().items], ordered[2:4])
+            self.assertEqual(back.status_code, 200)
+
+    def test_users_list_paginates(self):
+        """Does /users page through every user by id?"""
+
+        for i in range(3):
+            db.session.add(User(email=f"u{i}@test.com", username=f"u{i}",
+                                password="HASHED_PASSWORD"))
+        db.session.commit()
+
+        self.client.get("/users")
+        first = self.get_page()
+        self.assertEqual(len(first.items), 2)
+        self.assertIsNone(first.prev_cursor)
+
+        self.client.get("/users", query_string={"cursor": first.next_cursor})
+        second = self.get_page()
+        self.assertEqual(len(second.items), 2)
+        self.assertGreater(second.items[0].id, first.items[-1].id)
+        self.assertIsNotNone(second.prev_cursor)
@@ -0,0 +1,96 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, FollowersFollowee, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app
+import passwords
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class PasswordsTestCase(TestCase):
+    """Tests for pooled, cost-aware password hashing"""
+
+    def setUp(self):
+        """Clear out users and use a cheap cost factor."""
+
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.saved_rounds = passwords.log_rounds
+        passwords.log_rounds = 4
+
+    def tearDown(self):
+        passwords.log_rounds = self.saved_rounds
+
+    def test_hash_and_check(self):
+        """Do pooled hash and check round-trip at the configured cost?"""
+
+        pw_hash = passwords.hash_password("abc123")
+
+        self.assertEqual(passwords.hash_cost(pw_hash), 4)
+        self.assertTrue(passwords.check_password(pw_hash, "abc123"))
+        self.assertFalse(passwords.check_password(pw_hash, "wrong"))
+        self.assertEqual(passwords.stats()["queued"], 0)
+
+    def test_rehash_on_login(self):
+        """Is an outdated hash upgraded when its owner logs in?"""
+
+        User.signup(username="silas", email="silas@test.com",
+                    password="abc123", image_url=None)
+        db.session.commit()
+
+        passwords.log_rounds = 5
+        user = User.authenticate("silas", "abc123")
+
+        self.assertEqual(passwords.hash_cost(user.password), 5)
+        self.assertEqual(User.authenticate("silas", "abc123"), user)
+
+        # a wrong password doesn't touch the hash
+        old_hash = user.password
+        passwords.log_rounds = 6
+        self.assertFalse(User.authenticate("silas", "nope"))
+        self.assertEqual(User.query.get(user.id).password, old_hash)
+
+        # nor does logging in at a lower cost than it was made with
+        passwords.log_rounds = 4
+        self.assertEqual(User.authenticate("silas", "abc123"), user)
+        self.assertEqual(User.query.get(user.id).password, old_hash)
+
+    def test_empty_password_skips_bcrypt(self):
+        """Does an empty password fail without running bcrypt?"""
+
+        User.signup(username="silas", email="silas@test.com",
+                    password="abc123", image_url=None)
+        db.session.commit()
+
+        completed = passwords.stats()["completed"]
+
+        self.assertFalse(User.authenticate("silas", ""))
+        self.assertFalse(User.authenticate("silas", None))
+        self.assertEqual(passwords.stats()["completed"], completed)
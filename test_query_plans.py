@@ -0,0 +1,152 @@
+"""Query plan tests: hot routes must be served by indexes."""
+
+# run these tests like:
+#
+#    python -m unittest test_query_plans.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, FollowersFollowee, Like, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import indexes
+from queryplan import capture_plans, check_plans
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class QueryPlanTestCase(TestCase):
+    """EXPLAIN the queries behind each hot route"""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup(
+            username="testuser",
+            email="test@test.com",
+            password="testuser",
+            image_url=None,
+        )
+        other = User(email="other@test.com", username="other", password="x")
+        db.session.add(other)
+        db.session.commit()
+
+        self.testuser_id = self.testuser.id
+        self.other_id = other.id
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.post(f"/users/follow/{self.other_id}")
+
+            self.login(c, self.other_id)
+            c.post(f"/users/follow/{self.testuser_id}")
+            c.post("/messages/new", data={"text": "Hello"})
+
+        self.msg_id = Message.query.one().id
+
+    def login(self, client, user_id):
+        """Put `user_id` in the test client's session."""
+
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def assertIndexBacked(self, method, url, data=None, allow_scans=()):
+        """Request `url` and assert every SELECT it ran uses an index."""
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            with capture_plans() as captured:
+                resp = c.open(url, method=method, data=data)
+
+        self.assertLess(resp.status_code, 400, url)
+        self.assertTrue(captured, url)
+
+        problems = check_plans(captured, allow_scans=allow_scans)
+        self.assertEqual(problems, [], "\n\n".join(str(p) for p in problems))
+
+    def test_read_routes(self):
+        """Do the timeline, profile and list pages avoid scans and sorts?"""
+
+        for url in (
+            "/",
+            f"/users/{self.other_id}",
+            f"/users/{self.testuser_id}/following",
+            f"/users/{self.testuser_id}/followers",
+            f"/users/{self.testuser_id}/likes",
+            f"/messages/{self.msg_id}",
+        ):
+            self.assertIndexBacked("GET", url)
+
+    def test_user_list(self):
+        """Is the user list an in-order read of the primary key?"""
+
+        # paging through all users reads `users` in id order, which is fine
+        self.assertIndexBacked("GET", "/users", allow_scans=("users",))
+
+    def test_write_routes(self):
+        """Do login, liking, unliking and deleting find rows by index?"""
+
+        with self.client as c:
+            with capture_plans() as captured:
+                c.post(
+                    "/login", data={"username": "testuser", "password": "testuser"}
+                )
+
+        self.assertEqual(check_plans(captured), [])
+
+        data = {"return_to": "/"}
+        self.assertIndexBacked("POST", f"/like/{self.msg_id}", data=data)
+        self.assertIndexBacked("POST", f"/unlike/{self.msg_id}", data=data)
+        self.assertIndexBacked("POST", f"/like/{self.msg_id}", data=data)
+
+        msg = Message(text="Mine", user_id=self.testuser_id)
+        db.session.add(msg)
+        db.session.commit()
+        self.assertIndexBacked("POST", f"/messages/{msg.id}/delete")
+
+
+class ApplyIndexesTestCase(TestCase):
+    """Tests for bringing an existing database's indexes up to date"""
+
+    def test_apply_missing_index(self):
+        """Is a dropped index reported and recreated, and only once?"""
+
+        self.assertEqual(indexes.apply_indexes(dry_run=True), [])
+
+        db.session.execute("DROP INDEX ix_likes_message_user")
+        db.session.commit()
+
+        self.assertEqual(
+            indexes.apply_indexes(dry_run=True), ["ix_likes_message_user"]
+        )
+        self.assertEqual(indexes.apply_indexes(), ["ix_likes_message_user"])
+        self.assertEqual(indexes.apply_indexes(), [])
@@ -0,0 +1,193 @@
+"""Per-request SQL instrumentation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_querystats.py
+
+
+import json
+import os
+from unittest import TestCase
+
+from flask import g
+
+from models import db, User, Message, FollowersFollowee, Like, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import querystats
+from querystats import QueryStats, QueryBudgetExceeded, normalize
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class QueryStatsTestCase(TestCase):
+    """Tests for recording and summarizing a request's statements"""
+
+    def test_normalize(self):
+        """Are whitespace and IN-lists collapsed into one shape?"""
+
+        self.assertEqual(
+            normalize("SELECT *\n  FROM users WHERE id IN (?, ?, ?)"),
+            "SELECT * FROM users WHERE id IN (...)",
+        )
+
+    def test_slowest_and_repeated(self):
+        """Are the slowest statements and repeated shapes picked out?"""
+
+        stats = QueryStats()
+        stats.record("SELECT 1", 0.5)
+        for i in range(12):
+            stats.record("SELECT * FROM users WHERE id = ?", 0.001 * i)
+
+        self.assertEqual(len(stats), 13)
+        self.assertEqual(stats.slowest(1), [(0.5, "SELECT 1")])
+        self.assertEqual(
+            stats.repeated(10), [(12, "SELECT * FROM users WHERE id = ?")]
+        )
+
+    def test_exempt(self):
+        """Are statements run inside exempt() recorded but not charged?"""
+
+        with app.test_request_context():
+            stats = QueryStats()
+            g.query_stats = stats
+
+            User.query.count()
+            with querystats.exempt():
+                User.query.count()
+                User.query.count()
+
+            self.assertEqual((len(stats), stats.charged), (3, 1))
+
+
+class RequestInstrumentationTestCase(TestCase):
+    """Tests for the per-request headers, logs and query budgets"""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.client = app.test_client()
+
+        # one user following (and followed by) a dozen others, with a page
+        # of liked messages: enough rows for an N+1 to blow a budget
+        users = [
+            User(email=f"u{i}@test.com", username=f"user{i}", password="x")
+            for i in range(13)
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+
+        self.user_id, *other_ids = [u.id for u in users]
+
+        with self.client as c:
+            for other_id in other_ids:
+                self.login(c, self.user_id)
+                c.post(f"/users/follow/{other_id}")
+                self.login(c, other_id)
+                c.post(f"/users/follow/{self.user_id}")
+                c.post("/messages/new", data={"text": f"From {other_id}"})
+
+            self.login(c, self.user_id)
+            for (msg_id,) in db.session.query(Message.id):
+                c.post(f"/like/{msg_id}", data={"return_to": "/"})
+
+        self.msg_id = Message.query.first().id
+
+        self.config = {
+            key: app.config[key]
+            for key in ("QUERY_STATS_SAMPLE_RATE", "QUERY_BUDGET_ENFORCE")
+        }
+        app.config["QUERY_STATS_SAMPLE_RATE"] = 1
+        app.config["QUERY_BUDGET_ENFORCE"] = True
+
+    def tearDown(self):
+        app.config.update(self.config)
+
+    def login(self, client, user_id):
+        """Put `user_id` in the test client's session."""
+
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_headers_and_log(self):
+        """Do measured requests report their queries?"""
+
+        with self.client as c:
+            self.login(c, self.user_id)
+
+            with self.assertLogs("warbler.sql", "INFO") as logs:
+                resp = c.get(f"/users/{self.user_id}")
+
+            self.assertGreater(int(resp.headers["X-Query-Count"]), 0)
+            self.assertIn("X-Query-Time", resp.headers)
+
+            record = json.loads(logs.records[-1].getMessage())
+            self.assertEqual(record["endpoint"], "warbler.users_show")
+            self.assertEqual(record["queries"], int(resp.headers["X-Query-Count"]))
+            self.assertEqual(record["repeated"], [])
+
+            app.config["QUERY_STATS_SAMPLE_RATE"] = 0
+            app.config["QUERY_BUDGET_ENFORCE"] = False
+            resp = c.get(f"/users/{self.user_id}")
+            self.assertNotIn("X-Query-Count", resp.headers)
+
+    def test_pages_within_budget(self):
+        """Do the list pages stay within their query budgets?"""
+
+        with self.client as c:
+            self.login(c, self.user_id)
+
+            for url in (
+                "/",
+                "/users",
+                "/users?q=user",
+                f"/users/{self.user_id}",
+                f"/users/{self.user_id}/following",
+                f"/users/{self.user_id}/followers",
+                f"/users/{self.user_id}/likes",
+                f"/messages/{self.msg_id}",
+            ):
+                resp = c.get(url)
+                self.assertEqual(resp.status_code, 200, url)
+
+    def test_over_budget(self):
+        """Does going over a view's budget fail the request?"""
+
+        view = app.view_functions["warbler.users_followers"]
+        budget = view.query_budget
+        view.query_budget = 1
+        app.config["PROPAGATE_EXCEPTIONS"] = True
+
+        try:
+            with self.client as c:
+                self.login(c, self.user_id)
+                with self.assertRaises(QueryBudgetExceeded):
+                    c.get(f"/users/{self.user_id}/followers")
+        finally:
+            view.query_budget = budget
+            app.config["PROPAGATE_EXCEPTIONS"] = None
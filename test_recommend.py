@@ -0,0 +1,207 @@
+"""Who-to-follow suggestion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_recommend.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import (
+    db,
+    User,
+    Message,
+    FollowersFollowee,
+    Like,
+    Suggestion,
+    TimelineEntry,
+)
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import followgraph
+import recommend
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class RecommendTestCase(TestCase):
+    """Tests for building and reading suggestions"""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        Suggestion.query.delete()
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        followgraph.reset_graph()
+        recommend.reset_popular()
+        self.client = app.test_client()
+
+        names = ("alice", "bob", "carol", "dave", "erin", "newbie")
+        users = [
+            User(email=f"{name}@test.com", username=name, password="x")
+            for name in names
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        self.ids = {user.username: user.id for user in users}
+
+        # alice follows bob and carol; they both follow dave, and bob
+        # follows erin, who follows alice
+        for follower, followed in [
+            ("alice", "bob"),
+            ("alice", "carol"),
+            ("bob", "dave"),
+            ("carol", "dave"),
+            ("bob", "erin"),
+            ("erin", "alice"),
+        ]:
+            self.follow(follower, followed)
+
+    def tearDown(self):
+        followgraph.reset_graph()
+        recommend.reset_popular()
+
+    def follow(self, follower, followed):
+        follower = User.query.get(self.ids[follower])
+        followed = User.query.get(self.ids[followed])
+        follower.following.append(followed)
+        follower.following_count += 1
+        followed.followers_count += 1
+        db.session.commit()
+
+    def login(self, client, user_id):
+        """Put `user_id` in the test client's session."""
+
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def stored(self, name):
+        """[(suggested username, score)] stored for `name`, by rank."""
+
+        rows = (
+            db.session.query(User.username, Suggestion.score)
+            .join(Suggestion, Suggestion.suggested_id == User.id)
+            .filter(Suggestion.user_id == self.ids[name])
+            .order_by(Suggestion.rank)
+        )
+        return [tuple(row) for row in rows]
+
+    def test_build(self):
+        """Are friends of friends scored, ranked and stored?"""
+
+        self.assertEqual(recommend.build(), 5)
+
+        # dave via bob and carol, then erin via bob; not bob/carol (followed)
+        # and not alice herself (via erin's follow)
+        self.assertEqual(self.stored("alice"), [("dave", 2), ("erin", 1)])
+        self.assertEqual(self.stored("bob"), [("alice", 1)])
+        self.assertEqual(self.stored("erin"), [("bob", 1), ("carol", 1)])
+        self.assertEqual(self.stored("newbie"), [])
+
+        # rebuilding replaces, rather than adds to, the old suggestions
+        self.follow("alice", "dave")
+        self.assertEqual(recommend.build(k=1), 3)
+        self.assertEqual(self.stored("alice"), [("erin", 1)])
+
+    def test_processes(self):
+        """Do worker processes store the same suggestions?"""
+
+        recommend.build(block_size=2)
+        expected = self.stored("alice"), self.stored("erin")
+
+        Suggestion.query.delete()
+        db.session.commit()
+
+        recommend.build(processes=2, block_size=2)
+        self.assertEqual((self.stored("alice"), self.stored("erin")), expected)
+
+    def test_suggestions_for(self):
+        """Are followed users dropped, and short lists filled with popular ones?"""
+
+        with app.test_request_context():
+            recommend.build()
+            alice = User.query.get(self.ids["alice"])
+            newbie = User.query.get(self.ids["newbie"])
+
+            suggested = recommend.suggestions_for(alice, limit=1)
+            self.assertEqual([(s.username, s.score) for s in suggested], [("dave", 2)])
+
+            # followed since the job ran
+            self.follow("alice", "dave")
+            followgraph.followed(alice, User.query.get(self.ids["dave"]))
+            suggested = recommend.suggestions_for(alice, limit=2)
+            self.assertEqual(
+                [(s.username, s.score) for s in suggested],
+                [("erin", 1), ("newbie", None)],
+            )
+
+            # nothing precomputed: the most followed
+            suggested = recommend.suggestions_for(newbie, limit=3)
+            self.assertEqual([s.username for s in suggested], ["dave", "alice", "bob"])
+
+    def test_renamed_and_deleted(self):
+        """Do cached suggestions show new names and skip deleted accounts?"""
+
+        with app.test_request_context():
+            recommend.build()
+            newbie = User.query.get(self.ids["newbie"])
+            recommend.suggestions_for(newbie, limit=3)
+
+            User.query.get(self.ids["dave"]).username = "david"
+            User.query.get(self.ids["alice"]).deleted_at = datetime.utcnow()
+            User.query.get(self.ids["erin"]).deleted_at = datetime.utcnow()
+            db.session.commit()
+
+            suggested = recommend.suggestions_for(newbie, limit=3)
+            self.assertEqual([s.username for s in suggested], ["david", "bob", "carol"])
+
+            # erin was suggested to alice, precomputed
+            alice = User.query.get(self.ids["alice"])
+            self.assertNotIn(
+                "erin", [s.username for s in recommend.suggestions_for(alice)]
+            )
+
+    def test_pages(self):
+        """Do the homepage and your own profile show suggestions?"""
+
+        with app.app_context():
+            recommend.build()
+
+        with self.client as c:
+            self.login(c, self.ids["alice"])
+
+            resp = c.get("/")
+            self.assertIn(b"Who to follow", resp.data)
+            self.assertIn(b"Followed by 2 people you follow", resp.data)
+
+            resp = c.get(f"/users/{self.ids['alice']}")
+            self.assertIn(b"Followed by 2 people you follow", resp.data)
+
+            resp = c.get(f"/users/{self.ids['bob']}")
+            self.assertNotIn(b"Who to follow", resp.data)
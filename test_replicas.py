@@ -0,0 +1,171 @@
+"""Connection pool and read replica tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_replicas.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy.engine.url import make_url
+
+from models import db, User, Message, FollowersFollowee, Like, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+# A second database stands in for a replica
+REPLICA_URL = "postgresql:///warbler_test_replica"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import followgraph
+import fragcache
+import replicas
+import usercache
+from replicas import STICKY_KEY, engine_options
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class EngineOptionsTestCase(TestCase):
+    """Tests for pool and timeout settings"""
+
+    def test_postgres(self):
+        """Are pool sizes, pre-ping and the statement timeout applied?"""
+
+        config = dict(DB_POOL_SIZE=3, DB_MAX_OVERFLOW=0, DB_STATEMENT_TIMEOUT=500)
+        options = {}
+        engine_options(config, make_url("postgresql:///warbler"), options)
+
+        self.assertEqual(options["pool_size"], 3)
+        self.assertEqual(options["max_overflow"], 0)
+        self.assertEqual(options["pool_recycle"], replicas.DEFAULT_POOL_RECYCLE)
+        self.assertTrue(options["pool_pre_ping"])
+        self.assertEqual(
+            options["connect_args"], {"options": "-c statement_timeout=500"}
+        )
+
+    def test_sqlite(self):
+        """Does SQLite keep its own pool?"""
+
+        options = {}
+        engine_options({"DB_POOL_PRE_PING": False}, make_url("sqlite://"), options)
+        self.assertEqual(options, {"pool_pre_ping": False})
+
+
+class ReplicaViewsTestCase(TestCase):
+    """Tests for routing reads to a replica"""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        self.binds = app.config["SQLALCHEMY_BINDS"]
+        app.config["SQLALCHEMY_BINDS"] = {"replica0": REPLICA_URL}
+        self.replica = db.get_engine(app, bind="replica0")
+        db.metadata.create_all(self.replica)
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        followgraph.reset_graph()
+        fragcache.cache.clear()
+        usercache.cache.clear()
+        self.client = app.test_client()
+
+        alice = User(email="alice@test.com", username="alice", password="x")
+        bob = User(email="bob@test.com", username="bob", password="x")
+        db.session.add_all([alice, bob])
+        db.session.commit()
+        self.alice_id, self.bob_id = alice.id, bob.id
+
+        self.replicate()
+
+        # a change the replica hasn't caught up with
+        alice.username = "alice-renamed"
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        followgraph.reset_graph()
+        app.config["SQLALCHEMY_BINDS"] = self.binds
+
+    def replicate(self):
+        """Copy the primary's users to the replica."""
+
+        users = User.__table__
+        rows = [dict(row) for row in db.session.execute(users.select())]
+
+        with self.replica.begin() as conn:
+            for table in reversed(db.metadata.sorted_tables):
+                conn.execute(table.delete())
+            conn.execute(users.insert(), rows)
+
+    def login(self, client, user_id):
+        """Put `user_id` in the test client's session."""
+
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_reads_from_replica(self):
+        """Do read-only pages use the replica, and other pages the primary?"""
+
+        with self.client as c:
+            resp = c.get(f"/users/{self.alice_id}")
+            self.assertIn(b"@alice<", resp.data)
+
+            resp = c.get("/users?q=alice")
+            self.assertNotIn(b"alice-renamed", resp.data)
+
+            # the edit form isn't read-only
+            self.login(c, self.alice_id)
+            resp = c.get("/users/profile")
+            self.assertIn(b"alice-renamed", resp.data)
+
+    def test_sticky_after_write(self):
+        """Are a session's reads from the primary just after it writes?"""
+
+        with self.client as c:
+            self.login(c, self.bob_id)
+            c.post(f"/users/follow/{self.alice_id}")
+
+            resp = c.get(f"/users/{self.alice_id}")
+            self.assertIn(b"alice-renamed", resp.data)
+
+            resp = c.get(f"/users/{self.bob_id}/following")
+            self.assertIn(b"alice-renamed", resp.data)
+
+            # once the window's over, back to the replica
+            with c.session_transaction() as sess:
+                sess[STICKY_KEY] = 0
+
+            resp = c.get(f"/users/{self.alice_id}")
+            self.assertNotIn(b"alice-renamed", resp.data)
+
+    def test_no_replicas(self):
+        """Without replicas, is everything read from the primary?"""
+
+        app.config["SQLALCHEMY_BINDS"] = {}
+
+        with self.client as c:
+            resp = c.get(f"/users/{self.alice_id}")
+            self.assertIn(b"alice-renamed", resp.data)
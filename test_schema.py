@@ -0,0 +1,108 @@
+"""Schema upgrade tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_schema.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import inspect
+
+from models import (
+    db,
+    User,
+    Message,
+    FollowersFollowee,
+    Like,
+    TimelineEntry,
+    TrendingScore,
+)
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app
+import schema
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class SchemaTestCase(TestCase):
+    """Tests for upgrading an existing database in place"""
+
+    def setUp(self):
+        """Two users who follow and like each other."""
+
+        TrendingScore.query.delete()
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        u1 = User(email="one@test.com", username="one", password="x")
+        u2 = User(email="two@test.com", username="two", password="x")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.u1_id, self.u2_id = u1.id, u2.id
+
+        msg = Message(text="Hello", user_id=u2.id)
+        db.session.add(msg)
+        db.session.add(FollowersFollowee(followee_id=u1.id, follower_id=u2.id))
+        db.session.commit()
+        db.session.add(Like(user_id=u1.id, message_id=msg.id))
+        db.session.commit()
+        self.msg_id = msg.id
+
+    def tearDown(self):
+        db.session.remove()
+        # whatever a failed test left out
+        schema.migrate()
+
+    def columns(self, table):
+        return {column["name"] for column in inspect(db.engine).get_columns(table)}
+
+    def test_migrate(self):
+        """Does migrate add what an old database lacks, and fill it in?"""
+
+        db.session.remove()
+        with db.engine.begin() as conn:
+            conn.execute("DROP TABLE trending")
+            conn.execute("ALTER TABLE users DROP COLUMN following_count")
+            conn.execute("ALTER TABLE users DROP COLUMN deleted_at")
+            conn.execute("ALTER TABLE messages DROP COLUMN likes_count")
+
+        result = app.test_cli_runner().invoke(args=["migrate"])
+        self.assertIn("3 missing columns", result.output)
+        self.assertIn("following_count", self.columns("users"))
+        self.assertIn("deleted_at", self.columns("users"))
+        self.assertIn("trending", inspect(db.engine).get_table_names())
+
+        # the counters are filled in, not left at their defaults
+        self.assertEqual(User.query.get(self.u1_id).following_count, 1)
+        self.assertEqual(User.query.get(self.u1_id).likes_count, 1)
+        self.assertEqual(Message.query.get(self.msg_id).likes_count, 1)
+        self.assertIsNone(User.query.get(self.u1_id).deleted_at)
+
+        # and there's nothing left to do
+        result = app.test_cli_runner().invoke(args=["migrate", "--dry-run"])
+        self.assertIn("0 missing columns", result.output)
+        self.assertNotIn("ALTER TABLE", result.output)
@@ -0,0 +1,135 @@
+"""Username search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, FollowersFollowee, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app
+import search
+from search import NgramIndex
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class NgramIndexTestCase(TestCase):
+    """Tests for the in-process n-gram index"""
+
+    def setUp(self):
+        self.index = NgramIndex()
+        for user_id, username in enumerate(
+                ["juanton", "JuanCarlos", "tonjuan", "marjuana", "bob"], 1):
+            self.index.add(user_id, username)
+
+    def test_search_ranks_exact_prefix_substring(self):
+        """Are exact, then prefix, then substring matches returned in order?"""
+
+        self.index.add(6, "juan")
+
+        self.assertEqual(self.index.search("juan"), [6, 1, 2, 3, 4])
+
+    def test_search_is_case_insensitive_and_limited(self):
+        """Does search ignore case and respect its limit?"""
+
+        self.assertEqual(self.index.search("JUAN", limit=2), [1, 2])
+
+    def test_short_query_matches_substrings(self):
+        """Do queries too short for a trigram still match anywhere in a name?"""
+
+        self.assertEqual(self.index.search("ju"), [1, 2, 3, 4])
+        self.assertEqual(self.index.search("o"), [5, 1, 3, 2])
+
+    def test_fuzzy_match(self):
+        """Does a near-miss still find the user?"""
+
+        self.assertIn(1, self.index.search("juantom"))
+        self.assertEqual(self.index.search("zzzzz"), [])
+
+    def test_prefix(self):
+        """Does prefix lookup return usernames starting with the query?"""
+
+        self.assertEqual(self.index.prefix("ju"), [2, 1])
+        self.assertEqual(self.index.prefix("b"), [5])
+
+    def test_rename_and_remove(self):
+        """Are renamed and removed users re-indexed?"""
+
+        self.index.add(5, "bobjuan")
+        self.assertIn(5, self.index.search("juan"))
+        self.assertEqual(self.index.prefix("bob"), [5])
+
+        self.index.remove(5)
+        self.assertNotIn(5, self.index.search("juan"))
+        self.assertEqual(len(self.index), 4)
+
+
+class SearchViewsTestCase(TestCase):
+    """Tests for /users?q= and /users/autocomplete"""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+
+        for username in ["juanton", "juancarlos", "silas", "100%real"]:
+            db.session.add(User(email=f"{username}@test.com", username=username,
+                                password="HASHED_PASSWORD"))
+        db.session.commit()
+
+        search.reset_index()
+        self.client = app.test_client()
+
+    def test_search_page(self):
+        """Does /users?q= list matching users only?"""
+
+        resp = self.client.get("/users?q=juan")
+
+        self.assertIn(b"@juanton", resp.data)
+        self.assertIn(b"@juancarlos", resp.data)
+        self.assertNotIn(b"@silas", resp.data)
+
+    def test_short_search(self):
+        """Does a one- or two-letter query match in the middle of a name?"""
+
+        resp = self.client.get("/users?q=il")
+
+        self.assertIn(b"@silas", resp.data)
+        self.assertNotIn(b"@juanton", resp.data)
+
+    def test_search_wildcards_are_literal(self):
+        """Is a % in the query matched literally rather than as a wildcard?"""
+
+        resp = self.client.get("/users?q=0%25r")
+
+        self.assertIn(b"@100%real", resp.data)
+        self.assertNotIn(b"@silas", resp.data)
+
+    def test_autocomplete(self):
+        """Does /users/autocomplete return prefix matches as JSON?"""
+
+        resp = self.client.get("/users/autocomplete?q=JUAN")
+        usernames = [u["username"] for u in resp.get_json()["users"]]
+
+        self.assertEqual(usernames, ["juancarlos", "juanton"])
@@ -0,0 +1,139 @@
+"""Template bytecode cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_templatecache.py
+
+
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message, FollowersFollowee, Like, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, create_app
+import templatecache
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class TemplateCacheTestCase(TestCase):
+    """Tests for precompiling and preloading templates"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+        # each new app takes over `db`; hand it back
+        db.app = app
+
+    def cached_files(self):
+        return [
+            name for name in os.listdir(self.directory.name) if name.endswith(".cache")
+        ]
+
+    def test_compile_command(self):
+        """Does the build step compile every template into the cache?"""
+
+        build_app = create_app("test", TEMPLATE_CACHE_DIR=self.directory.name)
+        result = build_app.test_cli_runner().invoke(args=["compile-templates"])
+
+        count = len(templatecache.template_names(build_app))
+        self.assertIn(f"Compiled {count} templates", result.output)
+        self.assertIn("base.html", templatecache.template_names(build_app))
+        self.assertEqual(len(self.cached_files()), count)
+
+    def test_workers_load_from_cache(self):
+        """Do later apps render from the cache without compiling?"""
+
+        create_app(
+            "test", TEMPLATE_CACHE_DIR=self.directory.name, TEMPLATE_PRELOAD=True
+        )
+        self.assertTrue(self.cached_files())
+
+        worker_app = create_app("test", TEMPLATE_CACHE_DIR=self.directory.name)
+
+        def compile(*args, **kwargs):
+            raise AssertionError("compiled a cached template")
+
+        worker_app.jinja_env.compile = compile
+        resp = worker_app.test_client().get("/login")
+        self.assertEqual(resp.status_code, 200)
+
+    def test_preload(self):
+        """Does the production profile load every template up front?"""
+
+        prod_app = create_app("production", TEMPLATE_CACHE_DIR="")
+        self.assertFalse(prod_app.jinja_env.auto_reload)
+        self.assertEqual(
+            len(prod_app.jinja_env.cache), len(templatecache.template_names(prod_app))
+        )
+
+    def test_forget_with_warm_cache(self):
+        """Do workers whose templates come from the cache forget fragments?"""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        user = User(email="cached@test.com", username="cached", password="x")
+        db.session.add(user)
+        db.session.commit()
+        msg = Message(text="cached", user_id=user.id)
+        db.session.add(msg)
+        db.session.commit()
+        user_id, msg_id = user.id, msg.id
+
+        create_app(
+            "test", TEMPLATE_CACHE_DIR=self.directory.name, TEMPLATE_PRELOAD=True
+        )
+
+        # a fresh process, which has never parsed a template
+        code = f"""
+import sys
+from app import create_app, CURR_USER_KEY
+import fragcache
+from models import Message
+
+app = create_app("test", TEMPLATE_CACHE_DIR=sys.argv[1])
+client = app.test_client()
+with client.session_transaction() as sess:
+    sess[CURR_USER_KEY] = {user_id}
+client.get("/users/{user_id}")
+
+with app.test_request_context():
+    key = fragcache.fragment_key("profile-message", Message.query.get({msg_id}))
+cached = bool(fragcache.cache.backend.get_many([key]))
+client.post("/messages/{msg_id}/delete")
+print(cached, bool(fragcache.cache.backend.get_many([key])))
+"""
+        out = subprocess.run(
+            [sys.executable, "-c", code, self.directory.name],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+
+        self.assertEqual(out.strip(), "True False")
@@ -0,0 +1,162 @@
+"""Materialized timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, FollowersFollowee, Like, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import timeline
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class TimelineTestCase(TestCase):
+    """Tests for fan-out-on-write home timelines"""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        app.config["TIMELINE_FANOUT_LIMIT"] = timeline.DEFAULT_FANOUT_LIMIT
+
+        self.client = app.test_client()
+
+        self.author = User(email="author@test.com", username="author",
+                           password="HASHED_PASSWORD")
+        self.reader = User(email="reader@test.com", username="reader",
+                           password="HASHED_PASSWORD")
+        db.session.add_all([self.author, self.reader])
+        db.session.commit()
+
+        self.author_id = self.author.id
+        self.reader_id = self.reader.id
+
+    def login(self, client, user_id):
+        """Put `user_id` in the test client's session."""
+
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def timeline_ids(self, user_id):
+        """Message ids materialized in a user's timeline."""
+
+        return {e.message_id for e in
+                TimelineEntry.query.filter_by(owner_id=user_id)}
+
+    def test_post_fans_out_to_followers(self):
+        """Does a new message land in the author's and followers' timelines?"""
+
+        with self.client as c:
+            self.login(c, self.reader_id)
+            c.post(f"/users/follow/{self.author_id}")
+
+            self.login(c, self.author_id)
+            c.post("/messages/new", data={"text": "Hello"})
+
+        msg = Message.query.one()
+
+        self.assertEqual(self.timeline_ids(self.author_id), {msg.id})
+        self.assertEqual(self.timeline_ids(self.reader_id), {msg.id})
+
+        with self.client as c:
+            self.login(c, self.reader_id)
+            resp = c.get("/")
+            self.assertIn(b"Hello", resp.data)
+
+    def test_follow_backfills_and_unfollow_purges(self):
+        """Do follow/unfollow add and remove the followee's messages?"""
+
+        with self.client as c:
+            self.login(c, self.author_id)
+            c.post("/messages/new", data={"text": "Before you followed"})
+
+            self.login(c, self.reader_id)
+            c.post(f"/users/follow/{self.author_id}")
+            self.assertEqual(len(self.timeline_ids(self.reader_id)), 1)
+
+            c.post(f"/users/stop-following/{self.author_id}")
+            self.assertEqual(self.timeline_ids(self.reader_id), set())
+
+    def test_delete_message_removes_entries(self):
+        """Does deleting a message remove it from every timeline?"""
+
+        with self.client as c:
+            self.login(c, self.reader_id)
+            c.post(f"/users/follow/{self.author_id}")
+
+            self.login(c, self.author_id)
+            c.post("/messages/new", data={"text": "Oops"})
+            msg = Message.query.one()
+
+            c.post(f"/messages/{msg.id}/delete")
+
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_high_fanout_author_merged_at_read(self):
+        """Are high-fanout authors skipped on write but still shown on read?"""
+
+        app.config["TIMELINE_FANOUT_LIMIT"] = 0
+
+        with self.client as c:
+            self.login(c, self.reader_id)
+            c.post(f"/users/follow/{self.author_id}")
+
+            self.login(c, self.author_id)
+            c.post("/messages/new", data={"text": "Famous words"})
+
+        self.assertTrue(User.query.get(self.author_id).is_high_fanout)
+        self.assertEqual(self.timeline_ids(self.reader_id), set())
+
+        reader = User.query.get(self.reader_id)
+        self.assertEqual([m.text for m in timeline.home_timeline(reader)],
+                         ["Famous words"])
+
+    def test_rebuild_all(self):
+        """Does rebuild_all reconstruct timelines from follows and messages?"""
+
+        with self.client as c:
+            self.login(c, self.reader_id)
+            c.post(f"/users/follow/{self.author_id}")
+
+            self.login(c, self.author_id)
+            c.post("/messages/new", data={"text": "Hello"})
+
+        TimelineEntry.query.delete()
+        db.session.commit()
+
+        with app.app_context():
+            timeline.rebuild_all()
+
+        msg = Message.query.one()
+        self.assertEqual(self.timeline_ids(self.reader_id), {msg.id})
+        self.assertEqual(self.timeline_ids(self.author_id), {msg.id})
@@ -0,0 +1,290 @@
+"""Trending messages tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+
+import os
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+
+from models import (
+    db,
+    User,
+    Message,
+    FollowersFollowee,
+    Like,
+    TimelineEntry,
+    TrendingScore,
+)
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import likes
+import trending
+from pagination import Cursor, NEXT, PREV
+from trending import TrendingBoard, NO_SCORE, keyset_page, log2_add, log2_sub
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class TrendingBoardTestCase(TestCase):
+    """Tests for forward-decayed scores and the in-memory board"""
+
+    def test_log2_arithmetic(self):
+        """Do log-domain sums and differences match plain ones?"""
+
+        self.assertAlmostEqual(log2_add(3, 3), 4)
+        self.assertAlmostEqual(log2_add(NO_SCORE, 5), 5)
+        self.assertAlmostEqual(log2_sub(4, 3), 3)
+        self.assertEqual(log2_sub(3, 3), NO_SCORE)
+
+        # no overflow with weights far past a float's range
+        self.assertAlmostEqual(log2_add(5000, 5000), 5001)
+
+    def test_decay(self):
+        """Does a like one half-life later count twice as much?"""
+
+        board = TrendingBoard()
+        board.add(1, 100)
+        board.add(1, 100)
+        board.add(2, 101)
+        board.add(3, 100.5)
+
+        self.assertAlmostEqual(board.scores[1], board.scores[2])
+        self.assertEqual([id for _, id in board.ranked()][0], 3)
+
+        board.remove(2, 101)
+        self.assertNotIn(2, board.scores)
+
+    def test_space_saving(self):
+        """Does a newcomer to a full board replace the lowest score?"""
+
+        board = TrendingBoard(capacity=2)
+        board.add(1, 10)
+        board.add(1, 10)
+        board.add(2, 10)
+        board.add(3, 10)
+
+        self.assertEqual(set(board.scores), {1, 3})
+        # counted from the evicted message's score: an overestimate
+        self.assertAlmostEqual(board.scores[3], 11)
+
+    def test_replace_keeps_new_changes(self):
+        """Are changes made during a snapshot kept when reloading?"""
+
+        board = TrendingBoard()
+        board.add(1, 10)
+        pending = board.take_pending()
+        self.assertEqual(set(pending), {1})
+
+        board.add(2, 10)
+        board.replace({1: 12})
+        self.assertEqual(board.scores, {1: 12, 2: 10})
+        self.assertEqual(set(board.take_pending()), {2})
+
+    def test_keyset_page(self):
+        """Does paging walk the board best first, both ways?"""
+
+        ranked = [(float(score), id) for id, score in enumerate(range(5))]
+
+        first = keyset_page(ranked, Cursor(), per_page=2)
+        self.assertEqual([id for _, id in first], [4, 3])
+        self.assertIsNone(first.prev_cursor)
+
+        values = first.items[-1]
+        second = keyset_page(ranked, Cursor(NEXT, values), per_page=2)
+        self.assertEqual([id for _, id in second], [2, 1])
+
+        third = keyset_page(ranked, Cursor(NEXT, second.items[-1]), per_page=2)
+        self.assertEqual([id for _, id in third], [0])
+        self.assertIsNone(third.next_cursor)
+
+        back = keyset_page(ranked, Cursor(PREV, second.items[0]), per_page=2)
+        self.assertEqual([id for _, id in back], [4, 3])
+
+
+class TrendingViewsTestCase(TestCase):
+    """Tests for the write path, snapshots and /trending"""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        TrendingScore.query.delete()
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        trending.reset_board()
+        likes.buffer.take()
+        self.client = app.test_client()
+
+        users = [
+            User(email=f"fan{n}@test.com", username=f"fan{n}", password="x")
+            for n in range(3)
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        self.user_ids = [user.id for user in users]
+
+        messages = [
+            Message(text=text, user_id=self.user_ids[0])
+            for text in ("Old news", "Hot take", "Quiet one")
+        ]
+        db.session.add_all(messages)
+        db.session.commit()
+        self.old_id, self.hot_id, self.quiet_id = [msg.id for msg in messages]
+
+    def tearDown(self):
+        trending.reset_board()
+
+    def login(self, client, user_id):
+        """Put `user_id` in the test client's session."""
+
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def like(self, client, user_id, message_id, path="like"):
+        self.login(client, user_id)
+        client.post(f"/{path}/{message_id}", data={"return_to": "/trending"})
+
+    def trending_ids(self, client):
+        resp = client.get("/trending")
+        self.assertEqual(resp.status_code, 200)
+
+        with app.app_context():
+            return [id for _, id in reversed(trending.get_board().ranked())]
+
+    def test_likes_trend(self):
+        """Do likes put messages on /trending, and unlikes take them off?"""
+
+        with self.client as c:
+            for user_id in self.user_ids:
+                self.like(c, user_id, self.hot_id)
+            self.like(c, self.user_ids[0], self.old_id)
+
+            resp = c.get("/trending")
+            self.assertLess(resp.data.index(b"Hot take"), resp.data.index(b"Old news"))
+            self.assertNotIn(b"Quiet one", resp.data)
+
+            self.like(c, self.user_ids[0], self.old_id, "unlike")
+            resp = c.get("/trending")
+            self.assertNotIn(b"Old news", resp.data)
+
+            # deleted messages drop off
+            self.login(c, self.user_ids[0])
+            c.post(f"/messages/{self.hot_id}/delete")
+            resp = c.get("/trending")
+            self.assertNotIn(b"Hot take", resp.data)
+
+    def test_unlike_takes_off_its_like(self):
+        """Does an unlike take off what its like added, not a like made now?"""
+
+        hour_ago = datetime.utcnow() - timedelta(hours=1)
+        fan, other, legacy = self.user_ids
+
+        with app.app_context():
+            board = trending.get_board()
+            trending.record({(fan, self.hot_id): (True, hour_ago)})
+            trending.record({(other, self.hot_id): (True, datetime.utcnow())})
+            trending.record({(fan, self.hot_id): (False, hour_ago)})
+            score = board.scores[self.hot_id]
+            self.assertAlmostEqual(trending.likes_now(score), 1, 3)
+
+            # a like older than its timestamp: nothing known to take off
+            trending.record({(legacy, self.hot_id): (False, None)})
+            self.assertEqual(board.scores[self.hot_id], score)
+
+        with self.client as c:
+            # as if fan liked it an hour ago, and other just now
+            self.like(c, fan, self.old_id)
+            Like.query.update({"timestamp": hour_ago})
+            db.session.commit()
+            self.like(c, other, self.old_id)
+            trending.reset_board()
+            board = trending.get_board()
+            then = hour_ago.replace(tzinfo=timezone.utc).timestamp()
+            board.add(self.old_id, trending.like_weight(then))
+            board.add(self.old_id, trending.like_weight())
+
+            self.like(c, fan, self.old_id, "unlike")
+            score = board.scores[self.old_id]
+            self.assertAlmostEqual(trending.likes_now(score), 1, 3)
+
+    def test_snapshot_and_restart(self):
+        """Do snapshots store scores, and a fresh board start from them?"""
+
+        with self.client as c:
+            self.like(c, self.user_ids[0], self.old_id)
+            self.like(c, self.user_ids[1], self.hot_id)
+            self.like(c, self.user_ids[2], self.hot_id)
+
+        with app.app_context():
+            self.assertEqual(trending.snapshot(), 2)
+            scores = db.session.query(TrendingScore.message_id, TrendingScore.score)
+            stored = dict(scores)
+            self.assertEqual(set(stored), {self.old_id, self.hot_id})
+            self.assertAlmostEqual(stored[self.hot_id] - stored[self.old_id], 1, 3)
+
+            # a second snapshot adds nothing twice
+            self.assertEqual(trending.snapshot(), 0)
+            self.assertEqual(dict(scores), stored)
+
+            trending.reset_board()
+            self.assertEqual(trending.get_board().scores, stored)
+
+            # decayed scores are pruned
+            TrendingScore.query.filter_by(message_id=self.old_id).update(
+                {"score": stored[self.old_id] - 10}
+            )
+            db.session.commit()
+            trending.snapshot()
+            self.assertEqual(
+                [id for (id,) in db.session.query(TrendingScore.message_id)],
+                [self.hot_id],
+            )
+
+    def test_write_behind(self):
+        """Are buffered likes counted when they're flushed?"""
+
+        config = {
+            key: app.config[key]
+            for key in ("LIKES_WRITE_BEHIND", "LIKES_FLUSH_INTERVAL")
+        }
+        app.config["LIKES_WRITE_BEHIND"] = True
+        app.config["LIKES_FLUSH_INTERVAL"] = 3600
+
+        try:
+            with self.client as c:
+                self.like(c, self.user_ids[0], self.quiet_id)
+                self.assertEqual(self.trending_ids(c), [])
+
+            with app.app_context():
+                likes.flush()
+
+            with self.client as c:
+                self.assertEqual(self.trending_ids(c), [self.quiet_id])
+        finally:
+            app.config.update(config)
+            likes.buffer.take()
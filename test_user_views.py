@@ -32,6 +32,10 @@ db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
 
+# Fail any view that runs more queries than its @query_budget
+
+app.config['QUERY_BUDGET_ENFORCE'] = True
+
 
 def sign_up_user():
     """adds test user to database"""
@@ -0,0 +1,136 @@
+"""Current-user cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_usercache.py
+
+
+import os
+import time
+from unittest import TestCase
+
+from models import db, User, Message, FollowersFollowee, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ["DATABASE_URL"] = "postgresql:///warbler_test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from querystats import count_queries
+import usercache
+from usercache import UserCache, CachedUser
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+class UserCacheTestCase(TestCase):
+    """Tests for the LRU/TTL cache itself"""
+
+    def test_lru_eviction_and_stats(self):
+        """Does the cache evict least recently used entries and count hits?"""
+
+        cache = UserCache(maxsize=2, ttl=60)
+        cache.put(1, {"id": 1})
+        cache.put(2, {"id": 2})
+        cache.get(1)
+        cache.put(3, {"id": 3})
+
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(1), {"id": 1})
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.stats()["size"], 2)
+
+    def test_ttl_and_invalidate(self):
+        """Do entries expire and can they be invalidated?"""
+
+        cache = UserCache(ttl=0.01)
+        cache.put(1, {"id": 1})
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(1))
+
+        cache.ttl = 60
+        cache.put(1, {"id": 1})
+        cache.invalidate(1)
+        self.assertIsNone(cache.get(1))
+
+
+class CurrentUserViewsTestCase(TestCase):
+    """Tests for the cached g.user"""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        Like.query.delete()
+        Message.query.delete()
+        FollowersFollowee.query.delete()
+        User.query.delete()
+
+        user = User.signup(username="testuser", email="test@test.com",
+                           password="testuser", image_url=None)
+        db.session.commit()
+        self.user_id = user.id
+
+        usercache.cache.clear()
+        app.config["USER_CACHE_ENABLED"] = True
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config["USER_CACHE_ENABLED"] = True
+
+    def test_nav_only_page_skips_user_query(self):
+        """Once cached, does a page needing only the nav run no queries?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            c.get("/messages/new")
+            queries = count_queries(lambda: c.get("/messages/new"))
+
+        self.assertEqual(queries, 0)
+        self.assertEqual(usercache.cache.stats()["hits"], 1)
+
+    def test_profile_edit_invalidates(self):
+        """Does editing your profile refresh the cached username?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            c.get("/messages/new")
+            c.post("/users/profile", data={
+                "username": "renamed", "email": "test@test.com",
+                "image_url": "", "header_image_url": "", "bio": "",
+                "location": "", "password": "testuser"})
+
+            resp = c.get("/messages/new")
+
+        self.assertIn(b'alt="renamed"', resp.data)
+
+    def test_switch_off(self):
+        """With the cache off, is g.user a plain User again?"""
+
+        app.config["USER_CACHE_ENABLED"] = False
+
+        with app.test_request_context():
+            self.assertIsInstance(usercache.load_user(self.user_id), User)
+
+        app.config["USER_CACHE_ENABLED"] = True
+
+        with app.test_request_context():
+            self.assertIsInstance(usercache.load_user(self.user_id), CachedUser)
@@ -0,0 +1,296 @@
+"""Materialized home timelines for Warbler.
+
+Each new message is written ("fanned out") into a `timelines` row for its
+author and every follower, so the homepage is a single range read on
+(owner_id, timestamp) instead of an IN-list scan over everyone a user follows.
+
+Authors with more than TIMELINE_FANOUT_LIMIT followers are flagged
+`is_high_fanout` and skipped at write time; their recent messages are merged
+into the timeline when it is read.
+
+NB: the `follows` columns are named from the other side of the relationship:
+a row (followee_id=F, follower_id=T) means user F follows user T (see
+`User.followers` / `User.following` in models.py).
+"""
+
+import click
+from flask import current_app
+from sqlalchemy import func, literal
+from sqlalchemy.orm import contains_eager
+
+from models import db, User, Message, FollowersFollowee, TimelineEntry
+from pagination import Cursor, PREV, apply_keyset, build_page
+
+DEFAULT_FANOUT_LIMIT = 10000
+
+# How many of a followee's recent messages to copy in on a new follow.
+BACKFILL_SIZE = 100
+
+TIMELINE_COLUMNS = ["owner_id", "message_id", "author_id", "timestamp"]
+
+# Homepage page size, and the keyset its cursors are expressed in.
+PAGE_SIZE = 100
+KEY_COLUMNS = (Message.timestamp, Message.id)
+
+
+def fanout_limit():
+    """Follower count above which an author is merged in at read time."""
+
+    return current_app.config.get("TIMELINE_FANOUT_LIMIT", DEFAULT_FANOUT_LIMIT)
+
+
+def follower_ids_of(user_id):
+    """Query of ids of the users following `user_id`."""
+
+    return db.session.query(FollowersFollowee.followee_id).filter(
+        FollowersFollowee.follower_id == user_id
+    )
+
+
+def followee_ids_of(user_id):
+    """Query of ids of the users `user_id` follows."""
+
+    return db.session.query(FollowersFollowee.follower_id).filter(
+        FollowersFollowee.followee_id == user_id
+    )
+
+
+def fan_out_message(msg):
+    """Write a freshly-flushed `msg` into its author's and followers' timelines."""
+
+    db.session.add(
+        TimelineEntry(
+            owner_id=msg.user_id,
+            message_id=msg.id,
+            author_id=msg.user_id,
+            timestamp=msg.timestamp,
+        )
+    )
+
+    author = msg.user
+
+    if not author.is_high_fanout and follower_ids_of(author.id).count() > fanout_limit():
+        author.is_high_fanout = True
+
+    if author.is_high_fanout:
+        return
+
+    rows = follower_ids_of(author.id).add_columns(
+        literal(msg.id), literal(msg.user_id), literal(msg.timestamp)
+    )
+    db.session.execute(
+        TimelineEntry.__table__.insert().from_select(TIMELINE_COLUMNS, rows)
+    )
+
+
+def remove_message(msg):
+    """Remove `msg` from every timeline it was fanned out to."""
+
+    TimelineEntry.query.filter(TimelineEntry.message_id == msg.id).delete(
+        synchronize_session=False
+    )
+
+
+def backfill_follow(follower, followee, limit=BACKFILL_SIZE):
+    """Copy `followee`'s recent messages into `follower`'s timeline."""
+
+    if followee.is_high_fanout:
+        return
+
+    recent = (
+        db.session.query(
+            literal(follower.id), Message.id, Message.user_id, Message.timestamp
+        )
+        .filter(Message.user_id == followee.id)
+        .order_by(Message.timestamp.desc())
+        .limit(limit)
+    )
+    db.session.execute(
+        TimelineEntry.__table__.insert().from_select(TIMELINE_COLUMNS, recent)
+    )
+
+
+def purge_follow(follower, followee):
+    """Remove `followee`'s messages from `follower`'s timeline."""
+
+    TimelineEntry.query.filter(
+        TimelineEntry.owner_id == follower.id, TimelineEntry.author_id == followee.id
+    ).delete(synchronize_session=False)
+
+
+def message_key(msg):
+    """Sort key of a timeline message, matching KEY_COLUMNS."""
+
+    return (msg.timestamp, msg.id)
+
+
+def home_timeline(user, cursor=None, per_page=PAGE_SIZE):
+    """Return a KeysetPage of the messages for `user`'s homepage.
+
+    Reads the materialized timeline and merges in the messages of any
+    high-fanout authors `user` follows, both from the same keyset `cursor`.
+    Deleted accounts' messages are left out, though their purge may not have
+    reached the timeline yet.
+    """
+
+    cursor = cursor or Cursor()
+
+    materialized = (
+        Message.query.join(TimelineEntry, TimelineEntry.message_id == Message.id)
+        .join(Message.user)
+        .options(contains_eager(Message.user))
+        .filter(TimelineEntry.owner_id == user.id, User.deleted_at.is_(None))
+    )
+    messages = apply_keyset(
+        materialized,
+        (TimelineEntry.timestamp, TimelineEntry.message_id),
+        cursor,
+        per_page,
+    ).all()
+
+    pulled_ids = (
+        db.session.query(User.id)
+        .filter(User.is_high_fanout, User.deleted_at.is_(None))
+        .filter(User.id.in_(followee_ids_of(user.id).subquery()))
+        .all()
+    )
+
+    if pulled_ids:
+        pulled = (
+            Message.query.join(Message.user)
+            .options(contains_eager(Message.user))
+            .filter(
+                Message.user_id.in_([id for (id,) in pulled_ids]),
+                User.deleted_at.is_(None),
+            )
+        )
+        seen = {msg.id for msg in messages}
+        messages += [
+            msg
+            for msg in apply_keyset(pulled, KEY_COLUMNS, cursor, per_page)
+            if msg.id not in seen
+        ]
+        messages.sort(key=message_key, reverse=cursor.direction != PREV)
+
+    return build_page(messages, message_key, cursor, per_page)
+
+
+def version(user, cursor=None, per_page=PAGE_SIZE):
+    """A cheap stand-in for `home_timeline(user, cursor)`, for HTTP ETags.
+
+    The message ids on the page's stretch of the materialized timeline (read
+    from the timeline index, and the authors' rows to skip deleted accounts),
+    plus how many high-fanout authors get merged in and how many messages
+    they have. Changes whenever a message is added to or removed from the
+    page (merged-in messages are only counted, so one added and one deleted
+    together can go unnoticed).
+    """
+
+    cursor = cursor or Cursor()
+
+    entries = apply_keyset(
+        db.session.query(TimelineEntry.message_id)
+        .join(User, User.id == TimelineEntry.author_id)
+        .filter(TimelineEntry.owner_id == user.id, User.deleted_at.is_(None)),
+        (TimelineEntry.timestamp, TimelineEntry.message_id),
+        cursor,
+        per_page,
+    )
+
+    pulled = (
+        db.session.query(func.count(User.id), func.sum(User.messages_count))
+        .filter(User.is_high_fanout, User.deleted_at.is_(None))
+        .filter(User.id.in_(followee_ids_of(user.id).subquery()))
+        .one()
+    )
+
+    return tuple(id for (id,) in entries), tuple(pulled)
+
+
+def rebuild_timeline(user, limit=BACKFILL_SIZE):
+    """Rebuild one user's materialized timeline from `follows` and `messages`."""
+
+    TimelineEntry.query.filter(TimelineEntry.owner_id == user.id).delete(
+        synchronize_session=False
+    )
+
+    author_ids = (
+        db.session.query(User.id)
+        .filter(User.id.in_(followee_ids_of(user.id).subquery()))
+        .filter(~User.is_high_fanout)
+        .union(db.session.query(literal(user.id)))
+    )
+
+    recent = (
+        db.session.query(
+            literal(user.id), Message.id, Message.user_id, Message.timestamp
+        )
+        .filter(Message.user_id.in_(author_ids.subquery()))
+        .order_by(Message.timestamp.desc())
+        .limit(limit)
+    )
+    db.session.execute(
+        TimelineEntry.__table__.insert().from_select(TIMELINE_COLUMNS, recent)
+    )
+
+
+def rebuild_all(batch_size=500, echo=None):
+    """Recompute high-fanout flags, then rebuild every user's timeline."""
+
+    limit = fanout_limit()
+
+    follower_counts = (
+        db.session.query(FollowersFollowee.follower_id)
+        .group_by(FollowersFollowee.follower_id)
+        .having(db.func.count() > limit)
+    )
+    User.query.update({User.is_high_fanout: False}, synchronize_session=False)
+    User.query.filter(User.id.in_(follower_counts.subquery())).update(
+        {User.is_high_fanout: True}, synchronize_session=False
+    )
+    db.session.commit()
+
+    done = 0
+    last_id = 0
+
+    while True:
+        users = (
+            User.query.filter(User.id > last_id)
+            .order_by(User.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not users:
+            break
+
+        for user in users:
+            rebuild_timeline(user)
+
+        db.session.commit()
+        done += len(users)
+        last_id = users[-1].id
+
+        if echo:
+            echo(f"Rebuilt {done} timelines")
+
+    return done
+
+
+def init_app(app):
+    """Register the timeline CLI commands on `app`."""
+
+    @app.cli.command("rebuild-timelines")
+    @click.option("--user-id", type=int, help="Only rebuild this user's timeline.")
+    def rebuild_timelines_command(user_id):
+        """Rebuild (or backfill) materialized home timelines."""
+
+        if user_id:
+            user = User.query.get(user_id)
+            if not user:
+                raise click.BadParameter(f"No user #{user_id}", param_hint="--user-id")
+
+            rebuild_timeline(user)
+            db.session.commit()
+            click.echo(f"Rebuilt timeline for user #{user_id}")
+        else:
+            rebuild_all(echo=click.echo)
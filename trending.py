@@ -0,0 +1,492 @@
+"""Trending messages for Warbler.
+
+A message's trending score is its likes, each weighted by how recent it
+is: a like loses half its weight every TRENDING_HALF_LIFE seconds. Rather
+than decaying every score as time passes, scores use forward decay: a like
+at time t adds 2 ** (t / half-life), so newer likes simply count for more
+and a score only changes when the message is liked or unliked. Ordering by
+score is ordering by decayed likes at any moment, so /trending's keyset
+cursors stay valid however long a reader waits between pages. The weights
+get astronomically large, so a score is kept as log2 of the sum (see
+`log2_add`), which is also what's stored.
+
+Each process keeps the TRENDING_CAPACITY best-scoring messages in memory (a
+`TrendingBoard`), updated as likes and unlikes are applied (see likes.py),
+and /trending is served from it. A message liked while not on a full board
+takes the place of the lowest-scoring one, starting from that one's score
+("space saving"): a newcomer can be overrated by at most the lowest score
+on the board, but a message liked enough to belong is never missed.
+An unlike takes off what its like added, from the like's timestamp. Likes
+older than that column have none, and their unlikes take off nothing: a
+leftover like decays away, where taking off too much would wipe out the
+message's other likes.
+
+Every TRENDING_SNAPSHOT_INTERVAL seconds a background thread adds the
+likes this process has seen since its last snapshot into the `trending`
+table, drops rows decayed below MIN_LIKES, and reloads the board from the
+table's top. So every process's board converges on everyone's likes, and a
+restarted process starts from the last snapshot rather than an empty board
+or a scan of `likes`.
+"""
+
+import atexit
+import heapq
+import logging
+import math
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import timezone
+
+import click
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.orm import contains_eager
+
+import querystats
+from models import db, Message, TrendingScore, User
+from pagination import PREV, build_page
+
+logger = logging.getLogger("warbler.trending")
+
+DEFAULT_HALF_LIFE = 6 * 3600
+DEFAULT_CAPACITY = 10000
+DEFAULT_SNAPSHOT_INTERVAL = 30
+
+PER_PAGE = 20
+
+# Stored scores decayed below this many likes' worth are dropped
+MIN_LIKES = 0.05
+
+MERGE_CHUNK_SIZE = 500
+
+NO_SCORE = float("-inf")
+
+# /trending's keyset: best first
+KEY_COLUMNS = (TrendingScore.score, TrendingScore.message_id)
+
+
+def log2_add(a, b):
+    """log2(2 ** a + 2 ** b), without overflowing."""
+
+    if a < b:
+        a, b = b, a
+    if b == NO_SCORE:
+        return a
+    return a + math.log2(1 + 2 ** (b - a))
+
+
+def log2_sub(a, b):
+    """log2(2 ** a - 2 ** b), or NO_SCORE if that's not positive."""
+
+    if b == NO_SCORE:
+        return a
+    if b >= a:
+        return NO_SCORE
+    return a + math.log2(1 - 2 ** (b - a))
+
+
+def half_life():
+    return current_app.config.get("TRENDING_HALF_LIFE", DEFAULT_HALF_LIFE)
+
+
+def like_weight(at=None):
+    """log2 of the weight of a like at `at` (default now)."""
+
+    return (time.time() if at is None else at) / half_life()
+
+
+def likes_now(score, now=None):
+    """How many likes' worth `score` has decayed to by `now`."""
+
+    return 2 ** (score - like_weight(now))
+
+
+class TrendingBoard:
+    """The best-scoring messages, plus the changes not yet snapshotted."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.scores = {}
+        # (score, id) min-heap for eviction; stale entries are skipped
+        self.heap = []
+        # {message_id: [log2 of weight added, log2 of weight removed]}
+        self.pending = {}
+        self.version = 0
+        self._ranked = []
+        self._ranked_version = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.scores)
+
+    def _set(self, message_id, score):
+        if score == NO_SCORE:
+            self.scores.pop(message_id, None)
+        else:
+            self.scores[message_id] = score
+            heapq.heappush(self.heap, (score, message_id))
+            if len(self.heap) > 4 * self.capacity:
+                self._compact()
+        self.version += 1
+
+    def _compact(self):
+        self.heap = [(score, id) for id, score in self.scores.items()]
+        heapq.heapify(self.heap)
+
+    def _evict_lowest(self):
+        """Drop the lowest-scoring message; return its score."""
+
+        while self.heap:
+            score, message_id = heapq.heappop(self.heap)
+            if self.scores.get(message_id) == score:
+                del self.scores[message_id]
+                return score
+        return NO_SCORE
+
+    def _pend(self, message_id, removed, weight):
+        pending = self.pending.setdefault(message_id, [NO_SCORE, NO_SCORE])
+        pending[removed] = log2_add(pending[removed], weight)
+
+    def add(self, message_id, weight):
+        """Count a like of `message_id` (`weight` as from `like_weight`)."""
+
+        with self.lock:
+            self._pend(message_id, False, weight)
+
+            score = self.scores.get(message_id)
+            if score is None:
+                if len(self.scores) >= self.capacity:
+                    score = self._evict_lowest()
+                else:
+                    score = NO_SCORE
+
+            self._set(message_id, log2_add(score, weight))
+
+    def remove(self, message_id, weight):
+        """Count an unlike of `message_id`."""
+
+        with self.lock:
+            self._pend(message_id, True, weight)
+
+            if message_id in self.scores:
+                self._set(message_id, log2_sub(self.scores[message_id], weight))
+
+    def forget(self, message_id):
+        """Drop a deleted message."""
+
+        with self.lock:
+            self.pending.pop(message_id, None)
+            self._set(message_id, NO_SCORE)
+
+    def take_pending(self):
+        """Remove and return the changes since the last snapshot."""
+
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            return pending
+
+    def restore_pending(self, pending):
+        """Put back changes that failed to snapshot."""
+
+        with self.lock:
+            for message_id, (added, removed) in pending.items():
+                self._pend(message_id, False, added)
+                self._pend(message_id, True, removed)
+
+    def replace(self, scores):
+        """Reload from `scores` ({message_id: score}), keeping the changes
+        made since they were read.
+        """
+
+        with self.lock:
+            scores = dict(scores)
+            for message_id, (added, removed) in self.pending.items():
+                score = log2_add(scores.get(message_id, NO_SCORE), added)
+                scores[message_id] = log2_sub(score, removed)
+
+            best = heapq.nlargest(
+                self.capacity,
+                ((score, id) for id, score in scores.items() if score != NO_SCORE),
+            )
+            self.scores = {id: score for score, id in best}
+            self._compact()
+            self.version += 1
+
+    def ranked(self):
+        """[(score, message_id)], lowest first."""
+
+        with self.lock:
+            if self._ranked_version != self.version:
+                self._ranked = sorted(
+                    (score, id) for id, score in self.scores.items()
+                )
+                self._ranked_version = self.version
+            return self._ranked
+
+
+def keyset_page(ranked, cursor, per_page=PER_PAGE):
+    """The KeysetPage of (score, id) rows of `ranked` at `cursor`, best first."""
+
+    if cursor.direction == PREV:
+        lo = bisect_right(ranked, tuple(cursor.values))
+        rows = ranked[lo:lo + per_page + 1]
+    else:
+        if cursor.is_first_page:
+            hi = len(ranked)
+        else:
+            hi = bisect_left(ranked, tuple(cursor.values))
+        rows = ranked[max(0, hi - per_page - 1):hi][::-1]
+
+    return build_page(rows, tuple, cursor, per_page)
+
+
+##############################################################################
+# The board and its snapshots
+
+
+_board = None
+_board_lock = threading.Lock()
+_snapshotter = None
+
+
+def load_top(limit):
+    """{message_id: score} of the `limit` best-scoring stored messages."""
+
+    rows = (
+        db.session.query(TrendingScore.message_id, TrendingScore.score)
+        .order_by(TrendingScore.score.desc(), TrendingScore.message_id.desc())
+        .limit(limit)
+    )
+    return dict(rows)
+
+
+def get_board():
+    """This process's TrendingBoard, loaded from the last snapshot on first
+    use (which also starts the snapshot thread).
+    """
+
+    global _board
+
+    if _board is None:
+        with _board_lock, querystats.exempt():
+            if _board is None:
+                capacity = current_app.config.get("TRENDING_CAPACITY", DEFAULT_CAPACITY)
+                board = TrendingBoard(capacity)
+                board.replace(load_top(capacity))
+                _board = board
+        _start_snapshotter(current_app._get_current_object())
+
+    return _board
+
+
+def reset_board():
+    """Forget the in-process board (it's reloaded on next use)."""
+
+    global _board
+    _board = None
+
+
+def _merge(pending):
+    """Add `pending` changes into the stored scores (in the session's
+    transaction).
+    """
+
+    table = TrendingScore.__table__
+    ids = list(pending)
+    stored = {}
+    live = set()
+
+    for i in range(0, len(ids), MERGE_CHUNK_SIZE):
+        chunk = ids[i:i + MERGE_CHUNK_SIZE]
+        stored.update(
+            db.session.query(TrendingScore.message_id, TrendingScore.score)
+            .filter(TrendingScore.message_id.in_(chunk))
+            .with_for_update()
+        )
+
+        new_ids = [id for id in chunk if id not in stored]
+        if new_ids:
+            live.update(
+                id
+                for (id,) in db.session.query(Message.id).filter(
+                    Message.id.in_(new_ids)
+                )
+            )
+
+    updates, inserts, deletes = [], [], []
+    for message_id, (added, removed) in pending.items():
+        score = log2_add(stored.get(message_id, NO_SCORE), added)
+        score = log2_sub(score, removed)
+
+        if message_id in stored:
+            if score == NO_SCORE:
+                deletes.append(message_id)
+            else:
+                updates.append(dict(row_id=message_id, new_score=score))
+        elif message_id in live and score != NO_SCORE:
+            inserts.append(dict(message_id=message_id, score=score))
+
+    conn = db.session.connection()
+    if updates:
+        conn.execute(
+            table.update()
+            .where(table.c.message_id == bindparam("row_id"))
+            .values(score=bindparam("new_score")),
+            updates,
+        )
+    if inserts:
+        conn.execute(table.insert(), inserts)
+    for i in range(0, len(deletes), MERGE_CHUNK_SIZE):
+        chunk = deletes[i:i + MERGE_CHUNK_SIZE]
+        conn.execute(table.delete().where(table.c.message_id.in_(chunk)))
+
+
+def snapshot():
+    """Merge this process's likes since its last snapshot into the
+    `trending` table and reload the board from it; return how many
+    messages' scores were merged.
+
+    Needs an app context. If the transaction fails, the changes are kept
+    for the next snapshot.
+    """
+
+    board = get_board()
+    pending = board.take_pending()
+
+    try:
+        if pending:
+            _merge(pending)
+
+        cutoff = like_weight() + math.log2(MIN_LIKES)
+        TrendingScore.query.filter(TrendingScore.score < cutoff).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+
+        top = load_top(board.capacity)
+    except Exception:
+        db.session.rollback()
+        board.restore_pending(pending)
+        raise
+
+    board.replace(top)
+    return len(pending)
+
+
+def _snapshot_forever(app):
+    interval = app.config.get("TRENDING_SNAPSHOT_INTERVAL", DEFAULT_SNAPSHOT_INTERVAL)
+
+    while True:
+        time.sleep(interval)
+
+        with app.app_context():
+            try:
+                if _board is not None:
+                    snapshot()
+            except Exception:
+                logger.exception("Trending snapshot failed")
+            finally:
+                db.session.remove()
+
+
+def _start_snapshotter(app):
+    """Start this process's snapshot thread, unless running or turned off
+    (TRENDING_SNAPSHOT_INTERVAL of 0).
+    """
+
+    global _snapshotter
+
+    with _board_lock:
+        interval = app.config.get(
+            "TRENDING_SNAPSHOT_INTERVAL", DEFAULT_SNAPSHOT_INTERVAL
+        )
+        if _snapshotter is None and interval:
+            _snapshotter = threading.Thread(
+                target=_snapshot_forever,
+                args=(app,),
+                name="trending-snapshots",
+                daemon=True,
+            )
+            _snapshotter.start()
+            atexit.register(_snapshot_at_exit, app)
+
+
+def _snapshot_at_exit(app):
+    with app.app_context():
+        try:
+            if _board is not None:
+                snapshot()
+        except Exception:
+            logger.exception("Trending snapshot at exit failed")
+
+
+##############################################################################
+# Write path and pages
+
+
+def record(changes):
+    """Count applied likes and unlikes, {(user_id, message_id): (liked,
+    liked_at)} as returned by `Like.apply`.
+    """
+
+    if not changes:
+        return
+
+    board = get_board()
+
+    for (_, message_id), (liked, liked_at) in changes.items():
+        if liked_at is None:
+            continue
+
+        weight = like_weight(liked_at.replace(tzinfo=timezone.utc).timestamp())
+        if liked:
+            board.add(message_id, weight)
+        else:
+            board.remove(message_id, weight)
+
+
+def forget(msg):
+    """Take a message that's being deleted off the board."""
+
+    if _board is not None:
+        _board.forget(msg.id)
+
+
+def trending_page(cursor, per_page=PER_PAGE):
+    """The KeysetPage of trending Messages at `cursor`, best first (less
+    those of deleted accounts, until their purge takes them off the board).
+    """
+
+    page = keyset_page(get_board().ranked(), cursor, per_page)
+    ids = [message_id for _, message_id in page.items]
+
+    if ids:
+        messages = (
+            Message.query.join(Message.user)
+            .options(contains_eager(Message.user))
+            .filter(Message.id.in_(ids), User.deleted_at.is_(None))
+            .all()
+        )
+    else:
+        messages = []
+
+    by_id = {msg.id: msg for msg in messages}
+    page.items = [by_id[id] for id in ids if id in by_id]
+
+    return page
+
+
+def init_app(app):
+    """Add the `trending-snapshot` command."""
+
+    @app.cli.command("trending-snapshot")
+    def trending_snapshot():
+        """Prune decayed trending scores and show the top ten."""
+
+        snapshot()
+        ranked = get_board().ranked()
+        click.echo(f"{len(ranked):,} messages on the board")
+
+        for score, message_id in reversed(ranked[-10:]):
+            click.echo(f"{message_id:>10} {likes_now(score):10.1f} likes now")
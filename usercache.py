@@ -0,0 +1,179 @@
+"""Per-process cache of the logged-in user's profile row.
+
+`add_user_to_g` used to run a primary-key lookup before every request. It
+now puts a `CachedUser` in `g.user`: a stand-in carrying the user's cached
+profile fields (id, username, avatar, ...), which only loads the real `User`
+row the first time a view touches anything else (counters, relationships,
+methods). Pages that just render the nav bar never query for the user.
+
+Entries expire after USER_CACHE_TTL seconds, and the routes that change a
+user's profile or relationships call `invalidate()`. The cache is per
+process, so the TTL is what bounds staleness across workers.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import abort, current_app
+
+from models import User
+
+# Profile columns cheap and stable enough to cache (counters aren't: other
+# users' actions change them without going through this user's routes).
+CACHED_FIELDS = ("id", "username", "image_url", "header_image_url", "bio", "location")
+
+DEFAULT_SIZE = 1024
+DEFAULT_TTL = 60
+
+
+class UserCache:
+    """A bounded LRU of user snapshots, with a TTL and hit/miss counters."""
+
+    def __init__(self, maxsize=DEFAULT_SIZE, ttl=DEFAULT_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """The cached snapshot for `user_id`, or None."""
+
+        with self.lock:
+            entry = self.entries.get(user_id)
+
+            if entry is None or time.monotonic() > entry[0]:
+                self.entries.pop(user_id, None)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id, snapshot):
+        """Cache `snapshot` for `user_id`, evicting the least recently used."""
+
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + self.ttl, snapshot)
+            self.entries.move_to_end(user_id)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Forget `user_id`'s snapshot."""
+
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        """Forget everything and reset the counters."""
+
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Hit/miss counts and current size."""
+
+        with self.lock:
+            lookups = self.hits + self.misses
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                hit_ratio=self.hits / lookups if lookups else 0.0,
+                size=len(self.entries),
+            )
+
+
+class CachedUser:
+    """Stands in for a `User`, loading the row only when it's needed.
+
+    Cached fields are served from the snapshot; any other attribute
+    (counters, relationships, methods) loads the `User` row once and is
+    delegated to it. Setting attributes updates both.
+    """
+
+    def __init__(self, snapshot, user=None):
+        object.__setattr__(self, "_snapshot", snapshot)
+        object.__setattr__(self, "_user", user)
+
+    def _get_current_object(self):
+        """The real `User` row, loading it if need be."""
+
+        if self._user is None:
+            user = User.query.get(self._snapshot["id"])
+
+            if user is None or user.deleted_at is not None:
+                # deleted (by another process) since it was cached
+                cache.invalidate(self._snapshot["id"])
+                abort(404)
+
+            object.__setattr__(self, "_user", user)
+
+        return self._user
+
+    def __getattr__(self, name):
+        if name in self._snapshot:
+            return self._snapshot[name]
+        return getattr(self._get_current_object(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get_current_object(), name, value)
+        if name in self._snapshot:
+            self._snapshot[name] = value
+
+    def __eq__(self, other):
+        if isinstance(other, (User, CachedUser)):
+            return self.id == other.id
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((User, self.id))
+
+    def __repr__(self):
+        return f"<CachedUser #{self.id}: {self.username}>"
+
+
+cache = UserCache()
+
+
+def snapshot(user):
+    """The cacheable fields of `user`."""
+
+    return {field: getattr(user, field) for field in CACHED_FIELDS}
+
+
+def load_user(user_id):
+    """The user for `user_id` (a CachedUser if caching is on), or None."""
+
+    if not current_app.config.get("USER_CACHE_ENABLED", True):
+        user = User.query.get(user_id)
+        return user if user and user.deleted_at is None else None
+
+    cached = cache.get(user_id)
+    if cached is not None:
+        return CachedUser(dict(cached))
+
+    user = User.query.get(user_id)
+    if user is None or user.deleted_at is not None:
+        return None
+
+    cache.put(user_id, snapshot(user))
+    return CachedUser(snapshot(user), user)
+
+
+def invalidate(user):
+    """Drop `user` from the cache after changing their profile or follows."""
+
+    cache.invalidate(user.id)
+
+
+def init_app(app):
+    """Size the cache from `app`'s config."""
+
+    cache.maxsize = app.config.get("USER_CACHE_SIZE", DEFAULT_SIZE)
+    cache.ttl = app.config.get("USER_CACHE_TTL", DEFAULT_TTL)
@@ -0,0 +1,606 @@
+"""Warbler's pages, as the `warbler` blueprint (see `app.create_app`).
+
+WTForms is imported by the views that show a form, on first use, rather
+than when the blueprint is loaded.
+"""
+
+from flask import (
+    Blueprint,
+    abort,
+    render_template,
+    request,
+    flash,
+    redirect,
+    session,
+    g,
+    jsonify,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.expression import Tuple
+from sqlalchemy import and_
+from sqlalchemy.orm import joinedload
+from models import db, User, Message, Like, FollowersFollowee
+from httpcache import conditional, profile_version
+from querystats import query_budget
+from replicas import replica_reads
+from app import CURR_USER_KEY
+import accounts
+import counters
+import followgraph
+import fragcache
+import likes
+import pagination
+import search
+import timeline
+import trending
+import usercache
+
+bp = Blueprint("warbler", __name__)
+
+
+##############################################################################
+# User signup/login/logout
+
+
+@bp.before_app_request
+def add_user_to_g():
+    """If we're logged in, add curr user to Flask global.
+
+    This is usually a `usercache.CachedUser`, which only queries for the
+    user's row if the view needs more than their basic profile fields.
+    """
+
+    if CURR_USER_KEY in session:
+        g.user = usercache.load_user(session[CURR_USER_KEY])
+
+    else:
+        g.user = None
+
+
+def do_login(user):
+    """Log in user."""
+
+    session[CURR_USER_KEY] = user.id
+
+
+def do_logout():
+    """Logout user."""
+
+    if CURR_USER_KEY in session:
+        del session[CURR_USER_KEY]
+
+
+@bp.route("/signup", methods=["GET", "POST"])
+@query_budget(4)
+def signup():
+    """Handle user signup.
+
+    Create new user and add to DB. Redirect to home page.
+
+    If form not valid, present form.
+
+    If the there already is a user with that username: flash message
+    and re-present form.
+    """
+
+    from forms import UserAddForm
+
+    form = UserAddForm()
+
+    if form.validate_on_submit():
+        try:
+            user = User.signup(
+                username=form.data["username"],
+                password=form.data["password"],
+                email=form.data["email"],
+                image_url=form.data["image_url"],
+            )
+            db.session.commit()
+            search.user_changed(user)
+
+        except IntegrityError as e:
+            flash("Username already taken", "danger")
+            return render_template("users/signup.html", form=form)
+
+        do_login(user)
+
+        return redirect("/")
+
+    else:
+        return render_template("users/signup.html", form=form)
+
+
+@bp.route("/login", methods=["GET", "POST"])
+@query_budget(3)
+def login():
+    """Handle user login."""
+
+    from forms import LoginForm
+
+    form = LoginForm()
+
+    if form.validate_on_submit():
+        user = User.authenticate(form.data["username"], form.data["password"])
+
+        if user:
+            do_login(user)
+            flash(f"Hello, {user.username}!", "success")
+            return redirect("/")
+
+        flash("Invalid credentials.", "danger")
+
+    return render_template("users/login.html", form=form)
+
+
+@bp.route("/logout")
+def logout():
+    """Handle logout of user."""
+
+    do_logout()
+    flash("You have successfully logged out", "success")
+    return redirect("/login")
+
+
+##############################################################################
+# General user routes:
+
+
+@bp.route("/users")
+@query_budget(5)
+@replica_reads
+def list_users():
+    """Page with listing of users.
+
+    Can take a 'q' param in querystring to search by that username.
+    """
+
+    q = request.args.get("q")
+
+    if q:
+        users, page = search.search_users(q), None
+    else:
+        page = pagination.paginate(
+            User.query.filter(User.deleted_at.is_(None)), (User.id,), descending=False
+        )
+        users = page.items
+
+    followed_ids = followgraph.followed_ids_for([user.id for user in users], g.user)
+
+    return render_template(
+        "users/index.html", users=users, page=page, followed_ids=followed_ids
+    )
+
+
+@bp.route("/users/autocomplete")
+@query_budget(2)
+def autocomplete_users():
+    """JSON list of users whose username starts with the 'q' param."""
+
+    users = search.autocomplete(request.args.get("q", ""))
+
+    return jsonify(
+        users=[
+            dict(id=user.id, username=user.username, image_url=user.image_url)
+            for user in users
+        ]
+    )
+
+
+def profile_page_version(user_id):
+    """Version of a profile page: the user, and their newest message."""
+
+    user = User.query.get(user_id)
+    if user is None or user.deleted_at is not None:
+        return None
+
+    newest = (
+        db.session.query(Message.id)
+        .filter(Message.user_id == user_id)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(1)
+        .scalar()
+    )
+    return profile_version(user), newest
+
+
+@bp.route("/users/<int:user_id>")
+@query_budget(8)
+@replica_reads
+@conditional(profile_page_version)
+def users_show(user_id):
+    """Show user profile."""
+
+    user = User.get_active_or_404(user_id)
+    page = pagination.paginate(user.messages, (Message.timestamp, Message.id))
+    liked_ids = likes.liked_ids_for([msg.id for msg in page], g.user)
+
+    return render_template(
+        "users/show.html",
+        user=user,
+        messages=page.items,
+        page=page,
+        liked_ids=liked_ids,
+    )
+
+
+@bp.route("/users/<int:user_id>/following")
+@query_budget(5)
+@replica_reads
+def show_following(user_id):
+    """Show list of people this user is following."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user = User.get_active_or_404(user_id)
+    # Ordered by the follows column equal to User.id, so it's a range read
+    # of the follows primary key rather than a sort
+    page = pagination.paginate(
+        user.following.filter(User.deleted_at.is_(None)),
+        (FollowersFollowee.follower_id,),
+        descending=False,
+        key=lambda u: (u.id,),
+    )
+
+    followed_ids = followgraph.followed_ids_for([u.id for u in page], g.user)
+
+    return render_template(
+        "users/following.html",
+        user=user,
+        users=page.items,
+        page=page,
+        followed_ids=followed_ids,
+    )
+
+
+@bp.route("/users/<int:user_id>/followers")
+@query_budget(5)
+@replica_reads
+def users_followers(user_id):
+    """Show list of followers of this user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user = User.get_active_or_404(user_id)
+    page = pagination.paginate(
+        user.followers.filter(User.deleted_at.is_(None)),
+        (FollowersFollowee.followee_id,),
+        descending=False,
+        key=lambda u: (u.id,),
+    )
+
+    followed_ids = followgraph.followed_ids_for([u.id for u in page], g.user)
+
+    return render_template(
+        "users/followers.html",
+        user=user,
+        users=page.items,
+        page=page,
+        followed_ids=followed_ids,
+    )
+
+
+@bp.route("/users/follow/<int:follow_id>", methods=["POST"])
+@query_budget(8)
+def add_follow(follow_id):
+    """Add a follow for the currently-logged-in user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    followee = User.get_active_or_404(follow_id)
+    g.user.following.append(followee)
+    counters.followed(g.user, followee)
+    db.session.flush()
+    timeline.backfill_follow(g.user, followee)
+    followgraph.log_change(g.user.id, followee.id)
+    db.session.commit()
+    usercache.invalidate(g.user)
+    followgraph.followed(g.user, followee)
+
+    return redirect(f"/users/{g.user.id}/following")
+
+
+@bp.route("/users/stop-following/<int:follow_id>", methods=["POST"])
+@query_budget(8)
+def stop_following(follow_id):
+    """Have currently-logged-in-user stop following this user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    followee = User.query.get(follow_id)
+    g.user.following.remove(followee)
+    counters.unfollowed(g.user, followee)
+    timeline.purge_follow(g.user, followee)
+    followgraph.log_change(g.user.id, followee.id)
+    db.session.commit()
+    usercache.invalidate(g.user)
+    followgraph.unfollowed(g.user, followee)
+
+    return redirect(f"/users/{g.user.id}/following")
+
+
+@bp.route("/users/profile", methods=["GET", "POST"])
+@query_budget(4)
+def profile():
+    """Update profile for current user."""
+
+    from forms import EditUserForm
+
+    form = EditUserForm(obj=g.user)
+
+    if form.validate_on_submit():
+        user = User.authenticate(username=g.user.username,
+                                 password=form.data["password"])
+
+        if g.user == user:
+            # if user:
+            fragcache.forget(g.user)
+            g.user.username = request.form["username"]
+            g.user.email = request.form["email"]
+            g.user.image_url = request.form["image_url"]
+            g.user.header_image_url = request.form["header_image_url"]
+            g.user.bio = request.form["bio"]
+            g.user.location = request.form["location"]
+            db.session.commit()
+            usercache.invalidate(g.user)
+            search.user_changed(g.user)
+            return redirect(f"/users/{user.id}")
+
+        else:
+            flash("Incorrect Password", "danger")
+            return redirect("/")
+
+    # if g.user == user:
+    #     if not user:
+    #         flash("Incorrect Password", "danger")
+    #         return redirect("/")
+
+    # g.user.username = request.form["username"]
+    # g.user.email = request.form["email"]
+    # g.user.image_url = request.form["image_url"]
+    # g.user.header_image_url = request.form["header_image_url"]
+    # g.user.bio = request.form["bio"]
+    # g.user.location = request.form["location"]
+    # db.session.commit()
+    # return redirect(f"/users/{user.id}")
+
+    #     else:
+    #         flash("Incorrect Password", "danger")
+    #         return redirect("/")
+
+    return render_template("/users/edit.html", user=g.user, form=form, user_id=g.user.id)
+
+
+@bp.route("/users/delete", methods=["POST"])
+def delete_user():
+    """Delete user: their account goes now, their rows in the background."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    do_logout()
+
+    user = User.query.get_or_404(g.user.id)
+    accounts.tombstone(user)
+    db.session.commit()
+    usercache.invalidate(user)
+    search.user_removed(user.id)
+    followgraph.user_removed(user.id)
+    accounts.purge_soon()
+
+    return redirect("/signup")
+
+
+##############################################################################
+# Messages routes:
+
+
+@bp.route("/messages/new", methods=["GET", "POST"])
+@query_budget(8)
+def messages_add():
+    """Add a message:
+
+    Show form if GET. If valid, update message and redirect to user page.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    from forms import MessageForm
+
+    form = MessageForm()
+
+    if form.validate_on_submit():
+        msg = Message(text=form.data["text"])
+        g.user.messages.append(msg)
+        counters.message_added(g.user)
+        db.session.flush()
+        timeline.fan_out_message(msg)
+        db.session.commit()
+
+        return redirect(f"/users/{g.user.id}")
+
+    return render_template("messages/new.html", form=form)
+
+
+def message_page_version(message_id):
+    """Version of a message page: the message and its author."""
+
+    msg = Message.query.options(joinedload(Message.user)).get(message_id)
+    if msg is None or msg.user.deleted_at is not None:
+        return None
+
+    return msg.text, msg.timestamp, profile_version(msg.user)
+
+
+@bp.route("/messages/<int:message_id>", methods=["GET"])
+@query_budget(7)
+@replica_reads
+@conditional(message_page_version)
+def messages_show(message_id):
+    """Show a message."""
+
+    msg = Message.query.get_or_404(message_id)
+    if msg.user.deleted_at is not None:
+        abort(404)
+    liked_ids = likes.liked_ids_for([msg.id], g.user)
+
+    return render_template("messages/show.html", message=msg, liked_ids=liked_ids)
+
+
+@bp.route("/messages/<int:message_id>/delete", methods=["POST"])
+@query_budget(9)
+def messages_destroy(message_id):
+    """Delete a message."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    msg = Message.query.get(message_id)
+    fragcache.forget(msg)
+    trending.forget(msg)
+    timeline.remove_message(msg)
+    counters.message_removed(msg)
+    db.session.delete(msg)
+    db.session.commit()
+
+    return redirect(f"/users/{g.user.id}")
+
+
+@bp.route("/trending")
+@query_budget(4)
+@replica_reads
+def messages_trending():
+    """Show the messages with the most recent likes, best first."""
+
+    cursor = pagination.cursor_from_request(trending.KEY_COLUMNS)
+    page = trending.trending_page(cursor)
+    liked_ids = likes.liked_ids_for([msg.id for msg in page], g.user)
+
+    return render_template(
+        "messages/trending.html", messages=page.items, page=page, liked_ids=liked_ids
+    )
+
+
+#########################################
+# Likes
+
+
+# @bp.route("/likes/<int:message_id>", method=["POST"])
+# def like_or_unlike_a_message(message_id):
+#     return_to = request.form["return_to"]
+#     ....
+#     return redirect(return_to)
+
+
+@bp.route("/like/<int:message_id>", methods=["POST"])
+@query_budget(8)
+def like_message(message_id):
+    """adds a like to database and redirects back to previous page"""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    print("in like function")
+    likes.like(g.user, message_id)
+
+    return_to = request.form["return_to"]
+
+    return redirect(return_to)
+
+
+@bp.route("/unlike/<int:message_id>", methods=["POST"])
+@query_budget(8)
+def unlike_message(message_id):
+    """Deletes a like from the database and redirects back to previous page"""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    likes.unlike(g.user, message_id)
+
+    return_to = request.form["return_to"]
+
+    return redirect(return_to)
+
+
+@bp.route("/users/<int:user_id>/likes", methods=["GET", "POST"])
+@query_budget(5)
+@replica_reads
+def show_liked_messages(user_id):
+    """Show all of the liked messages"""
+
+    user = User.get_active_or_404(user_id)
+    # Keyed on the liked message id alone so it's a range read of the likes
+    # primary key
+    page = pagination.paginate(
+        user.liked_messages.options(joinedload(Message.user)),
+        (Like.message_id,),
+        key=lambda msg: (msg.id,),
+    )
+    liked_ids = likes.liked_ids_for([msg.id for msg in page], g.user)
+
+    return render_template(
+        "/users/likes.html",
+        user=user,
+        messages=page.items,
+        page=page,
+        liked_ids=liked_ids,
+    )
+
+
+##############################################################################
+# Homepage and error pages
+
+
+def homepage_version():
+    """Version of the homepage: the viewer's timeline page, if logged in."""
+
+    if not g.user:
+        return "anon"
+
+    cursor = pagination.cursor_from_request(timeline.KEY_COLUMNS)
+    return timeline.version(g.user, cursor)
+
+
+@bp.route("/")
+@query_budget(8)
+@replica_reads
+@conditional(homepage_version)
+def homepage():
+    """Show homepage:
+
+    - anon users: no messages
+    - logged in: most recent messages of followees, 100 per page
+    """
+
+    if g.user:
+        cursor = pagination.cursor_from_request(timeline.KEY_COLUMNS)
+        page = timeline.home_timeline(g.user, cursor)
+        liked_ids = likes.liked_ids_for([msg.id for msg in page], g.user)
+
+        return render_template(
+            "home.html", messages=page.items, page=page, liked_ids=liked_ids
+        )
+
+    else:
+        return render_template("home-anon.html")
+
+
+@bp.app_errorhandler(404)
+def page_not_found(e):
+    """404 NOT FOUND page."""
+
+    return render_template("404.html"), 404